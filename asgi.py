@@ -0,0 +1,158 @@
+"""ASGI entry point for Yandex endpoints
+
+Run with any ASGI server, Ex: uvicorn asgi:app
+"""
+import os
+import sys
+import logging
+
+import settings
+
+sys.path.append(settings.LIB_DIR)
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from lib.auth import ApiAuthError, TokenAgentOAuth
+from lib.backend import alice as backend
+
+from integrations.yandex import YandexDeviceBuilder, YandexRequest, YandexResponse
+from integrations.encoder import encode_body, splice_response
+from integrations.decoder import DecodeError
+from aio import Application, Response, TokenAuth
+from runtime import Lazy, Services
+from metrics import REGISTRY, REQUEST_LATENCY
+import drivers
+from drivers.scheduler import request_priority
+
+
+aud = "iot.vt77.com"
+logging.basicConfig(
+    format="%(asctime)-15s %(process)d %(levelname)s %(name)s %(message)s",
+    stream=sys.stdout,
+    level=getattr(settings, "LOG_LEVEL", logging.DEBUG),
+)
+logger = logging.getLogger()
+
+# Resources created on first use, see runtime.Services
+services = Services(settings, lambda: backend, validate_token=lambda token: tokens.validate_token(token))
+services.register_metrics()
+backend.connection = services.connection
+abackend = services.abackend
+catalog = services.catalog
+device_lists = services.device_lists
+resolver = services.resolver
+
+# Sync drivers calls run in backend executor
+drivers.DeviceDriver.executor = services.executor
+drivers.settings = {
+    'MQTT_HOST' : getattr(settings, "MQTT_HOST", None),
+    'MQTT_PREFIX' : getattr(settings, "MQTT_PREFIX", None),
+    'BACKEND' : backend
+}
+services.register_drivers()
+
+app = Application("alice-backend")
+
+
+@app.on_startup.append
+async def start_ingest():
+    """State feed started in worker, never blocks or fails requests"""
+    services.start_ingest()
+
+
+tokens = Lazy(lambda: TokenAgentOAuth(aud))
+auth = TokenAuth(services.token_cache, abackend, ApiAuthError)
+
+app.on_response.append(
+    lambda request, response, elapsed: REQUEST_LATENCY.observe(elapsed, request.route or "unmatched", request.method)
+)
+
+
+@app.route("/")
+async def main(request):
+    return Response("<h1>Yandex Alice integration</h1>")
+
+
+def bad_request(request, error: DecodeError) -> Response:
+    """Yandex format error for request body rejected by decoder"""
+    logger.warning("[ROUTE]Bad request: %s", error)
+    return Response.json(encode_body(dict({"request_id": request.header("X-Request-Id")}, **dict(error))), 400)
+
+
+@app.route("/metrics")
+async def metrics(request):
+    """Prometheus scrape endpoint, restrict access on proxy level"""
+    return Response(REGISTRY.render(), content_type=REGISTRY.CONTENT_TYPE)
+
+
+@app.route("/v1.0/", methods=["HEAD"])
+@auth.token_auth
+async def devices_ping(request):
+    logger.debug("[ROUTE]Ping %s", request.user.user_id)
+    return Response("OK")
+
+
+@app.route("/v1.0/user/unlink", methods=["GET"])
+@auth.token_auth
+async def devices_unlink(request):
+    """Called by yandex IoT framework on account unlink"""
+    user = request.user
+    logger.debug("[ROUTE]Unlink %s", user.user_id)
+    await abackend.user_unlink(user.user_id)
+    services.token_cache.evict_user(user.user_id)
+    catalog.invalidate(user.user_id)
+    device_lists.invalidate(user.user_id)
+    return Response.json(encode_body({"request_id": request.header("X-Request-Id")}))
+
+
+@app.route("/v1.0/user/devices", methods=["GET"])
+@auth.token_auth
+async def devices_list(request):
+    """Called by yandex IoT framework to list devices
+    See : https://yandex.ru/dev/dialogs/smart-home/doc/reference/get-devices.html
+    """
+    user = request.user
+    payload, etag = device_lists.get(
+        user.user_id,
+        await catalog.load_yandex_devices_async(user.user_id),
+        user.nickname,
+        YandexDeviceBuilder.build_many,
+    )
+    # Weak, body differs by request_id
+    headers = {"etag": f'W/"{etag}"'}
+    if request.if_none_match & {etag, "*"}:
+        return Response(b"", 304, headers=headers)
+    return Response.json(splice_response(request.header("X-Request-Id"), payload), headers=headers)
+
+
+@app.route("/v1.0/user/devices/query", methods=["POST"])
+@auth.token_auth
+async def devices_status(request):
+    """Called by yandex IoT framework to get devices status
+    See : https://yandex.ru/dev/dialogs/smart-home/doc/reference/post-devices-query.html
+    """
+    user = request.user
+    try:
+        yandex_request = YandexRequest.query(request.json)
+    except DecodeError as e:
+        return bad_request(request, e)
+    devices = await catalog.load_devices_async(user.user_id, yandex_request.device_ids)
+    ret = yandex_request.query_devices(devices)
+    await resolver.resolve_async(ret)
+    return Response.json(encode_body(YandexResponse(request.header("X-Request-Id"), ret)))
+
+
+@app.route("/v1.0/user/devices/action", methods=["POST"])
+@auth.token_auth
+async def devices_action(request):
+    """Called by yandex IoT framework to change devices state
+    See : https://yandex.ru/dev/dialogs/smart-home/doc/reference/post-action.html
+    """
+    user = request.user
+    try:
+        yandex_request = YandexRequest.action(request.json)
+    except DecodeError as e:
+        return bad_request(request, e)
+    devices = await catalog.load_devices_async(user.user_id, yandex_request.device_ids)
+    ret = yandex_request.action_devices(devices)
+    await resolver.resolve_async(ret, params={'user':user, 'priority':request_priority(len(ret))})
+    return Response.json(encode_body(YandexResponse(request.header("X-Request-Id"), ret)))
@@ -0,0 +1,62 @@
+"""Devices list construction: builder per row vs YandexDeviceBuilder.build_many
+
+Run from project root: python benchmarks/bench_build.py
+"""
+import sys
+import timeit
+
+# Project lib path
+sys.path.append("./lib")
+
+from integrations.yandex import YandexDeviceBuilder, YandexResponse
+from integrations.encoder import encode_payload
+from drivers import DeviceDriver, register_driver
+
+
+class BenchDriver(DeviceDriver):
+    name = 'bench'
+
+
+register_driver(BenchDriver())
+
+
+def catalog(count: int) -> list:
+    """Catalog rows as returned by backend.load_yandex_devices"""
+    return [
+        {
+            'device_id': i,
+            'name': f'Лампа {i}',
+            'description': 'Main lamp',
+            'room': f'Room {i % 5}',
+            'device_type': 'devices.types.light',
+            'driver': 'bench',
+            'params': {'freq': 315, 'payload': f'{10965763 + i},24'},
+            'capabilities': {'on_off': {'split': bool(i % 2)}, 'toggle': {}},
+            'properties': {'temperature': {}},
+            'device_info': {"manufacturer": "vt77", "model": "rf315sw", "hw_version": "0.1", "sw_version": "0.1"},
+        }
+        for i in range(count)
+    ]
+
+
+def per_row(rows) -> list:
+    return [YandexDeviceBuilder.from_row(row) for row in rows]
+
+
+def main(sizes=(10, 100, 10000)):
+    for count in sizes:
+        rows = catalog(count)
+        assert encode_payload(YandexResponse(None, per_row(rows))) == encode_payload(
+            YandexResponse(None, YandexDeviceBuilder.build_many(rows))
+        ), "Output differs"
+
+        number = max(1, 20000 // count)
+        baseline = min(timeit.repeat(lambda: per_row(rows), number=number, repeat=5)) / number
+        batch = min(timeit.repeat(lambda: list(YandexDeviceBuilder.build_many(rows)), number=number, repeat=5)) / number
+        print(f"{count} devices")
+        print(f"  from_row per row : {baseline * 1000:8.3f} ms")
+        print(f"  build_many       : {batch * 1000:8.3f} ms  (x{baseline / batch:.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""RF codes: codebook vs per command parsing, memory of cloned devices
+
+Run from project root: python benchmarks/bench_codebook.py
+"""
+import sys
+import json
+import timeit
+import tracemalloc
+
+# Project lib path
+sys.path.append("./lib")
+
+from drivers.codebook import Codebook, compile_code
+
+
+def rows(count: int) -> list:
+    """Actions data of cloned switches as loaded from custom_data, few distinct codes"""
+    return [json.loads(json.dumps({"on_off": [f"1096576{i % 8},24", f"1096577{i % 8},24"]})) for i in range(count)]
+
+
+def retained(build) -> int:
+    tracemalloc.start()
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def main(count: int = 50000, number: int = 100000):
+    devices = rows(count)
+    codebook = Codebook()
+    values = [d["on_off"][i % 2] for i, d in enumerate(devices[:1000])]
+
+    def parsed():
+        for value in values:
+            compile_code(value, "rfsend").wire
+
+    def compiled():
+        for value in values:
+            codebook.wire(value, "rfsend")
+
+    repeat = number // len(values)
+    baseline = min(timeit.repeat(parsed, number=repeat, repeat=3)) / number
+    cached = min(timeit.repeat(compiled, number=repeat, repeat=3)) / number
+    per_device = retained(lambda: [[compile_code(v, "rfsend") for v in d["on_off"]] for d in devices])
+    shared = retained(lambda: [[codebook.get(v, "rfsend") for v in d["on_off"]] for d in devices])
+    print(f"{count} cloned devices, {len(codebook)} distinct codes")
+    print(f"  parse per command  : {baseline * 1e9:8.0f} ns")
+    print(f"  codebook lookup    : {cached * 1e9:8.0f} ns")
+    print(f"  compiled per device: {per_device / 1024:8.0f} KiB")
+    print(f"  codebook shared    : {shared / 1024:8.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Action request decoding: typed decoder vs raw dict access
+
+Run from project root: python benchmarks/bench_decoder.py
+"""
+import sys
+import json
+import timeit
+
+# Project lib path
+sys.path.append("./lib")
+
+from integrations.decoder import DECODER
+
+
+def action_body(count: int) -> bytes:
+    """Action body for count devices as sent by Alice"""
+    return json.dumps(
+        {
+            "payload": {
+                "devices": [
+                    {
+                        "id": str(10000100 + i),
+                        "capabilities": [
+                            {"type": "devices.capabilities.on_off", "state": {"instance": "on", "value": bool(i % 2)}},
+                            {"type": "devices.capabilities.range", "state": {"instance": "brightness", "value": 50}},
+                        ],
+                        "custom_data": {"driver": "mqtt"},
+                    }
+                    for i in range(count)
+                ]
+            }
+        }
+    ).encode()
+
+
+def raw(data):
+    """Unchecked access as before: ids and sliced capability names only"""
+    return [
+        (d["id"], [(c["type"][21:], c["state"]) for c in d["capabilities"]]) for d in data["payload"]["devices"]
+    ]
+
+
+def main(count: int = 50, number: int = 2000):
+    body = action_body(count)
+    data = json.loads(body)
+    parse = min(timeit.repeat(lambda: json.loads(body), number=number, repeat=5)) / number
+    baseline = min(timeit.repeat(lambda: raw(data), number=number, repeat=5)) / number
+    decoded = min(timeit.repeat(lambda: DECODER.action(data), number=number, repeat=5)) / number
+    print(f"{count} devices action body, {len(body)} bytes")
+    print(f"  json.loads        : {parse * 1e6:8.1f} us")
+    print(f"  raw dict access   : {baseline * 1e6:8.1f} us")
+    print(f"  typed decoder     : {decoded * 1e6:8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""State ingest: topic trie vs scan of all device topics
+
+Run from project root: python benchmarks/bench_ingest.py
+"""
+import sys
+import timeit
+
+# Project lib path
+sys.path.append("./lib")
+
+from mqtt.broker import topic_matches
+from state import StateStore, StateIngest
+from state.ingest import device_routes
+
+
+def devices(count: int) -> list:
+    """Devices with json state topic and per property topics"""
+    return [
+        (
+            10000100 + i,
+            {
+                "state_topic": f"sensors/{i}",
+                "state_topics": {"power": f"plugs/{i}/power", "voltage": f"plugs/{i}/voltage"},
+            },
+        )
+        for i in range(count)
+    ]
+
+
+def main(count: int = 20000, number: int = 20000):
+    catalog = devices(count)
+    routes = [route for device_id, params in catalog for route in device_routes(device_id, params)]
+    ingest = StateIngest(StateStore(), lambda: catalog, batch_size=number + 1)
+    ingest.rebuild()
+    topics = [f"plugs/{i * 7919 % count}/power" for i in range(number)]
+
+    def scan():
+        for topic in topics[:100]:
+            [route for pattern, route in routes if topic_matches(pattern, topic)]
+
+    def ingested():
+        for topic in topics:
+            ingest.on_message(topic, b"12.5")
+        ingest.flush()
+
+    baseline = min(timeit.repeat(scan, number=1, repeat=3)) / 100
+    trie = min(timeit.repeat(ingested, number=1, repeat=3)) / number
+    print(f"{count} devices, {len(routes)} routes")
+    print(f"  scan match        : {baseline * 1e6:8.1f} us/message")
+    print(f"  trie + batch write: {trie * 1e6:8.1f} us/message ({1 / trie:,.0f} messages/s)")
+
+
+if __name__ == "__main__":
+    main()
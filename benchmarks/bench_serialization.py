@@ -0,0 +1,57 @@
+"""Devices list serialization: dict(__iter__) + json vs compiled encoders
+
+Run from project root: python benchmarks/bench_serialization.py
+"""
+import sys
+import json
+import timeit
+
+# Project lib path
+sys.path.append("./lib")
+
+from integrations.yandex import YandexDeviceBuilder, YandexResponse
+from integrations.encoder import encode_body
+from drivers import DeviceDriver, register_driver
+
+
+class BenchDriver(DeviceDriver):
+    name = 'bench'
+
+
+register_driver(BenchDriver())
+
+
+def build_devices(count: int) -> list:
+    return [
+        (
+            YandexDeviceBuilder(f'device-{i}', 'devices.types.light')
+            .with_name(f'Лампа {i}')
+            .with_room('Living room')
+            .with_description('Main lamp')
+            .with_custom_data({'driver': 'bench', 'params': {'freq': 315, 'payload': '10965763,24'}})
+            .with_capabilities({'on_off': {'split': True}, 'toggle': {}})
+            .with_properties({'temperature': {}})
+            .with_device_info({"manufacturer": "vt77", "model": "rf315sw", "hw_version": "0.1", "sw_version": "0.1"})
+        ).build()
+        for i in range(count)
+    ]
+
+
+def jsonify_body(response: YandexResponse) -> bytes:
+    """Same as flask jsonify in production mode"""
+    return (json.dumps(dict(response), ensure_ascii=True, sort_keys=True, separators=(",", ":")) + "\n").encode()
+
+
+def main(count: int = 1000, number: int = 20):
+    response = YandexResponse('request-id', build_devices(count), 'user')
+    assert jsonify_body(response) == encode_body(response), "Output differs"
+
+    baseline = min(timeit.repeat(lambda: jsonify_body(response), number=number, repeat=5)) / number
+    compiled = min(timeit.repeat(lambda: encode_body(response), number=number, repeat=5)) / number
+    print(f"{count} devices, {len(encode_body(response))} bytes")
+    print(f"  dict + json.dumps : {baseline * 1000:8.3f} ms")
+    print(f"  compiled encoders : {compiled * 1000:8.3f} ms  (x{baseline / compiled:.1f})")
+
+
+if __name__ == "__main__":
+    main()
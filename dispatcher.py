@@ -0,0 +1,57 @@
+"""Driver dispatcher daemon
+
+Owns driver connections (Ex: MQTT sessions) for all web workers of the
+host. Web workers with DISPATCHER_SOCKET setting send driver calls here,
+see lib/dispatch.
+
+Run: python dispatcher.py [--socket PATH]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+
+import settings
+
+sys.path.append(settings.LIB_DIR)
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from runtime import Services
+from dispatch import Dispatcher
+import drivers
+
+logger = logging.getLogger()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Driver dispatcher daemon")
+    parser.add_argument("--socket", default=getattr(settings, "DISPATCHER_SOCKET", None), help="unix socket path")
+    args = parser.parse_args(argv)
+    if not args.socket:
+        parser.error("socket path required: --socket or DISPATCHER_SOCKET setting")
+
+    logging.basicConfig(
+        format="%(asctime)-15s %(process)d %(levelname)s %(name)s %(message)s",
+        stream=sys.stdout,
+        level=getattr(settings, "LOG_LEVEL", logging.DEBUG),
+    )
+
+    # Backend not used by drivers in dispatcher
+    services = Services(settings, lambda: None)
+    services.register_local_drivers()
+    dispatcher = Dispatcher(drivers.DriverFactory.get, max_concurrency=getattr(settings, "DISPATCH_CONCURRENCY", 256))
+
+    async def serve():
+        server = await dispatcher.start(args.socket)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        logger.info("[DISPATCH]Stopped")
+
+
+if __name__ == "__main__":
+    main()
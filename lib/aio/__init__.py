@@ -0,0 +1,2 @@
+from .app import Application, Request, Response, HTTPError, TokenAuth
+from .backend import AsyncBackend
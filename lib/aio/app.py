@@ -0,0 +1,207 @@
+import json
+import logging
+import time
+from functools import wraps
+from integrations.decoder import invalid
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPError(Exception):
+    """Abort request with HTTP status"""
+
+    def __init__(self, status: int, message: str = ""):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Request:
+    """ASGI http request with body read"""
+
+    def __init__(self, scope: dict, body: bytes):
+        self.scope = scope
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.body = body
+        self.headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        self.user = None
+        # Matched route path, None for unknown paths
+        self.route = None
+
+    def header(self, name: str, default=None):
+        return self.headers.get(name.lower(), default)
+
+    @property
+    def if_none_match(self) -> set:
+        """Entity tags from If-None-Match header, weak prefix dropped"""
+        tags = set()
+        for tag in self.header("if-none-match", "").split(","):
+            tag = tag.strip()
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            if tag:
+                tags.add(tag.strip('"'))
+        return tags
+
+    @property
+    def json(self):
+        """Decoded body, None when empty
+
+        Raises:
+            DecodeError: malformed json, handlers answer it as Yandex error
+        """
+        if not self.body:
+            return None
+        try:
+            return json.loads(self.body)
+        except ValueError as e:
+            raise invalid("malformed json") from e
+
+
+class Response:
+    """ASGI http response"""
+
+    def __init__(self, body=b"", status: int = 200, content_type: str = "text/html; charset=utf-8", headers: dict = None):
+        self.body = body.encode() if isinstance(body, str) else body
+        self.status = status
+        self.headers = {"content-type": content_type}
+        if headers:
+            self.headers.update(headers)
+
+    @classmethod
+    def json(cls, body: bytes, status: int = 200, headers: dict = None):
+        """Response with pre-encoded json body"""
+        return cls(body, status, "application/json", headers)
+
+    async def send(self, send, head: bool = False):
+        headers = dict(self.headers, **{"content-length": str(len(self.body))})
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status,
+                "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()],
+            }
+        )
+        await send({"type": "http.response.body", "body": b"" if head else self.body})
+
+
+class Application:
+    """Minimal ASGI application: static routes, async handlers, lifespan hooks
+
+    on_response hooks called as hook(request, response, elapsed) after every
+    request, Ex: to observe latency
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.routes = {}
+        self.on_startup = []
+        self.on_shutdown = []
+        self.on_response = []
+
+    def route(self, path: str, methods=("GET",)):
+        """Register async handler(request) -> Response for path"""
+
+        def decorator(handler):
+            for method in methods:
+                self.routes[(path, method.upper())] = handler
+            return handler
+
+        return decorator
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                for hook in self.on_startup:
+                    await hook()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for hook in self.on_shutdown:
+                    await hook()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def http(self, scope, receive, send):
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        start = time.perf_counter()
+        request = Request(scope, body)
+        response = await self.dispatch(request)
+        await response.send(send, head=request.method == "HEAD")
+        for hook in self.on_response:
+            hook(request, response, time.perf_counter() - start)
+
+    async def dispatch(self, request: Request) -> Response:
+        handler = self.routes.get((request.path, request.method))
+        if not handler:
+            if any(path == request.path for path, _ in self.routes):
+                return Response("Method not allowed", 405)
+            return Response("Not found", 404)
+        request.route = request.path
+        try:
+            response = await handler(request)
+        except HTTPError as e:
+            return Response(e.message, e.status)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("[ROUTE]%s %s failed", request.method, request.path)
+            return Response("Internal server error", 500)
+        if isinstance(response, Response):
+            return response
+        return Response(response)
+
+
+class TokenAuth:
+    """Bearer token auth for async handlers
+
+    Tokens validated and cached with cache.TokenCache (same cache as wsgi
+    token_auth), users loaded with async backend. Authorized user available
+    as request.user
+    """
+
+    def __init__(self, cache, backend, auth_error=Exception):
+        """Create auth
+
+        Args:
+            cache (TokenCache): verified tokens cache, validates tokens on miss
+            backend: async backend with load_user(user_id) coroutine
+            auth_error (Exception, optional): token validation exception. Defaults to Exception.
+        """
+        self.cache = cache
+        self.backend = backend
+        self.auth_error = auth_error
+
+    async def authorize(self, request: Request):
+        header = request.header("authorization", "")
+        if not header.lower().startswith("bearer "):
+            raise HTTPError(403, "Forbidden")
+        try:
+            user = await self.cache.authorize_async(header[7:].strip(), self.backend.load_user)
+        except self.auth_error as e:
+            logger.warning("[AUTH]Token rejected: %s", e)
+            raise HTTPError(403, "Forbidden") from e
+        if not user:
+            raise HTTPError(403, "Forbidden")
+        return user
+
+    def token_auth(self, handler):
+        """Decorator for handlers requiring authorized user"""
+
+        @wraps(handler)
+        async def wrapper(request: Request):
+            request.user = await self.authorize(request)
+            return await handler(request)
+
+        return wrapper
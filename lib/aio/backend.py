@@ -0,0 +1,41 @@
+import asyncio
+from functools import partial
+
+
+class AsyncBackend:
+    """Async interface over sync backend (Ex: lib.backend.alice)
+
+    Every backend function becomes coroutine running in thread pool, so
+    event loop never blocks on database.
+    """
+
+    def __init__(self, backend, executor=None, after_call=None):
+        """Create async backend
+
+        Args:
+            backend: sync backend module or object
+            executor (Executor, optional): thread pool for backend calls. Defaults to loop default executor.
+            after_call (callable, optional): called in worker thread after every call. Ex: release DB connection
+        """
+        self.backend = backend
+        self.executor = executor
+        self.after_call = after_call
+
+    def __getattr__(self, name):
+        func = getattr(self.backend, name)
+        if not callable(func):
+            return func
+
+        def run(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if self.after_call:
+                    self.after_call()
+
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, partial(run, *args, **kwargs))
+
+        call.__name__ = name
+        return call
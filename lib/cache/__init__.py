@@ -0,0 +1,4 @@
+from .lru import LRUCache
+from .catalog import CatalogCache, Catalog
+from .responses import DeviceListCache
+from .tokens import TokenCache
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+from .lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class Catalog(tuple):
+    """User devices rows with index by device id
+
+    Partial catalog holds only rows loaded by id (see CatalogCache.load_devices)
+    and ids known to be absent for user.
+    """
+
+    def __new__(cls, rows=(), complete: bool = True, absent: frozenset = frozenset()):
+        catalog = super().__new__(cls, rows)
+        catalog.complete = complete
+        catalog.absent = absent
+        catalog.index = {str(d['device_id']): d for d in catalog}
+        return catalog
+
+    def merge(self, rows, requested) -> "Catalog":
+        """New partial catalog with rows loaded for requested ids added"""
+        rows = tuple(rows)
+        loaded = {str(d['device_id']) for d in rows}
+        absent = self.absent | frozenset(str(i) for i in requested if str(i) not in loaded)
+        return Catalog(self + rows, complete=False, absent=absent)
+
+    def missing(self, device_ids) -> list:
+        """Requested ids neither loaded nor known absent"""
+        if self.complete:
+            return []
+        return [i for i in device_ids if i not in self.index and i not in self.absent]
+
+    def subset(self, device_ids) -> dict:
+        """Rows by id for requested ids, unknown ids skipped"""
+        return {i: self.index[i] for i in device_ids if i in self.index}
+
+
+class CatalogCache:
+    """Per-user device catalog cache in front of backend.load_yandex_devices
+
+    User devices changed rarely while Alice polls query endpoint constantly,
+    so catalog loaded once and served from memory until ttl expired or
+    invalidate() called. Any code path changing user devices (unlink, device
+    write/import) should call invalidate(user_id).
+
+    With ids_loader query/action requests load only requested devices and
+    keep them as partial catalog, so cost grows with devices in request, not
+    with user home size.
+
+    Cached rows shared between requests and must not be modified.
+    """
+
+    def __init__(
+        self, loader, maxsize: int = 1024, ttl: float = 300, clock=None, async_loader=None, ids_loader=None, validator=None
+    ):
+        """Create catalog cache
+
+        Args:
+            loader (callable): loader(user_id) returns list of device rows. Ex: backend.load_yandex_devices
+            maxsize (int, optional): max users in cache. Defaults to 1024.
+            ttl (float, optional): catalog ttl in seconds. Defaults to 300.
+            clock (callable, optional): time source for tests.
+            async_loader (callable, optional): coroutine loader for async mode. Defaults to loader in thread pool.
+            ids_loader (callable, optional): ids_loader(user_id, device_ids) returns rows for requested devices only.
+            validator (CatalogValidator, optional): loaded rows checked once, violations logged only.
+        """
+        self.loader = loader
+        self.async_loader = async_loader
+        self.ids_loader = ids_loader
+        self.validator = validator
+        kwargs = {"clock": clock} if clock else {}
+        self.cache = LRUCache(maxsize, ttl, **kwargs)
+
+    def load_yandex_devices(self, user_id) -> Catalog:
+        """Load all user devices from cache or backend"""
+        generation = self.cache.generation
+        catalog = self.cache.get(user_id)
+        if catalog is None or not catalog.complete:
+            catalog = self._load(user_id)
+            self.cache.set(user_id, catalog, generation=generation)
+        return catalog
+
+    async def load_yandex_devices_async(self, user_id) -> Catalog:
+        """Async variant of load_yandex_devices"""
+        generation = self.cache.generation
+        catalog = self.cache.get(user_id)
+        if catalog is None or not catalog.complete:
+            if self.async_loader:
+                logger.debug("[CATALOG]Load devices for user %s", user_id)
+                catalog = Catalog(self._checked(await self.async_loader(user_id)))
+            else:
+                catalog = await asyncio.to_thread(self._load, user_id)
+            self.cache.set(user_id, catalog, generation=generation)
+        return catalog
+
+    def load_devices(self, user_id, device_ids: list) -> dict:
+        """Load requested user devices
+
+        Args:
+            user_id (int): user id
+            device_ids (list): requested device ids
+
+        Returns:
+            dict: rows by device id, devices not found for user skipped
+        """
+        device_ids = [str(i) for i in device_ids]
+        if not self.ids_loader:
+            return self.load_yandex_devices(user_id).subset(device_ids)
+
+        generation = self.cache.generation
+        catalog = self.cache.get(user_id)
+        if catalog is None:
+            catalog = Catalog(complete=False)
+        missing = catalog.missing(device_ids)
+        if missing:
+            logger.debug("[CATALOG]Load devices %s for user %s", missing, user_id)
+            catalog = catalog.merge(self._checked(self.ids_loader(user_id, missing)), missing)
+            self.cache.set(user_id, catalog, generation=generation)
+        return catalog.subset(device_ids)
+
+    async def load_devices_async(self, user_id, device_ids: list) -> dict:
+        """Async variant of load_devices, ids_loader runs in thread pool"""
+        device_ids = [str(i) for i in device_ids]
+        if not self.ids_loader:
+            return (await self.load_yandex_devices_async(user_id)).subset(device_ids)
+
+        generation = self.cache.generation
+        catalog = self.cache.get(user_id)
+        if catalog is None:
+            catalog = Catalog(complete=False)
+        missing = catalog.missing(device_ids)
+        if missing:
+            logger.debug("[CATALOG]Load devices %s for user %s", missing, user_id)
+            catalog = catalog.merge(self._checked(await asyncio.to_thread(self.ids_loader, user_id, missing)), missing)
+            self.cache.set(user_id, catalog, generation=generation)
+        return catalog.subset(device_ids)
+
+    def _load(self, user_id) -> Catalog:
+        logger.debug("[CATALOG]Load devices for user %s", user_id)
+        return Catalog(self._checked(self.loader(user_id)))
+
+    def _checked(self, rows):
+        # Cached rows trusted, only fresh rows checked
+        return self.validator.checked_rows(rows) if self.validator else rows
+
+    def invalidate(self, user_id):
+        """Drop user catalog. Call on unlink and every device write"""
+        if self.cache.invalidate(user_id):
+            logger.debug("[CATALOG]Invalidated user %s", user_id)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self) -> dict:
+        return self.cache.stats()
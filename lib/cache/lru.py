@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Bounded in-process cache with LRU eviction and per-entry TTL
+
+    Thread safe. Values are stored as is, so callers must treat them as
+    read only.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None, clock=time.monotonic):
+        """Create cache
+
+        Args:
+            maxsize (int): max number of entries, least recently used are evicted first
+            ttl (float, optional): entry time to live in seconds. None - never expires
+            clock (callable, optional): time source. Defaults to time.monotonic.
+        """
+        assert maxsize > 0, "maxsize should be positive"
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Bumped on every invalidation, so loads started before it are not stored
+        self._generation = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self) -> int:
+        """Invalidation counter, see set(generation=)"""
+        return self._generation
+
+    def get(self, key, default=None):
+        """Get value by key, counts hit/miss"""
+        now = self.clock()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires = entry
+                if expires is None or expires > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl: float = None, generation: int = None):
+        """Store value
+
+        Args:
+            key: cache key
+            value: value to store
+            ttl (float, optional): overrides cache default ttl for this entry
+            generation (int, optional): store only if no invalidation happened since this generation
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else self.clock() + ttl
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """Get value or load it with loader(key) and store
+
+        Loader is called outside of cache lock.
+        """
+        generation = self._generation
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader(key)
+            self.set(key, value, generation=generation)
+        return value
+
+    def invalidate(self, key) -> bool:
+        """Drop entry. Returns True if entry existed"""
+        with self._lock:
+            self._generation += 1
+            return self._data.pop(key, _MISSING) is not _MISSING
+
+    def invalidate_where(self, predicate) -> int:
+        """Drop entries which values match predicate(value). O(n), for rare operations
+
+        Returns:
+            int: number of dropped entries
+        """
+        with self._lock:
+            self._generation += 1
+            keys = [key for key, (value, _) in self._data.items() if predicate(value)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and (entry[1] is None or entry[1] > self.clock())
+
+    def stats(self) -> dict:
+        """Cache counters for monitoring/sizing"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
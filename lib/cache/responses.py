@@ -0,0 +1,47 @@
+import hashlib
+import logging
+from integrations.yandex import YandexResponse
+from integrations.encoder import encode_payload
+from .lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceListCache:
+    """Pre-encoded /v1.0/user/devices payloads per user
+
+    Entry is bound to catalog object it was built from (see CatalogCache), so
+    catalog reload or invalidation makes entry stale automatically.
+    Only request_id spliced at response time, see encoder.splice_response
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.cache = LRUCache(maxsize)
+
+    def get(self, user_id, catalog, nickname, build) -> tuple:
+        """Get encoded payload and etag for user devices list
+
+        Args:
+            user_id (int): user id
+            catalog (tuple): user catalog as returned by CatalogCache
+            nickname (str): user nickname, part of payload
+            build (callable): build(catalog) returns YandexDevice iterable, Ex: YandexDeviceBuilder.build_many
+
+        Returns:
+            tuple: (payload bytes, etag)
+        """
+        entry = self.cache.get(user_id)
+        if entry and entry[0] is catalog and entry[1] == nickname:
+            return entry[2], entry[3]
+
+        logger.debug("[DEVICES]Encode devices list for user %s", user_id)
+        payload = encode_payload(YandexResponse(None, build(catalog), nickname))
+        etag = hashlib.sha1(payload).hexdigest()
+        self.cache.set(user_id, (catalog, nickname, payload, etag))
+        return payload, etag
+
+    def invalidate(self, user_id):
+        self.cache.invalidate(user_id)
+
+    def stats(self) -> dict:
+        return self.cache.stats()
@@ -0,0 +1,109 @@
+import hashlib
+import logging
+import time
+from .lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class TokenCache:
+    """Verified bearer tokens cache
+
+    Maps token digest to validated claims and loaded user, so signature
+    check and user load done once per token, not on every Alice request.
+    Entry expires at token exp (claims.exp, unix time) or after ttl,
+    whatever comes first. Raw tokens are never stored.
+    """
+
+    def __init__(self, validate, load_user, maxsize: int = 10000, ttl: float = 300, clock=time.time):
+        """Create token cache
+
+        Args:
+            validate (callable): validate(token) returns claims with user_id, raises on invalid token
+            load_user (callable): load_user(user_id) returns user or None
+            maxsize (int, optional): max cached tokens. Defaults to 10000.
+            ttl (float, optional): max entry lifetime in seconds. Defaults to 300.
+            clock (callable, optional): wall clock to compare with exp. Defaults to time.time.
+        """
+        self.validate = validate
+        self.load_user = load_user
+        self.ttl = ttl
+        self.clock = clock
+        self.cache = LRUCache(maxsize)
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def lookup(self, token: str):
+        """Cached user for token or None"""
+        entry = self.cache.get(self.digest(token))
+        if entry is None:
+            return None
+        _, user, expires = entry
+        if expires <= self.clock():
+            return None
+        return user
+
+    def store(self, token: str, claims, user, generation: int = None):
+        """Cache validated token
+
+        Args:
+            generation (int, optional): store only if no eviction happened since
+                this cache generation, see LRUCache.set. Defaults to None.
+        """
+        now = self.clock()
+        expires = now + self.ttl
+        exp = getattr(claims, "exp", None)
+        if exp is not None:
+            expires = min(expires, float(exp))
+        if expires > now:
+            self.cache.set(self.digest(token), (claims, user, expires), ttl=expires - now, generation=generation)
+
+    def authorize(self, token: str):
+        """User for token, validated and loaded on cache miss
+
+        User evicted while loaded (Ex: unlink) is not stored back.
+
+        Raises:
+            Exception: validate exceptions on invalid token
+
+        Returns:
+            user or None if user not found
+        """
+        generation = self.cache.generation
+        user = self.lookup(token)
+        if user is None:
+            claims = self.validate(token)
+            user = self.load_user(claims.user_id)
+            if user is not None:
+                self.store(token, claims, user, generation)
+        return user
+
+    async def authorize_async(self, token: str, load_user):
+        """Async variant of authorize
+
+        Args:
+            token (str): bearer token
+            load_user (callable): load_user(user_id) coroutine, Ex: AsyncBackend.load_user
+        """
+        generation = self.cache.generation
+        user = self.lookup(token)
+        if user is None:
+            claims = self.validate(token)
+            user = await load_user(claims.user_id)
+            if user is not None:
+                self.store(token, claims, user, generation)
+        return user
+
+    def revoke(self, token: str):
+        """Forget token, next request validates it again"""
+        self.cache.invalidate(self.digest(token))
+
+    def evict_user(self, user_id):
+        """Forget all tokens of user. Call on unlink/tokens revocation"""
+        count = self.cache.invalidate_where(lambda entry: entry[0].user_id == user_id)
+        logger.debug("[AUTH]Evicted %s tokens of user %s", count, user_id)
+
+    def stats(self) -> dict:
+        return self.cache.stats()
@@ -0,0 +1,2 @@
+from .pool import ConnectionPool, ThreadConnection, PoolTimeout
+from .devices import load_yandex_devices_by_ids, load_device_params, save_yandex_devices, device_from_row, device_to_row
@@ -0,0 +1,170 @@
+import json
+import logging
+from integrations.validation import CatalogValidationError, Violation, capability_list, capability_map
+
+logger = logging.getLogger(__name__)
+
+DEVICE_COLUMNS = (
+    "device_id",
+    "name",
+    "description",
+    "room",
+    "device_type",
+    "capabilities",
+    "properties",
+    "device_info",
+    "custom_data",
+)
+
+
+def device_params(custom_data: dict) -> dict:
+    """Driver params from custom_data column: all keys but driver"""
+    return {k: v for k, v in (custom_data or {}).items() if k != "driver"}
+
+
+def device_from_row(row: dict) -> dict:
+    """Convert devices table row to backend.load_yandex_devices format
+
+    Row format as in sql/my_devices.sql: capabilities json list (see
+    capability_map), custom_data driver name with driver params.
+
+    Args:
+        row (dict): devices table row, json columns as strings
+
+    Returns:
+        dict: device data, see YandexDeviceBuilder.from_row
+    """
+    custom_data = json.loads(row["custom_data"] or "{}")
+    return {
+        "device_id": row["device_id"],
+        "name": row["name"],
+        "description": row["description"],
+        "room": row["room"],
+        "device_type": row["device_type"],
+        "driver": custom_data.get("driver"),
+        "params": device_params(custom_data),
+        "capabilities": capability_map(json.loads(row["capabilities"] or "[]")),
+        "properties": json.loads(row["properties"] or "{}"),
+        "device_info": json.loads(row["device_info"] or "null"),
+    }
+
+
+def device_to_row(device: dict) -> dict:
+    """Convert device data to devices table row, reverse of device_from_row"""
+    return {
+        "device_id": device["device_id"],
+        "name": device["name"],
+        "description": device.get("description") or "",
+        "room": device.get("room") or "",
+        "device_type": device["device_type"],
+        "capabilities": json.dumps(capability_list(device.get("capabilities"))),
+        "properties": json.dumps(device.get("properties") or {}),
+        "device_info": json.dumps(device.get("device_info")),
+        "custom_data": json.dumps(dict(device_params(device.get("params")), driver=device["driver"])),
+    }
+
+
+def save_yandex_devices(connection, user_id: int, devices: list, validator, placeholder: str = "%s") -> int:
+    """Validate and write user devices (create or update) in one transaction
+
+    Nothing written if any device invalid, owned by other user or write
+    fails (devices table is InnoDB, see sql/03-devices.sql). Invalidate
+    user catalog cache after write.
+
+    Args:
+        connection: DB-API connection
+        user_id (int): device owner
+        devices (list): devices in backend.load_yandex_devices format
+        validator (CatalogValidator): see integrations.validation
+        placeholder (str, optional): driver paramstyle placeholder. Defaults to "%s" (mysql).
+
+    Raises:
+        CatalogValidationError: with all violations found
+
+    Returns:
+        int: written devices count
+    """
+    rows = [device_to_row(d) for d in validator.validate(devices)]
+    if not rows:
+        return 0
+    columns = DEVICE_COLUMNS[1:]
+    update = "UPDATE devices SET {} WHERE device_id = {} AND user_id = {}".format(
+        ", ".join(f"{c} = {placeholder}" for c in columns), placeholder, placeholder
+    )
+    insert = "INSERT INTO devices (user_id, {}) VALUES ({})".format(
+        ", ".join(DEVICE_COLUMNS), ", ".join([placeholder] * (len(DEVICE_COLUMNS) + 1))
+    )
+    cursor = connection.cursor()
+    try:
+        owners = device_owners(cursor, [row["device_id"] for row in rows], placeholder)
+        foreign = [
+            Violation(row["device_id"], "device_id", "owned by other user")
+            for row in rows
+            if owners.get(str(row["device_id"]), user_id) != user_id
+        ]
+        if foreign:
+            raise CatalogValidationError(foreign)
+        for row in rows:
+            # device_id is global key: own row updated, new id inserted (id
+            # taken meanwhile fails on key, transaction rolled back)
+            if str(row["device_id"]) in owners:
+                cursor.execute(update, (*(row[c] for c in columns), row["device_id"], user_id))
+            else:
+                cursor.execute(insert, (user_id, *(row[c] for c in DEVICE_COLUMNS)))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    logger.debug("[DB]Saved %s devices for user %s", len(rows), user_id)
+    return len(rows)
+
+
+def device_owners(cursor, device_ids: list, placeholder: str = "%s") -> dict:
+    """Owner user_id by device id (as str) of existing devices"""
+    cursor.execute(
+        "SELECT device_id, user_id FROM devices WHERE device_id IN ({})".format(", ".join([placeholder] * len(device_ids))),
+        tuple(device_ids),
+    )
+    return {str(device_id): owner for device_id, owner in cursor.fetchall()}
+
+
+def load_yandex_devices_by_ids(connection, user_id: int, device_ids: list, placeholder: str = "%s") -> list:
+    """Load only requested user devices in one indexed query, see device_from_row
+
+    Args:
+        connection: DB-API connection
+        user_id (int): device owner
+        device_ids (list): requested ids
+        placeholder (str, optional): driver paramstyle placeholder. Defaults to "%s" (mysql).
+
+    Returns:
+        list: devices in backend.load_yandex_devices format, unknown ids skipped
+    """
+    if not device_ids:
+        return []
+    query = "SELECT {} FROM devices WHERE user_id = {} AND device_id IN ({})".format(
+        ", ".join(DEVICE_COLUMNS), placeholder, ", ".join([placeholder] * len(device_ids))
+    )
+    cursor = connection.cursor()
+    try:
+        cursor.execute(query, (user_id, *device_ids))
+        columns = [c[0] for c in cursor.description]
+        return [device_from_row(dict(zip(columns, row))) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def load_device_params(connection) -> list:
+    """Driver params of all devices, for indexes over whole catalog (Ex: state ingest)
+
+    Returns:
+        list: (device_id, params) pairs
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT device_id, custom_data FROM devices")
+        return [(device_id, device_params(json.loads(custom_data or "{}"))) for device_id, custom_data in cursor.fetchall()]
+    finally:
+        cursor.close()
@@ -0,0 +1,222 @@
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """No free connection in pool in time"""
+
+
+class ConnectionPool:
+    """Thread-safe DB-API connection pool
+
+    Connections created on demand up to size. Connection idle longer than
+    ping_interval is health checked on checkout and reconnected if stale.
+    """
+
+    def __init__(self, connect, size: int = 8, timeout: float = 5.0, ping_interval: float = 30, clock=time.monotonic):
+        """Create pool
+
+        Args:
+            connect (callable): creates new connection. Ex: lambda: mysql.connector.connect(**config)
+            size (int, optional): max connections. Defaults to 8.
+            timeout (float, optional): checkout timeout in seconds. Defaults to 5.0.
+            ping_interval (float, optional): check connections idle longer than this. Defaults to 30.
+            clock (callable, optional): time source. Defaults to time.monotonic.
+        """
+        assert size > 0, "size should be positive"
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self.clock = clock
+
+        # (connection, released_at), last released reused first
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+
+        self.checkouts = 0
+        self.timeouts = 0
+        self.reconnects = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def acquire(self, timeout: float = None):
+        """Checkout connection
+
+        Args:
+            timeout (float, optional): overrides pool checkout timeout
+
+        Raises:
+            PoolTimeout: no connection released in time
+
+        Returns:
+            connection
+        """
+        timeout = self.timeout if timeout is None else timeout
+        start = self.clock()
+        try:
+            conn, released_at = self._idle.get_nowait()
+        except queue.Empty:
+            conn, released_at = self._create_or_wait(timeout)
+
+        waited = self.clock() - start
+        if released_at is not None and self.clock() - released_at > self.ping_interval and not self.is_alive(conn):
+            logger.warning("[DB]Stale connection, reconnect")
+            conn = self._reconnect(conn)
+
+        with self._lock:
+            self._in_use += 1
+            self.checkouts += 1
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+        return conn
+
+    def release(self, conn, discard: bool = False):
+        """Return connection to pool
+
+        Args:
+            conn: connection from acquire
+            discard (bool, optional): close connection instead of reuse (Ex: on connection error)
+        """
+        if not discard:
+            try:
+                # Drop open transaction, next user should not see old snapshot
+                conn.rollback()
+            except Exception:  # pylint: disable=broad-except
+                logger.warning("[DB]Connection reset failed, discard")
+                discard = True
+
+        with self._lock:
+            self._in_use -= 1
+            if discard:
+                self._created -= 1
+
+        if discard:
+            self._close(conn)
+        else:
+            self._idle.put((conn, self.clock()))
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        """Checkout connection for with block"""
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @staticmethod
+    def is_alive(conn) -> bool:
+        """Connection health check"""
+        try:
+            if hasattr(conn, "ping"):
+                # mysql.connector raises InterfaceError if connection lost
+                conn.ping()
+            else:
+                cursor = conn.cursor()
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+                cursor.close()
+            return True
+        except Exception:  # pylint: disable=broad-except
+            return False
+
+    def stats(self) -> dict:
+        """Pool counters for monitoring"""
+        return {
+            "size": self.size,
+            "created": self._created,
+            "in_use": self._in_use,
+            "idle": self._idle.qsize(),
+            "utilisation": self._in_use / self.size,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "reconnects": self.reconnects,
+            "wait_time_total": self.wait_time_total,
+            "wait_time_max": self.wait_time_max,
+        }
+
+    def close(self):
+        """Close idle connections"""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            with self._lock:
+                self._created -= 1
+            self._close(conn)
+
+    def _create_or_wait(self, timeout: float):
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            return self._connect(), None
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty as e:
+            with self._lock:
+                self.timeouts += 1
+            raise PoolTimeout(f"No free connection in {timeout}s") from e
+
+    def _connect(self):
+        try:
+            return self.connect()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _reconnect(self, conn):
+        self._close(conn)
+        with self._lock:
+            self.reconnects += 1
+        return self._connect()
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+
+class ThreadConnection:
+    """Connection proxy checking out pooled connection per thread
+
+    For modules using single connection attribute (Ex: backend.connection).
+    Thread gets connection on first use and keeps it until release(),
+    call release at the end of request.
+    """
+
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+        self._local = threading.local()
+
+    def get(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self.pool.acquire()
+        return conn
+
+    def release(self, discard: bool = False):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            self.pool.release(conn, discard)
+
+    def reset(self):
+        """Forget connections without release. Used in forked child"""
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
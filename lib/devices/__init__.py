@@ -1,5 +1,5 @@
 from .device import Device
-from .actions import get_action_by_name,ActionResult
+from .actions import get_action_by_name,compile_action,ActionResult
 
 class DeviceException(Exception):
     """Base device exception
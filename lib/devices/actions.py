@@ -1,13 +1,46 @@
+import asyncio
+import concurrent.futures
+from types import MappingProxyType
+
+
 class DeviceAction:
-    """Handle requet to change device capability parameter"""
+    """Handle requet to change device capability parameter
+
+    Actions compiled with compile_action are shared between devices and
+    requests, so they are immutable after compile() and request templates
+    prepared in constructor.
+    """
 
     name = None
     param = None
     value = None
 
+    # Action classes by name, filled on class definition
+    registry: dict = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if not cls.__dict__.get("name"):
+            return
+        registered = DeviceAction.registry.get(cls.name)
+        if registered is not None:
+            raise TypeError(f"Action {cls.name} already registered by {registered.__qualname__}")
+        DeviceAction.registry[cls.name] = cls
+
     def __init__(self,data):
+        self._frozen = False
         self.data = data
 
+    def __setattr__(self, name, value):
+        if self.__dict__.get("_frozen"):
+            raise AttributeError(f"{type(self).__name__} is shared and can't be changed")
+        super().__setattr__(name, value)
+
+    def compile(self) -> "DeviceAction":
+        """Freeze action, see compile_action"""
+        self._frozen = True
+        return self
+
     def __iter__(self):
         yield 'param',self.param
         yield 'value',self.value
@@ -39,6 +72,10 @@ class DeviceActionOnOff(DeviceAction):
         else: 
             switch_data = [data]
         super(DeviceActionOnOff, self).__init__(switch_data)
+        on = MappingProxyType({'param': self.name, 'value': switch_data[0]})
+        # Differnt on and off values, use second value for off command
+        off = MappingProxyType({'param': self.name, 'value': switch_data[1]}) if len(switch_data) == 2 else on
+        self.templates = (off, on)
 
 
     def request(self,param:str,value):
@@ -49,18 +86,10 @@ class DeviceActionOnOff(DeviceAction):
             value (bool): True/False 
 
         Returns:
-            dict : action request
+            Mapping : action request, read-only
         """
 
-        action_value = self.data[0]
-        if len(self.data) == 2 and not value: 
-            # Differnt on and off values, use second value for off command
-            action_value = self.data[1]
-
-        return {
-            'param': self.name,
-            'value': action_value
-        }
+        return self.templates[bool(value)]
 
 
 
@@ -73,6 +102,7 @@ class DeviceActionRange(DeviceAction):
         # data in format : [up_cmd,down_cmd,set_cmd]
         # Example : [0,0,123344] - Only set supported
         super(DeviceActionRange, self).__init__(data)
+        self.template = MappingProxyType({'param': self.param, 'value': data[0]})
 
     def request(self,param:str,value:int,relative:bool=False):
         """Create range request
@@ -83,19 +113,66 @@ class DeviceActionRange(DeviceAction):
             relative (bool): set realtive to current state
 
         Returns:
-            dict : action request
+            Mapping : action request, read-only
         """
 
-        return {
-            'param': self.param,
-            'value': self.data[0]
-        }
+        return self.template
 
 
 def get_action_by_name(name, **kwargs):
-    for cls in DeviceAction.__subclasses__():
-        if cls.name == name:
-            return cls(**kwargs)
+    cls = DeviceAction.registry.get(name)
+    if cls:
+        return cls(**kwargs)
+
+
+# Compiled actions by (name, frozen spec), see compile_action
+_compiled = {}
+
+
+def _frozen(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_frozen(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _frozen(v)) for k, v in value.items()))
+    return value
+
+
+def compile_action(name: str, spec) -> DeviceAction:
+    """Shared immutable action for device action spec
+
+    Equal specs of all devices share one action instance, so action class
+    lookup and request templates built once.
+
+    Args:
+        name (str): action name. Ex: on_off
+        spec: action constructor kwargs (Ex: {'data': '10965772,24'}) or action data (Ex: '10965772,24')
+
+    Raises:
+        KeyError: action not registered
+
+    Returns:
+        DeviceAction: compiled action
+    """
+    kwargs = spec if isinstance(spec, dict) else {'data': spec}
+    key = (name, _frozen(kwargs))
+    try:
+        action = _compiled.get(key)
+    except TypeError:
+        # Unhashable spec values, compiled but not shared
+        key = action = None
+    if action is None:
+        cls = DeviceAction.registry.get(name)
+        if cls is None:
+            raise KeyError(f"Unknown action {name}")
+        action = cls(**kwargs).compile()
+        if key is not None:
+            action = _compiled.setdefault(key, action)
+    return action
+
+
+def get_actions():
+    """Registered action classes by name"""
+    return MappingProxyType(DeviceAction.registry)
 
 class ActionResult():
 
@@ -107,6 +184,8 @@ class ActionResult():
     STATUS_ERROR = "ERROR"
 
     param = None
+    # Request actually sent when merged with other ones, see CommandCoalescer
+    sent = None
 
     def __init__(self,param,status,error_code=None,error_message=None):
         self.param = param
@@ -128,4 +207,33 @@ class ActionResult():
 
 
 class QueryResult():
-    value = 1234
\ No newline at end of file
+    """Driver answer to query: current value of state instance"""
+
+    param = None
+    value = None
+
+    def __init__(self,param=None,value=None):
+        self.param = param
+        self.value = value
+
+    def __str__(self):
+        return f"(QueryResult) Param : {self.param} Value : {self.value}"
+
+
+def settle(future, result=None, error=None):
+    """Set result future outcome unless caller gave up on it (Ex: cancelled on deadline)
+
+    Args:
+        future (Future): concurrent.futures or asyncio future
+        result (optional): outcome. Defaults to None.
+        error (Exception, optional): failure, set instead of result. Defaults to None.
+    """
+    if future.done():
+        return
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except (concurrent.futures.InvalidStateError, asyncio.InvalidStateError):
+        pass
@@ -1,12 +1,18 @@
 
 
 import logging
-from drivers import DriverFactory
-from .actions import DeviceAction, get_action_by_name
+from collections import ChainMap
+from types import MappingProxyType
+# Module import: drivers imports devices.actions, names resolved at call time
+import drivers
+from metrics import DRIVER_LATENCY
+from .actions import DeviceAction, compile_action
 
 
 logger = logging.getLogger(__name__)
 
+NO_PARAMS = MappingProxyType({})
+
 class Device:
     """Base class for integrations devices """ 
     params = None #general driver command params
@@ -17,15 +23,67 @@ class Device:
         """Create device
 
         Args:
-            driver (str): driver name ex: mqtt
+            driver (str|DeviceDriver): driver name ex: mqtt or already located driver
             params (dict, optional): global params Ex : topic: /test/mqtt . Defaults to None.
             actions (dict, optional): List of actions . Ex: {on_off: 1234567 }. Defaults to None.
         """
         self.params = params
-        self.driver = DriverFactory.get(driver)
+        self.driver = driver if isinstance(driver, drivers.DeviceDriver) else drivers.DriverFactory.get(driver)
         assert driver,f"Can't find driver for {driver}"
         self.actions = actions
+        # Read-only view passed to drivers, device params never changed by requests
+        self.driver_params = MappingProxyType(params) if params else NO_PARAMS
+        # Compiled actions by name, see get_action
+        self.compiled = {}
+
+    def get_action(self, action: str) -> DeviceAction:
+        """Compiled action of device, see compile_action
+
+        Raises:
+            KeyError: action not configured for device or not registered
+        """
+        compiled = self.compiled.get(action)
+        if compiled is None:
+            compiled = self.compiled[action] = compile_action(action, self.actions[action])
+        return compiled
 
+    def driver_params_for(self, action_params: dict = None):
+        """Device params with request params layered on top, nothing copied or changed"""
+        if not action_params:
+            return self.driver_params
+        return MappingProxyType(ChainMap(action_params, self.driver_params))
+
+
+    def build_request(self,action:str, param:str, value: str=None, action_params:dict=None) -> dict:
+        """Build driver request for action. See DeviceAction
+
+        Args:
+            action (str): action name ex: on_off
+            param(str): param to change ex : on
+            value (str) : value to set ex: False
+            action_params (dict, optional): extra driver params
+
+        Returns:
+            dict: driver action kwargs, driver_params is read-only mapping
+        """
+
+        action = self.get_action(action)
+        logger.info("[DEVICE]Process action %s for param %s => %s",action.name,param,value)
+        action_request = action.request(param,value)
+        logger.debug("[DEVICE]Action request %s",action_request)
+        return dict(action_request, driver_params=self.driver_params_for(action_params))
+
+    def build_query(self,param:str, action_params:dict=None) -> dict:
+        """Build driver request for state query
+
+        Args:
+            param (str): state instance ex: on
+            action_params (dict, optional): extra driver params
+
+        Returns:
+            dict: driver query kwargs, driver_params is read-only mapping
+        """
+        return {'action': 'query', 'param': param, 'driver_params': self.driver_params_for(action_params)}
 
     def action(self,action:str, param:str, value: str=None, action_params:dict=None):
         """Process action on device. See DeviceAction
@@ -38,15 +96,15 @@ class Device:
         Returns:
             ActionResult: action result
         """
+        request = self.build_request(action,param,value,action_params)
+        with DRIVER_LATENCY.time(self.driver.name, action):
+            return self.driver.action(**request)
 
-        action = get_action_by_name(action,**self.actions[action])
-        logger.info("[DEVICE]Process action %s for param %s => %s",action.name,param,value)
-        action_request = action.request(param,value)
-        print(action_request)
-        params = self.params or {}
-        if action_params:
-            params.update(action_params)
-        return self.driver.action(**action_request, driver_params=params)
+    async def action_async(self,action:str, param:str, value: str=None, action_params:dict=None):
+        """Async variant of action, see DeviceDriver.action_async"""
+        request = self.build_request(action,param,value,action_params)
+        with DRIVER_LATENCY.time(self.driver.name, action):
+            return await self.driver.action_async(**request)
 
 
     def __iter__(self):
@@ -0,0 +1,4 @@
+from .protocol import DispatchError
+from .client import DispatcherClient
+from .server import Dispatcher
+from .remote import RemoteDriver
@@ -0,0 +1,140 @@
+import itertools
+import json
+import logging
+import socket
+import threading
+import time
+from concurrent.futures import Future
+from devices.actions import settle
+from .protocol import HEADER, MAX_BODY, CALL, RESULT, DispatchError, frame, decode_result
+
+logger = logging.getLogger(__name__)
+
+
+class DispatcherClient:
+    """Web worker connection to dispatcher, see dispatch.server
+
+    One connection per process, connected on first call. Calls pipelined:
+    frame written and future returned at once, reader thread resolves
+    futures by correlation id. Pending calls failed with ConnectionError
+    when connection lost, actions are not resent.
+    """
+
+    def __init__(self, path: str, connect_timeout: float = 1.0, retry_interval: float = 1.0, clock=time.monotonic):
+        """Create client
+
+        Args:
+            path (str): dispatcher unix socket path
+            connect_timeout (float, optional): connect timeout in seconds. Defaults to 1.0.
+            retry_interval (float, optional): no reconnect attempts for retry_interval after failed one. Defaults to 1.0.
+            clock (callable, optional): time source for tests. Defaults to time.monotonic.
+        """
+        self.path = path
+        self.connect_timeout = connect_timeout
+        self.retry_interval = retry_interval
+        self.clock = clock
+        self.pending = {}
+        self.sock = None
+        self.failed_at = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def call(self, driver: str, request: dict) -> Future:
+        """Send driver call
+
+        Args:
+            driver (str): driver name in dispatcher. Ex: mqtt
+            request (dict): json serializable action kwargs, see RemoteDriver.request
+
+        Returns:
+            Future: ActionResult/QueryResult, DispatchError or ConnectionError
+        """
+        future = Future()
+        with self._lock:
+            correlation_id = next(self._ids) % 2**32 or next(self._ids)
+            try:
+                data = frame(CALL, correlation_id, [driver, request])
+                sock = self._connected()
+                self.pending[correlation_id] = future
+                future.add_done_callback(lambda done: self._cancelled(correlation_id, done))
+                sock.sendall(data)
+            except (OSError, TypeError, ValueError) as e:
+                self.pending.pop(correlation_id, None)
+                if isinstance(e, OSError):
+                    self._lost(self.sock, e)
+                settle(future, error=e if not isinstance(e, OSError) else ConnectionError(f"dispatcher unavailable: {e}"))
+        return future
+
+    def _cancelled(self, correlation_id: int, future: Future):
+        """Drop pending call caller gave up on (Ex: RemoteDriver timeout), its result ignored"""
+        if not future.cancelled():
+            return
+        with self._lock:
+            if self.pending.get(correlation_id) is future:
+                del self.pending[correlation_id]
+
+    def _connected(self) -> socket.socket:
+        """Current connection, connects when needed. Called with lock held"""
+        if self.sock is not None:
+            return self.sock
+        if self.failed_at is not None and self.clock() - self.failed_at < self.retry_interval:
+            raise ConnectionError("dispatcher unavailable")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.connect_timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            self.failed_at = self.clock()
+            raise
+        sock.settimeout(None)
+        self.sock = sock
+        self.failed_at = None
+        logger.debug("[DISPATCH]Connected to %s", self.path)
+        threading.Thread(target=self._read, args=(sock,), name="dispatch-reader", daemon=True).start()
+        return sock
+
+    def _lost(self, sock, error: Exception):
+        """Drop connection and fail its pending calls. Called with lock held"""
+        if sock is None or self.sock is not sock:
+            return
+        logger.warning("[DISPATCH]Connection to %s lost: %s", self.path, error)
+        self.sock = None
+        sock.close()
+        pending, self.pending = self.pending, {}
+        for future in pending.values():
+            settle(future, error=ConnectionError(f"dispatcher connection lost: {error}"))
+
+    def _read(self, sock: socket.socket):
+        stream = sock.makefile("rb")
+        try:
+            while True:
+                header = stream.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    raise ConnectionError("connection closed")
+                length, correlation_id, kind = HEADER.unpack(header)
+                if length > MAX_BODY:
+                    raise ConnectionError(f"frame too large: {length}")
+                body = stream.read(length)
+                if len(body) < length:
+                    raise ConnectionError("connection closed")
+                with self._lock:
+                    future = self.pending.pop(correlation_id, None)
+                if future is None:
+                    continue
+                try:
+                    if kind == RESULT:
+                        settle(future, decode_result(json.loads(body)))
+                    else:
+                        settle(future, error=DispatchError(json.loads(body)))
+                except (ValueError, IndexError, TypeError, DispatchError) as e:
+                    settle(future, error=DispatchError(f"bad result: {e}"))
+        except (OSError, ValueError) as e:
+            with self._lock:
+                self._lost(sock, e)
+        finally:
+            stream.close()
+
+    def close(self):
+        with self._lock:
+            self._lost(self.sock, ConnectionError("client closed"))
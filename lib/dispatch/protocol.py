@@ -0,0 +1,46 @@
+"""Dispatcher frames
+
+Frame: header (body length u32, correlation id u32, kind u8) and compact
+json body. Requests and results matched by correlation id, so many
+requests in flight on one connection and results sent as they complete.
+
+Bodies:
+    CALL    [driver name, action kwargs]
+    RESULT  ["A", param, status, error_code, error_message] or ["Q", param, value]
+    ERROR   error message
+"""
+import json
+import struct
+from devices.actions import ActionResult, QueryResult
+
+HEADER = struct.Struct("<IIB")
+MAX_BODY = 16 * 1024 * 1024
+
+CALL = 1
+RESULT = 2
+ERROR = 3
+
+
+class DispatchError(Exception):
+    """Request failed in dispatcher (Ex: unknown driver, driver exception)"""
+
+
+def frame(kind: int, correlation_id: int, body) -> bytes:
+    data = json.dumps(body, separators=(",", ":")).encode()
+    return HEADER.pack(len(data), correlation_id, kind) + data
+
+
+def encode_result(result):
+    if isinstance(result, ActionResult):
+        return ["A", result.param, result.status, result.error_code, result.error_message]
+    if isinstance(result, QueryResult):
+        return ["Q", result.param, result.value]
+    raise TypeError(f"Unsupported driver result {result!r}")
+
+
+def decode_result(body):
+    if body[0] == "A":
+        return ActionResult(*body[1:])
+    if body[0] == "Q":
+        return QueryResult(*body[1:])
+    raise DispatchError(f"Unsupported result {body!r}")
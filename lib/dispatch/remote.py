@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from devices.actions import ActionResult
+from drivers.base import DeviceDriver
+
+logger = logging.getLogger(__name__)
+
+
+class RemoteDriver(DeviceDriver):
+    """Driver proxy in web worker, calls run by dispatcher process
+
+    Registered under name of real driver, so devices and resolver work as
+    with local driver. Dispatcher unavailable and timeouts reported as
+    DEVICE_UNREACHABLE action results.
+    """
+
+    DEVICE_UNREACHABLE = "DEVICE_UNREACHABLE"
+    # Driver params sent to dispatcher, others (Ex: request user) stay in worker
+    WIRE_PARAMS = ("action", "topic", "freq", "proto", "priority", "device_id", "repeats")
+
+    def __init__(self, name: str, client, timeout: float = 5.0, wire_params=WIRE_PARAMS):
+        """Create proxy
+
+        Args:
+            name (str): driver name in dispatcher. Ex: mqtt
+            client (DispatcherClient): process dispatcher connection
+            timeout (float, optional): result wait in seconds. Defaults to 5.0.
+            wire_params (tuple, optional): driver params sent to dispatcher. Defaults to WIRE_PARAMS.
+        """
+        self.name = name
+        self.client = client
+        self.timeout = timeout
+        self.wire_params = tuple(wire_params)
+
+    def request(self, action: str = None, param: str = None, value=None, data=None, driver_params=None) -> dict:
+        """Driver call kwargs sent to dispatcher, only wire_params of driver_params"""
+        request = {"param": param, "value": value}
+        if action is not None:
+            request["action"] = action
+        if data is not None:
+            request["data"] = data
+        if driver_params:
+            request["driver_params"] = {k: driver_params[k] for k in self.wire_params if k in driver_params}
+        return request
+
+    def failed(self, request: dict, message: str) -> ActionResult:
+        if request.get("action") == "query":
+            raise ConnectionError(message)
+        return ActionResult(request.get("param"), ActionResult.STATUS_ERROR, self.DEVICE_UNREACHABLE, message)
+
+    def action(self, action: str = None, param: str = None, value=None, data=None, driver_params=None) -> ActionResult:
+        """Run driver action in dispatcher, see DeviceDriver.action
+
+        Args:
+            driver_params (Mapping, optional): device and request params, see request
+        """
+        request = self.request(action, param, value, data, driver_params)
+        future = self.client.call(self.name, request)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            return self.failed(request, "Dispatcher not answered in time")
+        except ConnectionError as e:
+            return self.failed(request, str(e))
+
+    async def action_async(self, **kwargs) -> ActionResult:
+        """Async variant of action, result awaited on event loop"""
+        request = self.request(**kwargs)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(self.client.call(self.name, request)), self.timeout)
+        except asyncio.TimeoutError:
+            return self.failed(request, "Dispatcher not answered in time")
+        except ConnectionError as e:
+            return self.failed(request, str(e))
@@ -0,0 +1,92 @@
+import asyncio
+import json
+import logging
+import os
+import stat
+from .protocol import HEADER, MAX_BODY, CALL, RESULT, ERROR, frame, encode_result
+
+logger = logging.getLogger(__name__)
+
+
+class Dispatcher:
+    """Driver calls server for web workers
+
+    Owns driver connections (Ex: MQTT sessions) for all web workers of the
+    host: workers send calls over unix socket (see DispatcherClient), every
+    call runs as task with driver action_async and result sent back as soon
+    as ready, so slow device never blocks others on the same connection.
+    """
+
+    def __init__(self, get_driver, max_concurrency: int = 256):
+        """Create dispatcher
+
+        Args:
+            get_driver (callable): get_driver(name) returns driver. Ex: DriverFactory.get
+            max_concurrency (int, optional): max driver calls in progress. Defaults to 256.
+        """
+        self.get_driver = get_driver
+        self.max_concurrency = max_concurrency
+        self.limit = asyncio.Semaphore(max_concurrency)
+        self.server = None
+        self.calls = 0
+        self.errors = 0
+
+    async def start(self, path: str):
+        """Listen on unix socket, stale socket file replaced
+
+        Raises:
+            FileExistsError: path exists and is not a socket
+        """
+        try:
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise FileExistsError(f"{path} exists and is not a socket")
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        self.server = await asyncio.start_unix_server(self.handle, path)
+        logger.info("[DISPATCH]Listening on %s", path)
+        return self.server
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        tasks = set()
+        try:
+            while True:
+                length, correlation_id, kind = HEADER.unpack(await reader.readexactly(HEADER.size))
+                if length > MAX_BODY:
+                    logger.error("[DISPATCH]Frame too large: %s", length)
+                    break
+                body = await reader.readexactly(length)
+                if kind != CALL:
+                    writer.write(frame(ERROR, correlation_id, f"Unsupported frame kind {kind}"))
+                    continue
+                task = asyncio.ensure_future(self.call(writer, correlation_id, body))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def call(self, writer: asyncio.StreamWriter, correlation_id: int, body: bytes):
+        self.calls += 1
+        async with self.limit:
+            try:
+                driver_name, request = json.loads(body)
+                result = await self.get_driver(driver_name).action_async(**request)
+                response = frame(RESULT, correlation_id, encode_result(result))
+            except Exception as e:  # pylint: disable=broad-except
+                self.errors += 1
+                logger.exception("[DISPATCH]Call %s failed", correlation_id)
+                response = frame(ERROR, correlation_id, f"{type(e).__name__}: {e}")
+        if not writer.is_closing():
+            writer.write(response)
+            await writer.drain()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "errors": self.errors}
@@ -1,21 +1,32 @@
 import logging
+from types import MappingProxyType
 from .base import DeviceDriver, DriversErrorException
+from .codebook import Codebook, CodebookError
 
 drivers_cache = {}
 
 logger = logging.getLogger(__name__)
 
 def get_driver_by_name(name: str):
-    for cls in DeviceDriver.__subclasses__():
-        if cls.name == name:
-            return cls
-    return None
+    return DeviceDriver.registry.get(name)
+
+
+def get_driver_classes():
+    """Registered driver classes by name"""
+    return MappingProxyType(DeviceDriver.registry)
 
 def register_driver(driver: DeviceDriver):
         global drivers_cache
         logger.debug("Register driver %s",driver.name)
+        if isinstance(drivers_cache, MappingProxyType):
+            raise DriversErrorException('DRIVERS_FROZEN')
         drivers_cache[driver.name] = driver
 
+def freeze_drivers():
+    """Make drivers registry read only before forking workers"""
+    global drivers_cache
+    drivers_cache = MappingProxyType(dict(drivers_cache))
+
 class DriverFactory:
 
     @staticmethod
@@ -1,6 +1,12 @@
 
+import asyncio
+import logging
+from functools import partial
 from devices.actions import ActionResult, DeviceAction
 
+logger = logging.getLogger(__name__)
+
+
 class DriversErrorException(Exception):
     """Base of drivers exception"""
 
@@ -8,6 +14,21 @@ class DriversErrorException(Exception):
 class DeviceDriver:
     """Action driver"""
     name = ""
+    # Executor for sync drivers in async mode. None - event loop default executor
+    executor = None
+
+    # Driver classes by name, filled on class definition
+    registry: dict = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if not cls.__dict__.get("name"):
+            return
+        registered = DeviceDriver.registry.get(cls.name)
+        if registered is not None:
+            # Same as register_driver: latest driver wins (Ex: test mocks)
+            logger.warning("Driver %s of %s replaced by %s", cls.name, registered.__qualname__, cls.__qualname__)
+        DeviceDriver.registry[cls.name] = cls
 
     @property
     def params(self):
@@ -36,6 +57,67 @@ class DeviceDriver:
 
         return ActionResult(ActionResult.STATUS_DONE)
 
+    async def action_async(self,**kwargs) -> ActionResult:
+        """Async variant of action
+
+        Sync drivers run in thread pool (see executor), drivers with native
+        async I/O should override it.
+
+        Returns:
+            ActionResult: action result
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(self.action, **kwargs))
+
+    @property
+    def batched(self) -> bool:
+        """Driver implements action_many/query_many (Ex: gateway sends one combined message)
+
+        Resolver groups work only for batched drivers, others called per item concurrently
+        """
+        cls = type(self)
+        return cls.action_many is not DeviceDriver.action_many or cls.query_many is not DeviceDriver.query_many
+
+    def action_many(self,requests:list) -> list:
+        """Take actions for many devices in one call
+
+        Default calls action per request, override to send them at once.
+
+        Args:
+            requests (list): action kwargs per request, see Device.build_request
+
+        Returns:
+            list: ActionResult per request in requests order, exception instance for failed request
+        """
+        ret = []
+        for request in requests:
+            try:
+                ret.append(self.action(**request))
+            except Exception as e:  # pylint: disable=broad-except
+                ret.append(e)
+        return ret
+
+    def query_many(self,requests:list) -> list:
+        """Query many devices in one call, see action_many
+
+        Args:
+            requests (list): query kwargs per request, see Device.build_query
+
+        Returns:
+            list: QueryResult per request in requests order, exception instance for failed request
+        """
+        return DeviceDriver.action_many(self, requests)
+
+    async def action_many_async(self,requests:list) -> list:
+        """Async variant of action_many"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.action_many, requests)
+
+    async def query_many_async(self,requests:list) -> list:
+        """Async variant of query_many"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.query_many, requests)
+
     def load_state(self,device_id:str):
         """ Load state for device from DB """
         states = settings['backend'].get_device_state()
@@ -0,0 +1,125 @@
+import json
+import threading
+from .base import DriversErrorException
+
+
+class CodebookError(DriversErrorException):
+    pass
+
+
+class Code:
+    """Compiled gateway code, shared by all devices with the same code"""
+
+    __slots__ = ("wire", "code", "bits")
+
+    def __init__(self, wire: bytes, code: int = None, bits: int = None):
+        self.wire = wire
+        self.code = code
+        self.bits = bits
+
+    def __repr__(self):
+        return f"Code({self.wire!r})"
+
+
+def parse_rf(text: str) -> tuple:
+    """RF code and bit length from "code,bits" (Ex: "10965763,24") or "code"
+
+    Raises:
+        CodebookError: not a RF code
+    """
+    parts = text.split(",")
+    try:
+        if len(parts) > 2:
+            raise ValueError
+        code = int(parts[0])
+        bits = int(parts[1]) if len(parts) == 2 else None
+    except ValueError:
+        raise CodebookError(f"Invalid RF code {text!r}") from None
+    if code < 0 or (bits is not None and not 0 < bits <= 64):
+        raise CodebookError(f"Invalid RF code {text!r}")
+    return code, bits
+
+
+def compile_code(value, kind: str = None) -> Code:
+    """Validate command and build its wire payload
+
+    Args:
+        value (str|int|bytes|Any): command from device action. Ex: "10965763, 24"
+        kind (str, optional): sender action, rfsend codes validated and normalized. Defaults to None.
+
+    Raises:
+        CodebookError: invalid code
+
+    Returns:
+        Code: compiled code
+    """
+    if isinstance(value, bytes):
+        return Code(value)
+    if isinstance(value, bool) or not isinstance(value, (str, int)):
+        return Code(json.dumps(value).encode())
+    text = str(value).strip()
+    if not text:
+        raise CodebookError("Empty code")
+    if kind != "rfsend":
+        return Code(text.encode())
+    code, bits = parse_rf(text.replace(" ", ""))
+    wire = f"{code},{bits}" if bits is not None else str(code)
+    return Code(wire.encode(), code, bits)
+
+
+class Codebook:
+    """Process codes of all devices, each distinct code compiled once
+
+    Cloned devices (Ex: thousands of the same RF switch) and users share
+    one Code, so command costs one dict lookup and driver gets ready wire
+    payload. Codes equal after normalization share wire bytes too.
+    """
+
+    def __init__(self, maxsize: int = 65536):
+        """Create codebook
+
+        Args:
+            maxsize (int, optional): max codes kept, others compiled per command. Defaults to 65536.
+        """
+        self.maxsize = maxsize
+        # (kind, value type, value) -> Code, type keeps True, 1 and 1.0 apart
+        self.codes = {}
+        # wire -> Code, dedup of normalized codes
+        self.wires = {}
+        self._lock = threading.Lock()
+        # Approximate, for monitoring only
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, value, kind: str = None) -> Code:
+        """Compiled code of command, see compile_code
+
+        Raises:
+            CodebookError: invalid code
+        """
+        try:
+            key = (kind, type(value), value)
+            code = self.codes.get(key)
+        except TypeError:
+            # Unhashable command (Ex: list), not kept
+            return compile_code(value, kind)
+        if code is not None:
+            self.hits += 1
+            return code
+        self.misses += 1
+        code = compile_code(value, kind)
+        with self._lock:
+            if len(self.codes) < self.maxsize:
+                code = self.wires.setdefault((kind, code.wire), code)
+                self.codes[key] = code
+        return code
+
+    def wire(self, value, kind: str = None) -> bytes:
+        """Ready to send payload of command"""
+        return self.get(value, kind).wire
+
+    def __len__(self):
+        return len(self.wires)
+
+    def stats(self) -> dict:
+        return {"codes": len(self.wires), "keys": len(self.codes), "hits": self.hits, "misses": self.misses}
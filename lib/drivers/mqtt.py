@@ -1,91 +1,157 @@
+import asyncio
 import logging
-from typing import Union, List
-from .base import ActionDriver, DriversErrorException
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from devices.actions import ActionResult
+from .base import DeviceDriver, DriversErrorException
+from .codebook import Codebook
+from .scheduler import BULK
 
 logger = logging.getLogger(__name__)
 
 
-class DriverMqtt(ActionDriver):
-    name = "mqtt"
+class DriverMqtt(DeviceDriver):
+    """Publishes device commands to MQTT gateway (Ex: RF/IR transmitter)
 
-    class SenderParameters:
-        payload: Union[str, List[str]] = None
+    Device params choose topic: explicit topic, or sender action with its
+    parameter (rfsend: freq -> rf/{freq}, irsend: proto -> ir/{proto}).
+    Command from device action (Ex: RF code) is payload. Messages go through
+    shared process pool of long-lived connections (see mqtt.MqttPool), so
+    command costs one PUBLISH and its PUBACK, no connect.
 
-        def __init__(self, params: dict):
-            if isinstance(params["payload"], list):
-                self.on_off = True
-                self.payload = params["payload"]
+    With scheduler transmissions serialized per topic (gateway channel),
+    see TransmitScheduler. Request param priority (INTERACTIVE or BULK) and
+    device param repeats honoured, commands ordered per device_id param.
 
-            if isinstance(params["payload"], str):
-                self.on_off = False
-                self.payload = str(params["payload"])
+    Commands compiled to wire payloads once per distinct code, see Codebook.
+    """
 
-            assert self.payload, "payload missing or wrong type (str|list)"
+    name = "mqtt"
 
-        def __iter__(self):
-            yield "payload", self.payload
+    DEVICE_UNREACHABLE = "DEVICE_UNREACHABLE"
+    INVALID_ACTION = "INVALID_ACTION"
 
-    def __init__(
-        self,
-        action: str,
-        params: dict,
-    ):
+    def __init__(self, pool, prefix: str = None, qos: int = 1, timeout: float = 2.0, scheduler=None, codebook=None):
         """Creates MQTT action driver
 
         Args:
-            action (str): Action string [rfsend,irsend]
-            params (dict): action parameters
+            pool (MqttPool): process clients pool
+            prefix (str, optional): topics prefix. Ex: home
+            qos (int, optional): publish QoS, 0 or 1. Defaults to 1.
+            timeout (float, optional): PUBACK wait in seconds, queue wait included with scheduler. Defaults to 2.0.
+            scheduler (TransmitScheduler, optional): transmissions scheduler. Defaults to None.
+            codebook (Codebook, optional): compiled codes. Defaults to new codebook.
         """
-        self.action = action
-        self.action_params: DriverMqtt.SenderParameters = self.build_action_params(
-            action, params
-        )
-        self.state = None
-
-    def build_action_params(self, action: str, params: dict) -> SenderParameters:
-        """Validates and parses action parameters
+        self.pool = pool
+        self.scheduler = scheduler
+        self.codebook = codebook if codebook is not None else Codebook()
+        self.prefix = prefix.strip("/") if prefix else None
+        self.qos = qos
+        self.timeout = timeout
+        # Topics by device config, see topic
+        self.topics = {}
+
+    @staticmethod
+    def build_topic(action: str, freq=None, proto=None) -> str:
+        """Sender topic
 
         Args:
-            action (str): action string ['rfsend','irsend']
-            params (dict): parameters
+            action (str): sender action ['rfsend','irsend']
 
         Raises:
             DriversErrorException: On parameters error
 
         Returns:
-            (SenderParameters) parsed parameters
-
+            str: topic without prefix
         """
         if action == "rfsend":
-            self.freq = params.get("freq")
-            assert self.freq, "Missing freq parameter"
-            self.topic = f"rf/{self.freq}"
-            return DriverMqtt.SenderParameters(params)
+            if not freq:
+                raise DriversErrorException("Missing freq parameter")
+            return f"rf/{freq}"
 
         if action == "irsend":
-            self.proto = params.get("proto")
-            assert self.proto, "Missing proto parameter"
-            self.topic = f"ir/{self.proto}"
-            return DriverMqtt.SenderParameters(params)
+            if not proto:
+                raise DriversErrorException("Missing proto parameter")
+            return f"ir/{proto}"
 
         raise DriversErrorException(f"Unknown action {action}")
 
-    def action(self,device_id:str,action:str,param:str,value) -> dict:
+    def topic(self, params) -> str:
+        """Publish topic for device params, built once per device config
+
+        Raises:
+            DriversErrorException: On parameters error
+        """
+        key = (params.get("topic"), params.get("action", "rfsend"), params.get("freq"), params.get("proto"))
+        topic = self.topics.get(key)
+        if topic is None:
+            topic = key[0].strip("/") if key[0] else self.build_topic(*key[1:])
+            if self.prefix:
+                topic = f"{self.prefix}/{topic}"
+            self.topics[key] = topic
+        return topic
+
+    def publish(self, value, driver_params=None):
+        """Publish command, returns future resolved by broker acknowledgement"""
+        driver_params = driver_params or {}
+        topic = self.topic(driver_params)
+        # Explicit topic: gateway code format unknown, sent as is
+        kind = None if driver_params.get("topic") else driver_params.get("action", "rfsend")
+        payload = self.codebook.wire(value, kind)
+        logger.debug("[MQTT]Publish %s => %s", topic, payload)
+        if self.scheduler is not None:
+            return self.scheduler.submit(
+                topic,
+                payload,
+                driver_params.get("priority", BULK),
+                driver_params.get("device_id"),
+                driver_params.get("repeats"),
+            )
+        return self.pool.publish(topic, payload, self.qos)
+
+    def result(self, param: str, future) -> ActionResult:
+        """ActionResult of publish, waits acknowledgement up to timeout"""
+        try:
+            future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            return ActionResult(param, ActionResult.STATUS_ERROR, self.DEVICE_UNREACHABLE, "Gateway not acknowledged in time")
+        except ConnectionError as e:
+            return ActionResult(param, ActionResult.STATUS_ERROR, self.DEVICE_UNREACHABLE, f"Gateway unavailable: {e}")
+        return ActionResult(param, ActionResult.STATUS_DONE)
+
+    def action(self, action: str = None, param: str = None, value=None, data=None, driver_params=None) -> ActionResult:
         """Take action on device
+
         Args:
-            device_id (str): device_id to take action
-            action (str): Ex: on_off, color
-            param (str): action params Ex: 'on'
-            value (Any) : action param value Ex: False
+            action (str, optional): 'query' for state query, not supported
+            param (str): action params Ex: 'on_off'
+            value (Any) : command to publish Ex: '10965772,24'
+            data (Any, optional): not used, command is value
+            driver_params (Mapping, optional): device params Ex: {'action': 'rfsend', 'freq': 433}
+
         Returns:
-            dict: Capability with action_result field
+            ActionResult: DONE when broker acknowledged message
         """
-        action_result = {
-            "status": "DONE"
-         }
-
-        action_result = {
-            "status": "ERROR",
-            "error_code": "INVALID_ACTION",
-            "error_message": "action not supportred"
-        }
+        if action == "query":
+            raise DriversErrorException("Query not supported, state comes from device reports")
+        try:
+            future = self.publish(value, driver_params)
+        except DriversErrorException as e:
+            return ActionResult(param, ActionResult.STATUS_ERROR, self.INVALID_ACTION, str(e))
+        return self.result(param, future)
+
+    async def action_async(self, action: str = None, param: str = None, value=None, data=None, driver_params=None) -> ActionResult:
+        """Async variant of action, acknowledgement awaited on event loop"""
+        if action == "query":
+            raise DriversErrorException("Query not supported, state comes from device reports")
+        try:
+            future = self.publish(value, driver_params)
+        except DriversErrorException as e:
+            return ActionResult(param, ActionResult.STATUS_ERROR, self.INVALID_ACTION, str(e))
+        try:
+            await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            return ActionResult(param, ActionResult.STATUS_ERROR, self.DEVICE_UNREACHABLE, "Gateway not acknowledged in time")
+        except ConnectionError as e:
+            return ActionResult(param, ActionResult.STATUS_ERROR, self.DEVICE_UNREACHABLE, f"Gateway unavailable: {e}")
+        return ActionResult(param, ActionResult.STATUS_DONE)
@@ -0,0 +1,158 @@
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from metrics import TRANSMIT_WAIT
+
+logger = logging.getLogger(__name__)
+
+# Voice command for single device goes ahead of scene traffic
+INTERACTIVE = 0
+BULK = 1
+PRIORITIES = ("interactive", "bulk")
+
+Job = namedtuple("Job", ["payload", "key", "repeats", "queued", "future"])
+
+
+def request_priority(devices: int) -> int:
+    """Priority of action request by devices count, many devices is a scene"""
+    return INTERACTIVE if devices <= 1 else BULK
+
+
+class Channel:
+    """Queues of one transmitter channel, guarded by scheduler lock"""
+
+    __slots__ = ("queues", "bulk_keys", "active", "sent_at")
+
+    def __init__(self):
+        self.queues = tuple(deque() for _ in PRIORITIES)
+        # key -> jobs in bulk queue, to keep device order on promotion
+        self.bulk_keys = {}
+        self.active = False
+        self.sent_at = None
+
+    def __len__(self):
+        return sum(len(q) for q in self.queues)
+
+    def push(self, job: Job, priority: int):
+        if priority == INTERACTIVE and job.key is not None and job.key in self.bulk_keys:
+            self.promote(job.key)
+        elif priority == BULK and job.key is not None:
+            self.bulk_keys[job.key] = self.bulk_keys.get(job.key, 0) + 1
+        self.queues[priority].append(job)
+
+    def promote(self, key):
+        """Move queued bulk jobs of key to interactive queue, order kept"""
+        del self.bulk_keys[key]
+        bulk = self.queues[BULK]
+        kept = deque()
+        for job in bulk:
+            (self.queues[INTERACTIVE] if job.key == key else kept).append(job)
+        self.queues = (self.queues[INTERACTIVE], kept)
+
+    def pop(self):
+        for priority, queue in enumerate(self.queues):
+            if queue:
+                job = queue.popleft()
+                if priority == BULK and job.key is not None:
+                    count = self.bulk_keys[job.key] - 1
+                    if count:
+                        self.bulk_keys[job.key] = count
+                    else:
+                        del self.bulk_keys[job.key]
+                return job, priority
+        return None, None
+
+
+class TransmitScheduler:
+    """Serializes gateway transmissions per channel
+
+    Gateway transmits one code at a time per band, so messages for the same
+    channel (Ex: publish topic home/rf/433) sent one by one: next frame goes
+    after previous one acknowledged and gap passed, every job sent repeats
+    times. Interactive jobs go ahead of bulk ones. Jobs with the same key
+    (device) keep order: queued bulk jobs of key promoted with interactive
+    one. Job cancelled while queued (Ex: caller timed out) not sent.
+
+    Channel worker thread started on demand and exits when queue empty.
+    """
+
+    def __init__(self, send, gap: float = 0.05, repeats: int = 1, timeout: float = 2.0, sleep=time.sleep):
+        """Create scheduler
+
+        Args:
+            send (callable): send(channel, payload) -> Future of one frame (Ex: MqttPool.publish)
+            gap (float, optional): min seconds between frames of channel. Defaults to 0.05.
+            repeats (int, optional): default frames per job. Defaults to 1.
+            timeout (float, optional): frame acknowledgement wait in seconds. Defaults to 2.0.
+            sleep (callable, optional): sleep for tests. Defaults to time.sleep.
+        """
+        self.send = send
+        self.gap = gap
+        self.repeats = repeats
+        self.timeout = timeout
+        self.sleep = sleep
+        self.channels = {}
+        self._lock = threading.Lock()
+
+    def submit(self, channel: str, payload, priority: int = BULK, key=None, repeats: int = None) -> Future:
+        """Queue transmission
+
+        Args:
+            channel (str): transmitter channel
+            payload (str|bytes): frame payload
+            priority (int, optional): INTERACTIVE or BULK. Defaults to BULK.
+            key (Hashable, optional): ordering key, Ex: device id. Defaults to None.
+            repeats (int, optional): frames to send. Defaults to scheduler repeats.
+
+        Returns:
+            Future: resolved with None when all frames sent, frame error otherwise
+        """
+        future = Future()
+        job = Job(payload, key, repeats or self.repeats, time.monotonic(), future)
+        with self._lock:
+            queue = self.channels.get(channel)
+            if queue is None:
+                queue = self.channels[channel] = Channel()
+            queue.push(job, priority)
+            if queue.active:
+                return future
+            queue.active = True
+        threading.Thread(target=self._run, args=(channel, queue), name="transmit", daemon=True).start()
+        return future
+
+    def _run(self, channel: str, queue: Channel):
+        while True:
+            with self._lock:
+                job, priority = queue.pop()
+                if job is None:
+                    queue.active = False
+                    return
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            TRANSMIT_WAIT.observe(time.monotonic() - job.queued, PRIORITIES[priority])
+            try:
+                for _ in range(job.repeats):
+                    self._frame(channel, queue, job.payload)
+            except Exception as e:  # pylint: disable=broad-except
+                job.future.set_exception(e)
+            else:
+                job.future.set_result(None)
+
+    def _frame(self, channel: str, queue: Channel, payload):
+        if queue.sent_at is not None:
+            wait = queue.sent_at + self.gap - time.monotonic()
+            if wait > 0:
+                self.sleep(wait)
+        try:
+            self.send(channel, payload).result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise ConnectionError("frame not acknowledged in time") from None
+        finally:
+            queue.sent_at = time.monotonic()
+
+    def stats(self) -> dict:
+        """Queued jobs by channel"""
+        with self._lock:
+            return {channel: len(queue) for channel, queue in self.channels.items()}
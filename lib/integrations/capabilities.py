@@ -1,15 +1,34 @@
 import logging
+from types import MappingProxyType
+from .descriptor import Descriptor
 
 logger  = logging.getLogger(__name__)
 
-class Capability:
-    """Base class for capability"""
+class Capability(Descriptor):
+    """Base class for capability
+
+    Immutable and shared between devices, see get_capability_by_name.
+    Capability state of device kept by integrations.yandex.DeviceCapability
+    """
+
+    __slots__ = ("retrievable", "reportable")
 
     name:str = ""
-    retrievable: bool = False
-    reportable: bool = False
-    state:dict = None
-    action_result = None
+    # Types of state value accepted in action request, None - any
+    value_types: tuple = None
+
+    # Capability classes by name, filled on class definition
+    registry: dict = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Subclasses without own name extend parent capability
+        if not cls.__dict__.get("name"):
+            return
+        registered = Capability.registry.get(cls.name)
+        if registered is not None:
+            raise TypeError(f"Capability {cls.name} already registered by {registered.__qualname__}")
+        Capability.registry[cls.name] = cls
 
     def __init__(self, retrievable=True, reportable=False):
         self.retrievable = retrievable
@@ -31,7 +50,9 @@ class Capability:
 
 
 class CapabilityOnOff(Capability):
+    __slots__ = ("split",)
     name = "on_off"
+    value_types = (bool,)
 
     def __init__(self, split=False, **kwargs):
         self.split = split
@@ -57,22 +78,35 @@ class CapabilityOnOff(Capability):
 
 
 class CapabilityColorSettings(Capability):
+    __slots__ = ()
     name = "color_setting"
+    # rgb/temperature_k int, hsv object, scene name
+    value_types = (int, dict, str)
 
 
 class CapabilityColorRange(Capability):
+    __slots__ = ()
     name = "range"
+    value_types = (int, float)
 
 class CapabilityMode(Capability):
+    __slots__ = ()
     name = "mode"
+    value_types = (str,)
 
 class CapabilityToggle(Capability):
+    __slots__ = ()
     name = "toggle"
+    value_types = (bool,)
     def get_params(self):
         return {"instance": "backlight"}
 
 def get_capability_by_name(name, **kwargs):
-    logger.debug("Locate capability : %s",name)
-    for cls in Capability.__subclasses__():
-        if cls.name == name:
-            return cls(**kwargs)
+    cls = Capability.registry.get(name)
+    if cls:
+        return cls.shared(**kwargs)
+
+
+def get_capabilities():
+    """Registered capability classes by name"""
+    return MappingProxyType(Capability.registry)
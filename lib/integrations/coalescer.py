@@ -0,0 +1,166 @@
+import concurrent.futures
+import logging
+import threading
+from collections import namedtuple
+from devices.actions import ActionResult, settle
+from .resolve import ActionRequest
+
+logger = logging.getLogger(__name__)
+
+# Capability stand-in for YandexDevice.call with merged request
+Command = namedtuple("Command", ["name", "resolve"])
+
+
+def split(requests: list) -> int:
+    """Count of queued requests merged into next command
+
+    Relative steps not summed: drivers send one step per command (Ex: RF
+    "brighter" code), so without absolute value queued steps sent one by one.
+    """
+    if any(not request.relative for request in requests):
+        return len(requests)
+    return 1
+
+
+def merge(requests: list, last: ActionRequest = None):
+    """Net request of queued requests for one capability instance, see split
+
+    Absolute value wins over everything queued before it, later relative
+    steps added to it. Net absolute value equal to last succeeded one
+    cancels out.
+
+    Args:
+        requests (list): ActionRequest list in arrival order
+        last (ActionRequest, optional): last request sent and done. Defaults to None.
+
+    Returns:
+        ActionRequest: net request or None when nothing to send
+    """
+    absolute = None
+    has_absolute = False
+    delta = 0
+    for request in requests:
+        if request.relative:
+            delta += request.value
+        else:
+            absolute = request.value
+            has_absolute = True
+            delta = 0
+    first = requests[0]
+    if not has_absolute:
+        return first
+    value = absolute + delta if delta else absolute
+    if last is not None and not last.relative and last.value == value:
+        return None
+    return ActionRequest(first.action_name, {"instance": first.param, "value": value})
+
+
+class Chain:
+    """Commands of one device capability instance: one in flight, rest queued"""
+
+    __slots__ = ("pending", "last")
+
+    def __init__(self):
+        self.pending = []
+        # Last command done, None when unknown (Ex: last one failed)
+        self.last = None
+
+
+class CommandCoalescer:
+    """Per device capability command coalescing
+
+    First command for device capability instance sent at once. Commands
+    arriving while it is in flight queued, and when it completes queue
+    merged into one net command (see merge). So coalescing window is the
+    time of previous transmission: single commands get no extra latency,
+    bursts of absolute values (Ex: slider, toggles) become one command.
+    Relative steps sent one by one, see split.
+    Every request gets ActionResult of command it was sent with, and the
+    command itself as ActionResult.sent.
+    """
+
+    def __init__(self):
+        self.chains = {}
+        self._lock = threading.Lock()
+        # Approximate, for monitoring only
+        self.submitted = 0
+        self.sent = 0
+
+    def submit(self, key, request: ActionRequest, execute, make_future=concurrent.futures.Future):
+        """Queue action
+
+        Args:
+            key (tuple): capability instance key. Ex: (device_id, name, instance)
+            request (ActionRequest): requested action
+            execute (callable): execute(request) starts driver call, returns future of its result
+            make_future (callable, optional): result future factory. Ex: loop.create_future
+
+        Returns:
+            future: action result, ActionResult for request param
+        """
+        future = make_future()
+        self.submitted += 1
+        with self._lock:
+            chain = self.chains.get(key)
+            if chain is not None:
+                chain.pending.append((request, future, execute))
+                return future
+            chain = self.chains[key] = Chain()
+        self._run(key, chain, request, [(request, future, execute)], execute)
+        return future
+
+    def _run(self, key, chain: Chain, request: ActionRequest, batch: list, execute):
+        self.sent += 1
+        try:
+            running = execute(request)
+        except Exception as e:  # pylint: disable=broad-except
+            self._finish(key, chain, request, batch, None, e)
+            return
+        running.add_done_callback(lambda done: self._done(key, chain, request, batch, done))
+
+    def _done(self, key, chain: Chain, sent: ActionRequest, batch: list, done):
+        try:
+            result, error = done.result(), None
+        except BaseException as e:  # pylint: disable=broad-except
+            result, error = None, e
+        self._finish(key, chain, sent, batch, result, error)
+
+    def _finish(self, key, chain: Chain, sent: ActionRequest, batch: list, result, error):
+        # Only done command suppresses repeats, retry of failed one always sent
+        done = isinstance(result, ActionResult) and result.status == ActionResult.STATUS_DONE
+        chain.last = sent if done else None
+        for request, future, _ in batch:
+            if isinstance(result, ActionResult):
+                settle(future, self.result(request, sent, result.status, result.error_code, result.error_message))
+            else:
+                settle(future, result, error)
+        self._next(key, chain)
+
+    @staticmethod
+    def result(request: ActionRequest, sent: ActionRequest, *args) -> ActionResult:
+        """ActionResult for request, sent is net request it went with"""
+        ret = ActionResult(request.param, *args)
+        ret.sent = sent
+        return ret
+
+    def _next(self, key, chain: Chain):
+        """Send net command of queued requests, chain dropped when queue empty"""
+        while True:
+            with self._lock:
+                if not chain.pending:
+                    del self.chains[key]
+                    return
+                count = split([request for request, _, _ in chain.pending])
+                batch, chain.pending = chain.pending[:count], chain.pending[count:]
+            net = merge([request for request, _, _ in batch], chain.last)
+            if net is not None:
+                logger.debug("[COALESCE]%s: %s commands sent as %s", key, len(batch), net.value)
+                # Latest request params used for net command
+                self._run(key, chain, net, batch, batch[-1][2])
+                return
+            logger.debug("[COALESCE]%s: %s commands cancelled out", key, len(batch))
+            for request, future, _ in batch:
+                settle(future, self.result(request, chain.last, ActionResult.STATUS_DONE))
+
+    def stats(self) -> dict:
+        return {"submitted": self.submitted, "sent": self.sent, "coalesced": self.submitted - self.sent}
@@ -0,0 +1,159 @@
+"""Typed decoder for Yandex query/action request bodies
+
+Request checked and converted in one pass before any backend or driver
+work, so routes get typed tuples instead of raw json. Capability types
+located with table compiled from registered capabilities.
+See: https://yandex.ru/dev/dialogs/smart-home/doc/reference/post-action.html
+"""
+from collections import namedtuple
+from .capabilities import get_capabilities
+
+CAPABILITY_PREFIX = "devices.capabilities."
+
+DeviceQuery = namedtuple("DeviceQuery", ["id"])
+DeviceChange = namedtuple("DeviceChange", ["id", "capabilities"])
+CapabilityChange = namedtuple("CapabilityChange", ["type", "name", "instance", "value", "relative"])
+
+# Positional construction without namedtuple __new__ argument parsing, as namedtuple._make does
+make = tuple.__new__
+
+
+class DecodeError(ValueError):
+    """Invalid request body, Yandex error code and message"""
+
+    def __init__(self, error_code: str, error_message: str):
+        super().__init__(f"{error_code}: {error_message}")
+        self.error_code = error_code
+        self.error_message = error_message
+
+    def __iter__(self):
+        yield "error_code", self.error_code
+        yield "error_message", self.error_message
+
+    def at(self, path: str) -> "DecodeError":
+        """Same error with message prefixed by location in body"""
+        return DecodeError(self.error_code, f"{path}.{self.error_message}")
+
+
+def invalid(message: str):
+    return DecodeError("INVALID_VALUE", message)
+
+
+class RequestDecoder:
+    """Query/action body decoder
+
+    Capability table compiled on creation, capabilities registered later
+    need new decoder. Error location in body built only on error path.
+    """
+
+    def __init__(self):
+        # type string -> (capability name, accepted value types)
+        self.capabilities = {
+            CAPABILITY_PREFIX + name: (name, cls.value_types) for name, cls in get_capabilities().items()
+        }
+
+    @staticmethod
+    def device_list(data) -> list:
+        if not isinstance(data, dict):
+            raise invalid("object expected")
+        devices = data.get("devices")
+        if not isinstance(devices, list) or not devices:
+            raise invalid("devices: non empty list expected")
+        return devices
+
+    @staticmethod
+    def device_id(device) -> str:
+        if not isinstance(device, dict):
+            raise invalid("object expected")
+        device_id = device.get("id")
+        if type(device_id) not in (str, int) or device_id == "":
+            raise invalid("id: string expected")
+        return str(device_id)
+
+    def query(self, data) -> tuple:
+        """Decode devices query body
+
+        Raises:
+            DecodeError: invalid body
+
+        Returns:
+            tuple: DeviceQuery for every requested device
+        """
+        try:
+            devices = self.device_list(data)
+        except DecodeError as e:
+            raise e.at("body") from None
+        ret = []
+        for i, device in enumerate(devices):
+            try:
+                ret.append(make(DeviceQuery, (self.device_id(device),)))
+            except DecodeError as e:
+                raise e.at(f"body.devices[{i}]") from None
+        return tuple(ret)
+
+    def action(self, data) -> tuple:
+        """Decode devices action body, devices in payload (or in body root)
+
+        Raises:
+            DecodeError: invalid body, unknown capability type or bad value
+
+        Returns:
+            tuple: DeviceChange for every requested device
+        """
+        if isinstance(data, dict) and "payload" in data:
+            data, root = data["payload"], "payload"
+        else:
+            root = "body"
+        try:
+            devices = self.device_list(data)
+        except DecodeError as e:
+            raise e.at(root) from None
+        ret = []
+        for i, device in enumerate(devices):
+            try:
+                ret.append(self.device_change(device))
+            except DecodeError as e:
+                raise e.at(f"{root}.devices[{i}]") from None
+        return tuple(ret)
+
+    def device_change(self, device) -> DeviceChange:
+        device_id = self.device_id(device)
+        capabilities = device.get("capabilities")
+        if not isinstance(capabilities, list) or not capabilities:
+            raise invalid("capabilities: non empty list expected")
+        changes = []
+        for j, capability in enumerate(capabilities):
+            try:
+                changes.append(self.capability(capability))
+            except DecodeError as e:
+                raise e.at(f"capabilities[{j}]") from None
+        return make(DeviceChange, (device_id, tuple(changes)))
+
+    def capability(self, data) -> CapabilityChange:
+        """Decode single capability change: {"type": ..., "state": {"instance": ..., "value": ...}}"""
+        if not isinstance(data, dict):
+            raise invalid("object expected")
+        capability_type = data.get("type")
+        located = self.capabilities.get(capability_type)
+        if located is None:
+            raise DecodeError("INVALID_ACTION", f"type: unknown capability {capability_type}")
+        name, value_types = located
+        state = data.get("state")
+        if not isinstance(state, dict):
+            raise invalid("state: object expected")
+        instance = state.get("instance")
+        if not isinstance(instance, str) or not instance:
+            raise invalid("state.instance: string expected")
+        if "value" not in state:
+            raise invalid("state.value: required")
+        value = state["value"]
+        # Exact type, bool is not a number here
+        if value_types is not None and type(value) not in value_types:
+            raise invalid(f"state.value: {' or '.join(t.__name__ for t in value_types)} expected")
+        relative = state.get("relative", False)
+        if relative is not False and relative is not True:
+            raise invalid("state.relative: bool expected")
+        return make(CapabilityChange, (capability_type, name, instance, value, relative))
+
+
+DECODER = RequestDecoder()
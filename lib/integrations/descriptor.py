@@ -0,0 +1,49 @@
+def params_key(params: dict) -> frozenset:
+    """Hashable key of params, value types included: True, 1 and 1.0 are
+    equal dict keys but encoded differently
+
+    Raises:
+        TypeError: unhashable value (Ex: list)
+    """
+    return frozenset((name, type(value), value) for name, value in params.items())
+
+
+class Descriptor:
+    """Immutable capability/property descriptor
+
+    Descriptors do not depend on device, so instances interned by
+    (class, params) and shared between all devices and users, see shared().
+    Subclasses should declare __slots__ for own attributes.
+    """
+
+    __slots__ = ("_frozen",)
+
+    # (class, params_key) -> descriptor
+    _interned = {}
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False):
+            raise AttributeError(f"{type(self).__name__} descriptor is immutable")
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} descriptor is immutable")
+
+    @classmethod
+    def shared(cls, **params):
+        """Shared descriptor for params
+
+        Returns:
+            Descriptor: interned instance, new instance if params unhashable (Ex: lists)
+        """
+        try:
+            key = (cls, params_key(params))
+            descriptor = Descriptor._interned.get(key)
+        except TypeError:
+            key = descriptor = None
+        if descriptor is None:
+            descriptor = cls(**params)
+            object.__setattr__(descriptor, "_frozen", True)
+            if key is not None:
+                descriptor = Descriptor._interned.setdefault(key, descriptor)
+        return descriptor
@@ -0,0 +1,207 @@
+"""Compiled JSON encoders for Yandex API objects
+
+Every API class has own encoder writing JSON text straight from object
+attributes, keys emitted in sorted order as flask jsonify does. No
+intermediate dicts, generators or key sorting at runtime. Output is
+byte compatible with jsonify(dict(obj)) in production mode.
+
+Strings escaped with C accelerated json.encoder.encode_basestring_ascii,
+free-form values (custom_data, action_result) with C accelerated stdlib
+encoder. orjson is not used: it does not escape non-ASCII and formats
+floats differently, so output would not match jsonify.
+"""
+import json
+from json.encoder import encode_basestring_ascii as encode_str, c_make_encoder
+from devices.actions import ActionResult
+from metrics import SERIALIZATION_LATENCY
+from .deviceinfo import DeviceInfo
+from .yandex import YandexResponse, YandexDevice, YandexError, DeviceCapability, DeviceProperty
+
+# Same options as flask jsonify in production (non debug) mode
+JSON_OPTIONS = {"ensure_ascii": True, "sort_keys": True, "separators": (",", ":")}
+
+
+
+def _default(value):
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if c_make_encoder:
+    # Built once, JSONEncoder.encode builds new one on every call
+    _c_encode = c_make_encoder(None, _default, encode_str, None, ":", ",", True, False, True)
+
+    def encode_generic(value) -> str:
+        return "".join(_c_encode(value, 0))
+
+else:
+    encode_generic = json.JSONEncoder(**JSON_OPTIONS).encode
+
+ENCODERS = {}
+
+
+def encoder(cls):
+    """Register encoder function for class"""
+
+    def decorator(func):
+        ENCODERS[cls] = func
+        return func
+
+    return decorator
+
+
+def encode_value(value) -> str:
+    """Encode any value to JSON text"""
+    func = ENCODERS.get(type(value))
+    if func is None:
+        func = lookup_encoder(type(value))
+    return func(value)
+
+
+def lookup_encoder(cls):
+    """Encoder for subclasses of registered classes, generic encoder otherwise"""
+    func = encode_generic
+    for base in cls.__mro__[1:]:
+        if base in ENCODERS:
+            func = ENCODERS[base]
+            break
+    ENCODERS[cls] = func
+    return func
+
+
+ENCODERS.update(
+    {
+        str: encode_str,
+        int: int.__repr__,
+        bool: lambda value: "true" if value else "false",
+        type(None): lambda value: "null",
+    }
+)
+
+
+def encode(obj) -> bytes:
+    """Encode object to JSON bytes"""
+    return encode_value(obj).encode()
+
+
+@encoder(DeviceInfo)
+def encode_device_info(info: DeviceInfo) -> str:
+    return '{"hw_version":%s,"manufacturer":%s,"model":%s,"sw_version":%s}' % (
+        encode_value(info.hw_version),
+        encode_value(info.manufacturer),
+        encode_value(info.model),
+        encode_value(info.sw_version),
+    )
+
+
+@encoder(YandexError)
+def encode_error(error: YandexError) -> str:
+    return '{"error_code":%s,"error_message":%s}' % (encode_value(error.error_code), encode_value(error.error_message))
+
+
+@encoder(ActionResult)
+def encode_action_result(result: ActionResult) -> str:
+    if result.error_code:
+        return '{"error_code":%s,"error_message":%s,"status":%s}' % (
+            encode_value(result.error_code),
+            encode_value(result.error_message),
+            encode_value(result.status),
+        )
+    return '{"status":%s}' % encode_value(result.status)
+
+
+def encode_state(value) -> str:
+    """StatableValue state, see StatableValue.get_state"""
+    parts = []
+    if value.action_result is not None:
+        parts.append('"action_result":' + encode_value(value.action_result))
+    parts.append('"instance":' + encode_value(value.instance))
+    if value.value is not None:
+        parts.append('"value":' + encode_value(value.value))
+    return "{" + ",".join(parts) + "}"
+
+
+@encoder(DeviceCapability)
+def encode_capability(value: DeviceCapability) -> str:
+    capability = value.capability
+    type_ = encode_str("devices.capabilities." + str(capability.name))
+    if value.instance:
+        return '{"state":%s,"type":%s}' % (encode_state(value), type_)
+    parts = ['"parameters":' + encode_value(dict(capability.get_params()))]
+    if capability.reportable:
+        parts.append('"reportable":' + encode_value(capability.reportable))
+    if not capability.retrievable:
+        parts.append('"retrievable":' + encode_value(capability.retrievable))
+    parts.append('"type":' + type_)
+    return "{" + ",".join(parts) + "}"
+
+
+@encoder(DeviceProperty)
+def encode_property(value: DeviceProperty) -> str:
+    prop = value.prop
+    type_ = encode_str("devices.properties." + str(prop.ptype))
+    if prop.state:
+        return '{"state":%s,"type":%s}' % (encode_value(prop.state), type_)
+    return '{"parameters":{"instance":%s,"unit":%s},"reportable":%s,"retrievable":%s,"type":%s}' % (
+        encode_value(prop.name),
+        encode_value(prop.units),
+        encode_value(prop.reportable),
+        encode_value(prop.retrievable),
+        type_,
+    )
+
+
+@encoder(YandexDevice)
+def encode_device(device: YandexDevice) -> str:
+    if device.error:
+        return '{"error_code":%s,"error_message":%s,"id":%s}' % (
+            encode_value(device.error.error_code),
+            encode_value(device.error.error_message),
+            encode_value(device.device_id),
+        )
+    parts = []
+    if device.capabilities:
+        parts.append('"capabilities":[' + ",".join(map(encode_value, device.capabilities)) + "]")
+    if device.custom_data:
+        parts.append('"custom_data":' + encode_value(device.custom_data))
+    if device.description:
+        parts.append('"description":' + encode_value(device.description))
+    if device.device_info:
+        parts.append('"device_info":' + encode_value(device.device_info))
+    parts.append('"id":' + encode_value(device.device_id))
+    if device.name:
+        parts.append('"name":' + encode_value(device.name))
+    if device.room:
+        parts.append('"room":' + encode_value(device.room))
+    if device.device_type:
+        parts.append('"type":' + encode_value(device.device_type))
+    return "{" + ",".join(parts) + "}"
+
+
+def payload_json(response: YandexResponse) -> str:
+    payload = '{"devices":[' + ",".join(map(encode_value, response.devices)) + "]"
+    if response.nickname:
+        payload += ',"user_id":' + encode_value(response.nickname)
+    return payload + "}"
+
+
+@encoder(YandexResponse)
+def encode_response(response: YandexResponse) -> str:
+    return '{"payload":%s,"request_id":%s}' % (payload_json(response), encode_value(response.request_id))
+
+
+def encode_payload(response: YandexResponse) -> bytes:
+    """Encode response payload, can be cached and spliced with splice_response"""
+    with SERIALIZATION_LATENCY.time("payload"):
+        return payload_json(response).encode()
+
+
+def splice_response(request_id, payload: bytes) -> bytes:
+    """Response body from request_id and pre-encoded payload, same as jsonify output"""
+    # Keys sorted as jsonify does: payload goes before request_id
+    return b'{"payload":' + payload + b',"request_id":' + encode_value(request_id).encode() + b"}\n"
+
+
+def encode_body(obj) -> bytes:
+    """Full response body for object, same as jsonify(dict(obj))"""
+    with SERIALIZATION_LATENCY.time("body"):
+        return encode(obj) + b"\n"
@@ -64,9 +64,14 @@ Yandex open/close sensor :
 }
 
 """
+from types import MappingProxyType
+from .descriptor import Descriptor
 
 
-class Property:
+class Property(Descriptor):
+    """Base class for property, immutable and shared between devices"""
+
+    __slots__ = ()
     name = ""
     ptype = "float"
     retrievable = True
@@ -74,6 +79,18 @@ class Property:
     units = ""
     state = None
 
+    # Property classes by name, filled on class definition
+    registry: dict = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if not cls.__dict__.get("name"):
+            return
+        registered = Property.registry.get(cls.name)
+        if registered is not None:
+            raise TypeError(f"Property {cls.name} already registered by {registered.__qualname__}")
+        Property.registry[cls.name] = cls
+
     def to_dict(self):
         data = {'type':self.ptype}
         if self.retrievable:
@@ -84,32 +101,39 @@ class Property:
 
     @classmethod
     def with_params(cls,params):
-        return cls(**params)
+        return cls.shared(**params)
 
 class PropertyAmperage(Property):
+    __slots__ = ()
     name = "amperage"
     ptype = "float"
     units = "amper"
 
 
 class PropertyPower(Property):
+    __slots__ = ()
     name = "power"
     ptype = "float"
     units = "watt"
 
 
 class PropertyVoltage(Property):
+    __slots__ = ()
     name = "voltage"
     ptype = "float"
     units = "volt"
 
 class PropertyTemperature(Property):
+    __slots__ = ()
     name = "temperature"
     ptype = "float"
     units = "celsius"
 
 
 def get_property_by_name(name):
-    for cls in Property.__subclasses__():
-        if cls.name == name:
-            return cls
+    return Property.registry.get(name)
+
+
+def get_properties():
+    """Registered property classes by name"""
+    return MappingProxyType(Property.registry)
@@ -6,6 +6,8 @@ class ActionRequest:
         self.action_name = action_name
         self.param = params['instance']
         self.value = params['value']
+        # Value is change of current state (Ex: range "brighter")
+        self.relative = params.get('relative', False)
 
     def __iter__(self):
         yield 'action', self.action_name
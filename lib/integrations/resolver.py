@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from devices.actions import ActionResult, QueryResult, settle
+from metrics import DEVICE_ERRORS, DRIVER_ERRORS
+from .coalescer import Command
+from .resolve import ActionRequest, QueryRequest
+from .yandex import YandexDevice, YandexError
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceResolver:
+    """Resolves devices queries/actions concurrently
+
+    Every unresolved capability/property of every device is a separate task
+    on bounded executor. Request has global deadline: values not answered in
+    time get DEVICE_UNREACHABLE error, the rest of response goes out as is.
+
+    With state store queries answered from store while state is fresh, only
+    stale values go to drivers. Driver query results and done actions
+    (optimistic state) written to store, relative actions skipped.
+
+    With coalescer actions for the same device capability instance merged
+    while previous one in flight, see CommandCoalescer.
+
+    Values of devices with batched driver (see DeviceDriver.batched) grouped
+    by driver and sent with one call per driver, not coalesced.
+    """
+
+    DEVICE_UNREACHABLE = "DEVICE_UNREACHABLE"
+    INTERNAL_ERROR = "INTERNAL_ERROR"
+
+    def __init__(self, max_workers: int = 16, timeout: float = 2.5, store=None, coalescer=None):
+        """Create resolver
+
+        Args:
+            max_workers (int, optional): max concurrent driver calls per process. Defaults to 16.
+            timeout (float, optional): default request deadline in seconds. Defaults to 2.5.
+            store (StateStore, optional): devices state store. Defaults to None.
+            coalescer (CommandCoalescer, optional): actions coalescing. Defaults to None.
+        """
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="resolve")
+        self.timeout = timeout
+        self.store = store
+        self.coalescer = coalescer
+
+    def serve(self, devices: list):
+        """Resolve queries with fresh state from store"""
+        if self.store is None:
+            return
+        for device in devices:
+            if not isinstance(device, YandexDevice):
+                continue
+            for value in device.unresolved():
+                if isinstance(value.resolve, QueryRequest):
+                    entry = self.store.fresh(device.device_id, value.name)
+                    if entry is not None:
+                        value.set_result(QueryResult(entry[0], entry[1]))
+                        value.resolve = None
+
+    @staticmethod
+    def pending(devices: list):
+        """(device, value) pairs waiting for driver"""
+        for device in devices:
+            if isinstance(device, YandexDevice):
+                for value in device.unresolved():
+                    yield device, value
+
+    @staticmethod
+    def settle_batch(batch: list, results: list):
+        for (_, _, future), result in zip(batch, results):
+            if isinstance(result, BaseException):
+                settle(future, error=result)
+            else:
+                settle(future, result)
+
+    def call_batch(self, driver, batch: list, params: dict = None):
+        """Batched driver call, results set to batch futures"""
+        try:
+            results = YandexDevice.call_many(driver, [(device, value) for device, value, _ in batch], params)
+        except Exception as e:  # pylint: disable=broad-except
+            results = [e] * len(batch)
+        self.settle_batch(batch, results)
+
+    async def call_batch_async(self, driver, batch: list, params: dict = None):
+        """Async variant of call_batch"""
+        try:
+            results = await YandexDevice.call_many_async(driver, [(device, value) for device, value, _ in batch], params)
+        except Exception as e:  # pylint: disable=broad-except
+            results = [e] * len(batch)
+        self.settle_batch(batch, results)
+
+    def submit(self, device: YandexDevice, value, params: dict = None) -> Future:
+        """Start driver call for value on executor"""
+        request = value.resolve
+        if self.coalescer is None or not isinstance(request, ActionRequest):
+            return self.executor.submit(device.call, value, params)
+        return self.coalescer.submit(
+            (device.device_id, value.name, request.param),
+            request,
+            lambda net: self.executor.submit(device.call, Command(value.name, net), params),
+        )
+
+    def submit_async(self, device: YandexDevice, value, params: dict = None):
+        """Async variant of submit, driver call runs as task on running loop"""
+        request = value.resolve
+        if self.coalescer is None or not isinstance(request, ActionRequest):
+            return asyncio.ensure_future(device.call_async(value, params))
+        return self.coalescer.submit(
+            (device.device_id, value.name, request.param),
+            request,
+            lambda net: asyncio.ensure_future(device.call_async(Command(value.name, net), params)),
+            asyncio.get_running_loop().create_future,
+        )
+
+    def record(self, device: YandexDevice, value, result):
+        """Apply driver result and keep state in store"""
+        value.set_result(result)
+        if isinstance(result, ActionResult) and result.status == ActionResult.STATUS_ERROR:
+            DRIVER_ERRORS.inc(device.device.driver.name, result.error_code or self.INTERNAL_ERROR)
+        if self.store is None:
+            return
+        if isinstance(result, QueryResult):
+            self.store.set(device.device_id, value.name, result.param, result.value)
+        elif isinstance(result, ActionResult) and result.status == ActionResult.STATUS_DONE:
+            # Merged request: device state is the value actually sent
+            request = result.sent or value.resolve
+            if isinstance(request, ActionRequest) and not request.relative:
+                self.store.set(device.device_id, value.name, request.param, request.value)
+
+    def resolve(self, devices: list, params: dict = None, timeout: float = None) -> list:
+        """Resolve devices in place
+
+        Args:
+            devices (list): YandexDevice list, other objects (Ex: error dicts) skipped
+            params (dict, optional): driver parameters. Defaults to None.
+            timeout (float, optional): request deadline in seconds. Defaults to resolver timeout.
+
+        Returns:
+            list: same devices list, order kept
+        """
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        self.serve(devices)
+        tasks = []
+        batches = {}
+        for device, value in self.pending(devices):
+            driver = device.batch_driver()
+            if driver is None:
+                tasks.append((device, value, self.submit(device, value, params)))
+            else:
+                future = Future()
+                batches.setdefault(driver, []).append((device, value, future))
+                tasks.append((device, value, future))
+        for driver, batch in batches.items():
+            self.executor.submit(self.call_batch, driver, batch, params)
+
+        # Results applied in this thread only, late driver answers are dropped
+        for device, value, future in tasks:
+            try:
+                result = future.result(timeout=max(0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                future.cancel()
+                logger.warning("dev[%s]Param %s not resolved in time", device.device_id, value.name)
+                self.set_error(device, value, self.DEVICE_UNREACHABLE, "Device not answered in time")
+                continue
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("dev[%s]Param %s resolve failed", device.device_id, value.name)
+                self.set_error(device, value, self.INTERNAL_ERROR, "Driver error")
+                continue
+            self.record(device, value, result)
+
+        return devices
+
+    async def resolve_async(self, devices: list, params: dict = None, timeout: float = None) -> list:
+        """Async variant of resolve, driver calls run as tasks on running loop"""
+        self.serve(devices)
+        loop = asyncio.get_running_loop()
+        tasks = []
+        batches = {}
+        for device, value in self.pending(devices):
+            driver = device.batch_driver()
+            if driver is None:
+                tasks.append((device, value, self.submit_async(device, value, params)))
+            else:
+                future = loop.create_future()
+                batches.setdefault(driver, []).append((device, value, future))
+                tasks.append((device, value, future))
+        calls = [asyncio.ensure_future(self.call_batch_async(driver, batch, params)) for driver, batch in batches.items()]
+        if tasks:
+            await asyncio.wait([task for _, _, task in tasks], timeout=self.timeout if timeout is None else timeout)
+
+        for device, value, task in tasks:
+            if not task.done():
+                task.cancel()
+                logger.warning("dev[%s]Param %s not resolved in time", device.device_id, value.name)
+                self.set_error(device, value, self.DEVICE_UNREACHABLE, "Device not answered in time")
+            elif task.exception():
+                logger.error("dev[%s]Param %s resolve failed: %s", device.device_id, value.name, task.exception())
+                self.set_error(device, value, self.INTERNAL_ERROR, "Driver error")
+            else:
+                self.record(device, value, task.result())
+        for call in calls:
+            call.cancel()
+
+        return devices
+
+    @staticmethod
+    def set_error(device: YandexDevice, value, error_code: str, error_message: str):
+        """Action errors reported per capability, query errors per device"""
+        DRIVER_ERRORS.inc(device.device.driver.name, error_code)
+        DEVICE_ERRORS.inc(error_code)
+        if isinstance(value.resolve, ActionRequest):
+            value.set_result(ActionResult(value.resolve.param, ActionResult.STATUS_ERROR, error_code, error_message))
+        elif not device.error:
+            device.set_error(YandexError(error_code, error_message))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,229 @@
+import inspect
+import logging
+from collections import namedtuple
+from .capabilities import get_capabilities
+from .property import get_properties
+from .deviceinfo import DeviceInfo
+from .yandex import DeviceCapability, DeviceProperty
+
+logger = logging.getLogger(__name__)
+
+CAPABILITY_PREFIX = "devices.capabilities."
+REQUIRED_FIELDS = ("device_id", "name", "device_type", "driver")
+
+
+def capability_map(capabilities) -> dict:
+    """Capabilities as {name: params}
+
+    devices table keeps json list of capability types (see
+    sql/my_devices.sql), Ex: ["devices.capabilities.toggle"], entries with
+    params as {"type": ..., "parameters": {...}}. Dict returned as is.
+    """
+    if not isinstance(capabilities, list):
+        return capabilities
+    ret = {}
+    for item in capabilities:
+        if isinstance(item, dict):
+            name, params = item.get("type"), item.get("parameters") or {}
+        else:
+            name, params = item, {}
+        name = str(name)
+        ret[name[len(CAPABILITY_PREFIX):] if name.startswith(CAPABILITY_PREFIX) else name] = params
+    return ret
+
+
+def capability_list(capabilities: dict) -> list:
+    """Capabilities in devices table format, reverse of capability_map"""
+    return [
+        {"type": CAPABILITY_PREFIX + name, "parameters": params} if params else CAPABILITY_PREFIX + name
+        for name, params in (capabilities or {}).items()
+    ]
+
+
+class Violation(namedtuple("Violation", ["device_id", "field", "message"])):
+    """Single catalog rule violation"""
+
+    def __str__(self):
+        return f"device {self.device_id}: {self.field}: {self.message}"
+
+
+class CatalogValidationError(ValueError):
+    """Catalog rows violate device rules, all violations in violations"""
+
+    def __init__(self, violations: list):
+        super().__init__(
+            "%d catalog violation(s):\n%s" % (len(violations), "\n".join(str(v) for v in violations))
+        )
+        self.violations = violations
+
+
+def init_params(cls):
+    """Keyword params accepted by class constructor, None if any accepted
+
+    Constructors passing **kwargs to parent collect parent params too
+    """
+    params = set()
+    for klass in cls.__mro__:
+        if "__init__" not in klass.__dict__:
+            continue
+        if klass is object:
+            break
+        accepts_kwargs = False
+        for name, param in inspect.signature(klass.__init__).parameters.items():
+            if param.kind is param.VAR_KEYWORD:
+                accepts_kwargs = True
+            elif param.kind is not param.VAR_POSITIONAL and name != "self":
+                params.add(name)
+        if not accepts_kwargs:
+            break
+    return frozenset(params)
+
+
+class CatalogValidator:
+    """Device rows validator compiled from device type tables
+
+    Device type tables (DeviceCapability.CAPIBILITIES, DeviceProperty.PROPERTIES)
+    and registered capability/property classes compiled to frozenset indexes
+    once, so checking a row is a few set lookups. Run on device write/import
+    and when catalog loaded into cache: cached rows are not checked again.
+    """
+
+    def __init__(self, capability_types: dict = None, property_types: dict = None):
+        """Compile tables
+
+        Args:
+            capability_types (dict, optional): device type -> capability types. Defaults to DeviceCapability.CAPIBILITIES.
+            property_types (dict, optional): device type -> [float names, event names]. Defaults to DeviceProperty.PROPERTIES.
+        """
+        capability_types = DeviceCapability.CAPIBILITIES if capability_types is None else capability_types
+        property_types = DeviceProperty.PROPERTIES if property_types is None else property_types
+
+        self.capabilities = {
+            device_type: frozenset(c[len(CAPABILITY_PREFIX):] for c in names if c.startswith(CAPABILITY_PREFIX))
+            for device_type, names in capability_types.items()
+        }
+        self.properties = {
+            device_type: {"float": frozenset(floats), "event": frozenset(events)}
+            for device_type, (floats, events) in property_types.items()
+        }
+        self.device_types = frozenset(self.capabilities) | frozenset(self.properties)
+        self.capability_params = {name: init_params(cls) for name, cls in get_capabilities().items()}
+        self.property_classes = dict(get_properties())
+        self.property_params = {name: init_params(cls) for name, cls in self.property_classes.items()}
+        self.device_info_fields = frozenset(DeviceInfo.__slots__)
+
+    def check_device(self, row: dict) -> list:
+        """All violations of device row
+
+        Args:
+            row (dict): device row, see backend.load_yandex_devices
+
+        Returns:
+            list: Violation list, empty for valid row
+        """
+        device_id = row.get("device_id")
+        violations = []
+
+        def fail(field, message):
+            violations.append(Violation(device_id, field, message))
+
+        for field in REQUIRED_FIELDS:
+            if row.get(field) in (None, ""):
+                fail(field, "required")
+
+        device_type = row.get("device_type")
+        if device_type and device_type not in self.device_types:
+            fail("device_type", f"unknown device type {device_type}")
+
+        capabilities = capability_map(row.get("capabilities") or {})
+        if not isinstance(capabilities, dict):
+            fail("capabilities", "should be object")
+            capabilities = {}
+        allowed = self.capabilities.get(device_type, frozenset())
+        for name, params in capabilities.items():
+            field = f"capabilities.{name}"
+            if name not in self.capability_params:
+                fail(field, "unknown capability")
+                continue
+            if device_type in self.device_types and name not in allowed:
+                fail(field, f"not supported by {device_type}")
+            if params is not None and not isinstance(params, dict):
+                fail(field, "params should be object")
+            elif params:
+                for param in sorted(params.keys() - self.capability_params[name]):
+                    fail(field, f"unknown param {param}")
+
+        properties = row.get("properties") or {}
+        if not isinstance(properties, dict):
+            fail("properties", "should be object")
+            properties = {}
+        allowed = self.properties.get(device_type, {})
+        for name, value in properties.items():
+            field = f"properties.{name}"
+            prop_class = self.property_classes.get(name)
+            if prop_class is None:
+                fail(field, "unknown property")
+                continue
+            if device_type in self.device_types and name not in allowed.get(prop_class.ptype, ()):
+                fail(field, f"{prop_class.ptype} property not supported by {device_type}")
+            if value is not None and not isinstance(value, dict):
+                fail(field, "should be object")
+            elif value:
+                for key in sorted(value.keys() - {"params"}):
+                    fail(field, f"unknown key {key}")
+                for param in sorted((value.get("params") or {}).keys() - self.property_params[name]):
+                    fail(field, f"unknown param {param}")
+
+        device_info = row.get("device_info")
+        if device_info is not None:
+            if not isinstance(device_info, dict):
+                fail("device_info", "should be object")
+            elif device_info.keys() != self.device_info_fields:
+                fail("device_info", "fields should be %s" % ", ".join(sorted(self.device_info_fields)))
+
+        return violations
+
+    def check_catalog(self, rows) -> list:
+        """All violations of catalog rows in one pass, duplicated ids included"""
+        violations = []
+        seen = set()
+        for row in rows:
+            violations += self.check_device(row)
+            device_id = str(row.get("device_id"))
+            if device_id in seen:
+                violations.append(Violation(row.get("device_id"), "device_id", "duplicated"))
+            seen.add(device_id)
+        return violations
+
+    def validate(self, rows) -> list:
+        """Validated rows
+
+        Raises:
+            CatalogValidationError: with all violations found
+
+        Returns:
+            list: rows
+        """
+        rows = list(rows)
+        violations = self.check_catalog(rows)
+        if violations:
+            raise CatalogValidationError(violations)
+        return rows
+
+    def checked_rows(self, rows) -> list:
+        """Rows with capabilities as dict, violations logged. For rows already
+        in DB: catalog is validated on write (see save_yandex_devices), rows
+        written before or by other tools still served
+
+        Capabilities in devices table list format (see capability_map)
+        converted here, once per catalog load.
+        """
+        ret = []
+        for row in rows:
+            if isinstance(row.get("capabilities"), list):
+                row = dict(row, capabilities=capability_map(row["capabilities"]))
+            violations = self.check_device(row)
+            if violations:
+                logger.warning("[CATALOG]Invalid device served:\n%s", "\n".join(str(v) for v in violations))
+            ret.append(row)
+        return ret
@@ -3,11 +3,15 @@ from __future__ import annotations
 import logging
 import json
 from devices import Device
+from drivers import DriverFactory
+from metrics import DEVICE_ERRORS, DRIVER_LATENCY
 from devices.actions import QueryResult, ActionResult
 from .capabilities import get_capability_by_name
 from .property import get_property_by_name
 from .resolve import ActionRequest,QueryRequest
+from .decoder import DECODER, CapabilityChange
 from .deviceinfo import DeviceInfo
+from .descriptor import params_key
 
 logger = logging.getLogger(__name__)
 
@@ -43,15 +47,84 @@ class YandexError:
 
 class YandexRequest:
     """Parse and handle yandex format request
+
+    Create with query/action, body decoded and checked before any backend
+    work (see integrations.decoder)
     """
 
-    def __init__(self,data):
-        self.data = data
+    def __init__(self,devices:tuple):
+        self.devices = devices
+
+    @classmethod
+    def query(cls,data) -> YandexRequest:
+        """Decode devices query body
+
+        Raises:
+            DecodeError: invalid body
+        """
+        return cls(DECODER.query(data))
+
+    @classmethod
+    def action(cls,data) -> YandexRequest:
+        """Decode devices action body
+
+        Raises:
+            DecodeError: invalid body
+        """
+        return cls(DECODER.action(data))
 
     @property
-    def devices(self):
-        return self.data['devices']
+    def device_ids(self) -> list:
+        return [d.id for d in self.devices]
+
+    def query_devices(self,devices:dict) -> list:
+        """Build devices to query from catalog
 
+        Args:
+            devices (dict): user catalog rows by device id
+
+        Returns:
+            list: YandexDevice to resolve or error dict for unknown devices, in request order
+        """
+        ret = []
+        for dev in self.devices:
+            if dev.id in devices:
+                device = devices[dev.id]
+                builder = (
+                    YandexDeviceBuilder(dev.id)
+                    .with_custom_data({'driver':device['driver'],'params':device['params']})
+                    .with_properties(self.build_query_request(device['properties']))
+                    .with_capabilities(self.build_query_request(device['capabilities']))
+                )
+                ret.append(builder.build())
+            else:
+                DEVICE_ERRORS.inc("DEVICE_NOT_FOUND")
+                ret.append(dict({'id':dev.id}, **dict(YandexError("DEVICE_NOT_FOUND","Device not found"))))
+        return ret
+
+    def action_devices(self,devices:dict) -> list:
+        """Build devices to take action from catalog
+
+        Args:
+            devices (dict): user catalog rows by device id
+
+        Returns:
+            list: YandexDevice to resolve or error dict for unknown devices, in request order
+        """
+        ret = []
+        for dev in self.devices:
+            if dev.id in devices:
+                device = devices[dev.id]
+                builder = (
+                    YandexDeviceBuilder(dev.id)
+                    .with_custom_data({'driver':device['driver'],'params':device['params']})
+                    .with_capabilities(self.build_action_request(device['capabilities'],dev.capabilities))
+                )
+                ret.append(builder.build())
+            else:
+                DEVICE_ERRORS.inc("DEVICE_NOT_FOUND")
+                ret.append({'id':dev.id,'action_result':dict(YandexError("DEVICE_NOT_FOUND","Device not found"))})
+        return ret
 
     @staticmethod
     def build_query_request(data:dict,request:list=None):
@@ -65,9 +138,11 @@ class YandexRequest:
             StatableValueRequest: request data
         """
 
-        query_requests = data
-        for name,r in query_requests:
-            query_requests[r]['resolve'] = QueryRequest(name)
+        # Copy, device data can be shared with catalog cache
+        return {
+            name: dict(value or {}, resolve=QueryRequest({'instance': name}))
+            for name, value in (data or {}).items()
+        }
 
     @staticmethod
     def build_action_request(data:dict,request:list) -> dict:
@@ -75,35 +150,45 @@ class YandexRequest:
 
         Args:
             data (dict) : device capabilities
-            capability (list): capabilities in yandex format
+            request (list): CapabilityChange list or capabilities in yandex format
+
+        Raises:
+            DecodeError: capability in yandex format invalid
 
         Returns:
             list: capabilities data in database format
         """
 
         ret = {}
-        for capability in request: 
-            capability_name = capability['type'][21:]
-            if capability_name in data:
-               ret[capability_name] = data[capability_name]
-               ret[capability_name]['resolve'] = ActionRequest(capability_name,capability['state'])
+        for change in request:
+            if not isinstance(change, CapabilityChange):
+                change = DECODER.capability(change)
+            if change.name in data:
+               # Copy, device data can be shared with catalog cache
+               ret[change.name] = dict(data[change.name])
+               ret[change.name]['resolve'] = ActionRequest(change.name,{'instance':change.instance,'value':change.value,'relative':change.relative})
 
         return ret
 
 
 
 class StatableValue:
+    """Per-device state of shared capability/property descriptor"""
+
+    # instance: value instance name in state (Ex: humidity  or 'on' for on_off )
+    # value: instance value after query (Ex, true)
+    # action_result: if action processd
+    # resolve: value should be resolved/action done
+    __slots__ = ("instance", "value", "action_result", "resolve")
+
     # Type of value - float/event for property or capability
     ptype = None
-    # Value instance name in state (Ex: humidity  or 'on' for on_off ) 
-    instance = None
-    # instance value after query (Ex, true)
-    value = None 
-    # if action processd
-    action_result = None
 
-    # Value should be resolved/action done
-    resolve = None
+    def __init__(self, resolve=None):
+        self.instance = None
+        self.value = None
+        self.action_result = None
+        self.resolve = resolve
 
     def get_state(self):
         if not self.instance:
@@ -154,19 +239,27 @@ class DeviceCapability(StatableValue):
         # Сенсор
         "devices.types.sensor": [],
     }
+    # Compiled for lookups, see also integrations.validation
+    SUPPORTED = {t: frozenset(c) for t, c in CAPIBILITIES.items()}
 
-    capability = None
+    __slots__ = ("capability",)
 
     def __init__(self, capability, resolve=None, **kwargs):
+        super().__init__(resolve)
         self.capability = get_capability_by_name(capability, **kwargs)
         assert self.capability, "capability not found %s" % capability
-        self.resolve = resolve
+
+    @classmethod
+    def of(cls, capability, resolve=None):
+        """Holder for already located shared capability descriptor"""
+        value = cls.__new__(cls)
+        StatableValue.__init__(value, resolve)
+        value.capability = capability
+        return value
         
     def validate(self,device_type:str):
         """ Valiidate capability supported by device_type """
-        if str(self.capability) not in self.CAPIBILITIES[device_type]:
-            return False
-        return True
+        return 'devices.capabilities.' + self.name in self.SUPPORTED.get(device_type, ())
 
     def __iter__(self):
         yield "type", 'devices.capabilities.' + str(self.capability.name)
@@ -220,11 +313,21 @@ class DeviceProperty(StatableValue):
         ],
     }
 
-    def __init__(self, name, resolve, params):
+    __slots__ = ("prop",)
+
+    def __init__(self, name, resolve=None, params=None):
+        super().__init__(resolve)
         prop_class  = get_property_by_name(name)
         assert prop_class, "Property class not found %s" % (name)
-        self.prop = prop_class.with_params(params)
-        self.resolve = resolve
+        self.prop = prop_class.with_params(params or {})
+
+    @classmethod
+    def of(cls, prop, resolve=None):
+        """Holder for already located shared property descriptor"""
+        value = cls.__new__(cls)
+        StatableValue.__init__(value, resolve)
+        value.prop = prop
+        return value
 
     def __iter__(self):
         yield "type", "devices.properties." + str(self.prop.ptype)
@@ -255,6 +358,7 @@ class YandexDevice(Device):
     device_info: DeviceInfo = None
     custom_data: dict = None
     device : Device = None
+    error: YandexError = None
 
     def __init__(
         self,
@@ -267,6 +371,7 @@ class YandexDevice(Device):
         properties: list = None,
         device_info: DeviceInfo = None, 
         custom_data: dict = None,
+        device: Device = None,
     ):
         self.device_id = str(device_id)
         self.name = name
@@ -277,11 +382,16 @@ class YandexDevice(Device):
         self.properties = properties
         self.device_info = device_info
         self.custom_data = custom_data
-        if custom_data:
+        if device is not None:
+            self.device = device
+        elif custom_data:
             self.device = Device(**custom_data)
 
     def __iter__(self):
         yield "id", self.device_id
+        if self.error:
+            yield from self.error
+            return
         if self.name:
             yield "name", self.name
         if self.device_type:
@@ -300,22 +410,127 @@ class YandexDevice(Device):
             yield "custom_data", self.custom_data
 
 
+    def unresolved(self):
+        """Properties/capabilities waiting for query or action"""
+        for p in (self.capabilities or []) + (self.properties or []):
+            if p.resolve:
+                yield p
+
+    def call(self,value:StatableValue,params=None):
+        """Run driver query/action for property or capability
+
+        Does not change value state, result should be applied with value.set_result
+
+        Args:
+            value (StatableValue): capability or property to resolve
+            params (dict, optional): driver parameters . Defaults to None.
+
+        Returns:
+            ActionResult|QueryResult: driver result
+        """
+        logger.info("dev[%s]Resolve param %s",self.device_id,value.name)
+        return self.device.action(**dict(value.resolve),action_params=self.action_params(params))
+
+    async def call_async(self,value:StatableValue,params=None):
+        """Async variant of call"""
+        logger.info("dev[%s]Resolve param %s",self.device_id,value.name)
+        return await self.device.action_async(**dict(value.resolve),action_params=self.action_params(params))
+
+    def action_params(self,params=None) -> dict:
+        """Request driver params with device_id, drivers order commands per device"""
+        return dict(params or (), device_id=self.device_id)
+
     def resolve(self,params=None):
         """Resolves all unresolved properties/capabilities for device
 
+        Batched driver gets all of them in one call, see DeviceDriver.action_many
+
         Args:
             params (dict, optional): driver parameters . Defaults to None.
         """
+        values = list(self.unresolved())
+        if self.batch_driver() is None:
+            for p in values:
+                p.set_result(self.call(p,params))
+            return
+        for p, result in zip(values, YandexDevice.call_many(self.device.driver, [(self, p) for p in values], params)):
+            if isinstance(result, Exception):
+                raise result
+            p.set_result(result)
+
+    def batch_driver(self):
+        """Device driver if it takes batches, otherwise None"""
+        driver = self.device.driver if self.device is not None else None
+        return driver if driver is not None and driver.batched else None
 
-        def resolve_all(prop:list): 
-            if prop:
-                for p in prop:
-                    if p.resolve:
-                        logger.info("dev[%s]Resolve param %s",self.device_id,p.name)
-                        p.set_result(self.device.action(**dict(p.resolve),action_params=params))
+    @staticmethod
+    def batch_requests(items: list, params=None):
+        """Driver requests of (device, value) items split by kind
+
+        Returns:
+            tuple: (actions, queries, failed). actions/queries are (index, request) lists, failed is {index: exception}
+        """
+        actions, queries, failed = [], [], {}
+        for i, (device, value) in enumerate(items):
+            try:
+                if isinstance(value.resolve, QueryRequest):
+                    queries.append((i, device.device.build_query(value.resolve.param, device.action_params(params))))
+                else:
+                    actions.append((i, device.device.build_request(**dict(value.resolve), action_params=device.action_params(params))))
+            except Exception as e:  # pylint: disable=broad-except
+                failed[i] = e
+        return actions, queries, failed
 
-        resolve_all(self.capabilities)
-        resolve_all(self.properties)
+    @staticmethod
+    def call_many(driver, items: list, params=None) -> list:
+        """Run queries/actions of (device, value) items sharing driver
+
+        One action_many and one query_many call at most. Does not change
+        values state, results should be applied with value.set_result
+
+        Returns:
+            list: driver results in items order, exception instance for failed item
+        """
+        actions, queries, failed = YandexDevice.batch_requests(items, params)
+        ret = [failed.get(i) for i in range(len(items))]
+        for batch, call in ((actions, driver.action_many), (queries, driver.query_many)):
+            if not batch:
+                continue
+            logger.info("[DRIVER]%s %s for %s items", driver.name, call.__name__, len(batch))
+            try:
+                with DRIVER_LATENCY.time(driver.name, call.__name__):
+                    results = call([request for _, request in batch])
+                if len(results) != len(batch):
+                    raise ValueError(f"{len(results)} results for {len(batch)} requests")
+            except Exception as e:  # pylint: disable=broad-except
+                results = [e] * len(batch)
+            for (i, _), result in zip(batch, results):
+                ret[i] = result
+        return ret
+
+    @staticmethod
+    async def call_many_async(driver, items: list, params=None) -> list:
+        """Async variant of call_many"""
+        actions, queries, failed = YandexDevice.batch_requests(items, params)
+        ret = [failed.get(i) for i in range(len(items))]
+        for batch, call in ((actions, driver.action_many_async), (queries, driver.query_many_async)):
+            if not batch:
+                continue
+            logger.info("[DRIVER]%s %s for %s items", driver.name, call.__name__, len(batch))
+            try:
+                with DRIVER_LATENCY.time(driver.name, call.__name__):
+                    results = await call([request for _, request in batch])
+                if len(results) != len(batch):
+                    raise ValueError(f"{len(results)} results for {len(batch)} requests")
+            except Exception as e:  # pylint: disable=broad-except
+                results = [e] * len(batch)
+            for (i, _), result in zip(batch, results):
+                ret[i] = result
+        return ret
+
+    def set_error(self,error:YandexError):
+        """Device level error, replaces capabilities/properties in response"""
+        self.error = error
 
 
 class YandexDeviceBuilder:
@@ -374,6 +589,89 @@ class YandexDeviceBuilder:
             self.device_info = DeviceInfo(**device_info)
         return self
 
+    @classmethod
+    def from_row(cls, row: dict) -> YandexDevice:
+        """Build device for devices list from backend catalog row
+
+        Args:
+            row (dict): see backend.load_yandex_devices
+
+        Returns:
+            YandexDevice: device
+        """
+        driver = DriverFactory.get(row['driver'])
+        return (
+            cls(row['device_id'], row['device_type'])
+            .with_name(row['name'])
+            .with_room(row['room'])
+            .with_custom_data({'driver':driver.name,'params':row['params']})
+            .with_description(row['description'])
+            .with_properties(row['properties'])
+            .with_capabilities(row['capabilities'])
+            .with_device_info(row['device_info'])
+        ).build()
+
+    @classmethod
+    def build_many(cls, rows):
+        """Build devices for devices list from backend catalog rows
+
+        Same result as from_row for every row, but drivers, capabilities and
+        properties descriptors located once per distinct value.
+
+        Args:
+            rows (iterable): see backend.load_yandex_devices
+
+        Yields:
+            YandexDevice: device per row, in rows order
+        """
+        drivers = {}
+        capabilities = {}
+        properties = {}
+
+        def capability(name, params):
+            try:
+                key = (name, params_key(params))
+                descriptor = capabilities.get(key)
+            except TypeError:
+                key = descriptor = None
+            if descriptor is None:
+                descriptor = get_capability_by_name(name, **params)
+                assert descriptor, "capability not found %s" % name
+                if key is not None:
+                    capabilities[key] = descriptor
+            return DeviceCapability.of(descriptor)
+
+        def prop(name, value):
+            params = (value or {}).get('params') or {}
+            try:
+                key = (name, params_key(params))
+                descriptor = properties.get(key)
+            except TypeError:
+                key = descriptor = None
+            if descriptor is None:
+                descriptor = DeviceProperty(name, **(value or {})).prop
+                if key is not None:
+                    properties[key] = descriptor
+            return DeviceProperty.of(descriptor)
+
+        for row in rows:
+            driver = drivers.get(row['driver'])
+            if driver is None:
+                driver = drivers[row['driver']] = DriverFactory.get(row['driver'])
+            device_info = row['device_info']
+            yield YandexDevice(
+                row['device_id'],
+                row['name'],
+                row['device_type'],
+                row['description'],
+                row['room'],
+                [capability(c, p) for c, p in row['capabilities'].items()] if row['capabilities'] else None,
+                [prop(p, v) for p, v in row['properties'].items()] if row['properties'] else None,
+                DeviceInfo(**device_info) if isinstance(device_info, dict) else None,
+                {'driver':driver.name,'params':row['params']},
+                device=Device(driver, row['params']),
+            )
+
     def build(self):
         return YandexDevice(
             self.device_id,
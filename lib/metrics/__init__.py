@@ -0,0 +1,36 @@
+"""Process metrics in prometheus text format, see Registry.render
+
+Instrumentation is lock free on hot path (per thread shards), so it stays on
+in production. Every process (prefork worker) exports own values.
+"""
+from .registry import Registry, Counter, Histogram, CallbackMetric, Timer, TimedProxy, DEFAULT_BUCKETS
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    "alice_request_duration_seconds", "HTTP request latency by route", ("route", "method")
+)
+DRIVER_LATENCY = REGISTRY.histogram(
+    "alice_driver_action_duration_seconds", "Driver action latency", ("driver", "action")
+)
+BACKEND_LATENCY = REGISTRY.histogram(
+    "alice_backend_call_duration_seconds", "Backend (MySQL) call latency", ("call",)
+)
+SERIALIZATION_LATENCY = REGISTRY.histogram(
+    "alice_serialization_duration_seconds", "Response encoding latency", ("kind",)
+)
+DEVICE_ERRORS = REGISTRY.counter(
+    "alice_device_errors_total", "Device errors returned to Alice", ("error_code",)
+)
+DRIVER_ERRORS = REGISTRY.counter(
+    "alice_driver_errors_total", "Driver calls failed or not answered in time", ("driver", "error_code")
+)
+TRANSMIT_WAIT = REGISTRY.histogram(
+    "alice_transmit_wait_seconds", "Gateway transmission queue wait", ("priority",)
+)
+
+
+def timed(target, histogram: Histogram = BACKEND_LATENCY):
+    """Proxy observing latency of target methods, method name used as label"""
+    return TimedProxy(target, histogram)
+
@@ -0,0 +1,273 @@
+import threading
+import time
+import weakref
+from bisect import bisect_left
+
+# Seconds, Alice waits up to 3s for answer
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra: str = "") -> str:
+    labels = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class ShardOwner:
+    """Thread local holder of shard, collected when its thread exits"""
+
+    __slots__ = ("shard", "__weakref__")
+
+    def __init__(self, shard: dict):
+        self.shard = shard
+
+
+class Metric:
+    """Base metric with per-thread shards
+
+    Every thread writes own shard dict without locks, shards merged on
+    collect. Lock taken only once per thread, when shard created, and when
+    thread exits: its shard folded into base values, so short-lived
+    threads (Ex: thread per connection) do not grow shards list.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._local = threading.local()
+        self._shards = []
+        # Values of exited threads
+        self._base = {}
+        self._lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.owner.shard
+        except AttributeError:
+            owner = ShardOwner({})
+            with self._lock:
+                self._shards.append(owner.shard)
+            weakref.finalize(owner, self._fold, owner.shard).atexit = False
+            self._local.owner = owner
+            return owner.shard
+
+    def _fold(self, shard: dict):
+        """Move shard of exited thread into base values"""
+        with self._lock:
+            for i, current in enumerate(self._shards):
+                if current is shard:
+                    del self._shards[i]
+                    self._merge(self._base, shard)
+                    return
+
+    @staticmethod
+    def _merge(into: dict, shard: dict):
+        raise NotImplementedError
+
+    def values(self) -> dict:
+        """Merged value by labels tuple"""
+        ret = {}
+        with self._lock:
+            for shard in [self._base] + self._shards:
+                self._merge(ret, shard)
+        return ret
+
+    def reset(self):
+        """Drop all values. Ex: in forked child"""
+        with self._lock:
+            self._shards = []
+            self._base = {}
+            # Dropped after lock released, its shard owners fold on collect
+            local, self._local = self._local, threading.local()
+        del local
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> list:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Monotonic counter"""
+
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    @staticmethod
+    def _merge(into: dict, shard: dict):
+        for labels, value in list(shard.items()):
+            into[labels] = into.get(labels, 0) + value
+
+    def render(self) -> list:
+        return [
+            f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}"
+            for labels, value in sorted(self.values().items())
+        ]
+
+
+class Timer:
+    """Context manager observing elapsed seconds"""
+
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Histogram(Metric):
+    """Histogram with fixed buckets
+
+    Shard value is list of per bucket counts (last is +Inf) and sum, buckets
+    made cumulative on collect.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            counts = shard[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def time(self, *labels) -> Timer:
+        """Observe duration of with block. Ex: with histogram.time("mqtt", "on_off"):"""
+        return Timer(self, labels)
+
+    @staticmethod
+    def _merge(into: dict, shard: dict):
+        for labels, counts in list(shard.items()):
+            merged = into.setdefault(labels, [0] * len(counts))
+            for i, count in enumerate(list(counts)):
+                merged[i] += count
+
+    def render(self) -> list:
+        lines = []
+        for labels, counts in sorted(self.values().items()):
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                le = 'le="%s"' % format_value(bound)
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, labels, le)} {total}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {total}")
+        return lines
+
+
+class TimedProxy:
+    """Proxy observing latency of target methods, method name used as label"""
+
+    def __init__(self, target, histogram: Histogram):
+        self._target = target
+        self._histogram = histogram
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+        histogram = self._histogram
+
+        def call(*args, **kwargs):
+            with histogram.time(name):
+                return attr(*args, **kwargs)
+
+        return call
+
+
+class CallbackMetric(Metric):
+    """Values read on collect. Ex: cache stats
+
+    callback() returns iterable of (labels tuple, value)
+    """
+
+    def __init__(self, name: str, documentation: str, labels, callback, kind: str = "gauge"):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+        self.kind = kind
+
+    @staticmethod
+    def _merge(into: dict, shard: dict):
+        # No shards written, latest value wins
+        into.update(shard)
+
+    def values(self) -> dict:
+        return dict(self.callback())
+
+    def render(self) -> list:
+        return [
+            f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}"
+            for labels, value in self.values().items()
+        ]
+
+
+class Registry:
+    """Metrics collection rendered in prometheus text format"""
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels=()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def callback(self, name: str, documentation: str, labels, callback, kind: str = "gauge") -> CallbackMetric:
+        return self.register(CallbackMetric(name, documentation, labels, callback, kind))
+
+    def unregister(self, name: str):
+        self.metrics.pop(name, None)
+
+    def reset(self):
+        for metric in self.metrics.values():
+            metric.reset()
+
+    def render(self) -> bytes:
+        lines = []
+        for metric in list(self.metrics.values()):
+            body = metric.render()
+            if body:
+                lines += metric.header() + body
+        return ("\n".join(lines) + "\n").encode()
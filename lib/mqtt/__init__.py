@@ -0,0 +1,4 @@
+from .client import MqttClient
+from .pool import MqttPool
+from .protocol import ProtocolError
+from .trie import TopicTrie
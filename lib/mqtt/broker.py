@@ -0,0 +1,145 @@
+import logging
+import socket
+import threading
+import time
+from . import protocol
+from .protocol import PacketReader, ProtocolError
+
+logger = logging.getLogger(__name__)
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """MQTT topic filter match with + and # wildcards"""
+    parts = topic.split("/")
+    for i, level in enumerate(topic_filter.split("/")):
+        if level == "#":
+            return True
+        if i >= len(parts) or (level != "+" and level != parts[i]):
+            return False
+    return len(parts) == len(topic_filter.split("/"))
+
+
+class LocalBroker:
+    """In-process MQTT broker stand-in for tests and local development
+
+    QoS 0/1 publish, subscriptions with wildcards (delivered at QoS 0) and
+    pings. No sessions or retained messages. Received messages kept in
+    messages as (topic, payload, qos, dup).
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, ack: bool = True):
+        """Start broker
+
+        Args:
+            host (str, optional): listen host. Defaults to 127.0.0.1.
+            port (int, optional): listen port. Defaults to free port.
+            ack (bool, optional): send PUBACK for QoS 1 messages. Defaults to True.
+        """
+        self.server = socket.create_server((host, port))
+        self.host, self.port = self.server.getsockname()[:2]
+        self.ack = ack
+        self.messages = []
+        self.connects = 0
+        self.clients = []
+        self.subscriptions = []
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        threading.Thread(target=self._accept, name="mqtt-broker", daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            with self._lock:
+                self.clients.append(conn)
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn: socket.socket):
+        reader = PacketReader(conn)
+        try:
+            while True:
+                packet_type, flags, body = reader.read()
+                if packet_type == protocol.CONNECT:
+                    with self._changed:
+                        self.connects += 1
+                        self._changed.notify_all()
+                    conn.sendall(protocol.packet(protocol.CONNACK, 0, b"\x00\x00"))
+                elif packet_type == protocol.PUBLISH:
+                    self._publish(conn, flags, body)
+                elif packet_type == protocol.SUBSCRIBE:
+                    self._subscribe(conn, body)
+                elif packet_type == protocol.PINGREQ:
+                    conn.sendall(protocol.packet(protocol.PINGRESP, 0))
+                elif packet_type == protocol.DISCONNECT:
+                    break
+        except (OSError, ProtocolError):
+            pass
+        finally:
+            with self._lock:
+                self.subscriptions = [s for s in self.subscriptions if s[1] is not conn]
+                if conn in self.clients:
+                    self.clients.remove(conn)
+            conn.close()
+
+    def _publish(self, conn, flags: int, body: bytes):
+        topic, payload, qos, packet_id = protocol.parse_publish(flags, body)
+        with self._changed:
+            self.messages.append((topic, payload, qos, bool(flags & 0x08)))
+            receivers = [c for f, c in self.subscriptions if topic_matches(f, topic)]
+            self._changed.notify_all()
+        if qos and self.ack:
+            conn.sendall(protocol.puback(packet_id))
+        self.deliver(topic, payload, receivers)
+
+    def _subscribe(self, conn, body: bytes):
+        offset = 2
+        codes = bytearray()
+        with self._changed:
+            while offset < len(body):
+                (length,) = protocol.U16.unpack_from(body, offset)
+                topic_filter = body[offset + 2:offset + 2 + length].decode()
+                offset += 3 + length
+                self.subscriptions.append((topic_filter, conn))
+                codes.append(0)
+            self._changed.notify_all()
+        conn.sendall(protocol.packet(protocol.SUBACK, 0, body[:2] + bytes(codes)))
+
+    def deliver(self, topic: str, payload: bytes, receivers=None):
+        """Send message to subscribers (all matching when receivers not given)"""
+        if receivers is None:
+            with self._lock:
+                receivers = [c for f, c in self.subscriptions if topic_matches(f, topic)]
+        packet = protocol.publish(topic, payload)
+        for conn in receivers:
+            try:
+                conn.sendall(packet)
+            except OSError:
+                pass
+
+    def wait(self, predicate, timeout: float = 2.0) -> bool:
+        """Wait until predicate(broker) true"""
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while not predicate(self):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._changed.wait(remaining)
+            return True
+
+    def drop_clients(self):
+        """Close all client connections, Ex: to test reconnect"""
+        with self._lock:
+            clients, self.clients = self.clients, []
+        for conn in clients:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            conn.close()
+
+    def stop(self):
+        self.server.close()
+        self.drop_clients()
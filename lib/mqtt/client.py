@@ -0,0 +1,348 @@
+import itertools
+import logging
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from devices.actions import settle
+from . import protocol
+from .protocol import PacketReader, ProtocolError
+
+logger = logging.getLogger(__name__)
+
+PINGREQ = protocol.packet(protocol.PINGREQ, 0)
+DISCONNECT = protocol.packet(protocol.DISCONNECT, 0)
+
+
+class MqttClient:
+    """Long-lived MQTT 3.1.1 connection
+
+    Connected on first use and reconnected on demand, in connect thread:
+    publishing thread never waits for broker, messages published meanwhile
+    queued and sent when connected (caller deadline bounds the wait on
+    future). Publishes pipelined: packet written and future returned at
+    once, QoS 1 future resolved by PUBACK, so many messages in flight on one
+    connection. When connection lost in-flight messages resent with DUP flag
+    after reconnect, or failed with ConnectionError when broker unavailable.
+    Reader thread handles acknowledgements, subscribed messages and
+    keepalive pings.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 1883,
+        client_id: str = None,
+        keepalive: int = 60,
+        username: str = None,
+        password: str = None,
+        connect_timeout: float = 5.0,
+        retry_interval: float = 1.0,
+        max_inflight: int = 1024,
+        clock=time.monotonic,
+    ):
+        """Create client, nothing connected until first publish/subscribe
+
+        Args:
+            host (str): broker host
+            port (int, optional): broker port. Defaults to 1883.
+            client_id (str, optional): client id. Defaults to random id.
+            keepalive (int, optional): keepalive in seconds. Defaults to 60.
+            username (str, optional): user name. Defaults to None.
+            password (str, optional): password. Defaults to None.
+            connect_timeout (float, optional): connect and CONNACK timeout in seconds. Defaults to 5.0.
+            retry_interval (float, optional): no reconnect attempts for retry_interval after failed one. Defaults to 1.0.
+            max_inflight (int, optional): max unacknowledged QoS 1 messages. Defaults to 1024.
+            clock (callable, optional): time source for tests. Defaults to time.monotonic.
+        """
+        self.host = host
+        self.port = port
+        self.client_id = client_id or f"alice-{uuid.uuid4().hex[:12]}"
+        self.keepalive = keepalive
+        self.username = username
+        self.password = password
+        self.connect_timeout = connect_timeout
+        self.retry_interval = retry_interval
+        self.max_inflight = max_inflight
+        self.clock = clock
+
+        # packet id -> (DUP packet for resend, future)
+        self.inflight = {}
+        # (packet, future, qos) published while connecting, sent on connect
+        self.queued = []
+        # topic filter -> qos, restored after reconnect
+        self.subscriptions = {}
+        # on_message(topic, payload) called in reader thread
+        self.on_message = None
+        self.sock = None
+        self.failed_at = None
+        self.closed = False
+        # Connect thread running
+        self.connecting = False
+        self.connects = 0
+        self._ids = itertools.count(1)
+        # Connection state and writes. Reentrant: futures callbacks may publish
+        self._lock = threading.RLock()
+        # Notified when connect attempt finished
+        self._attempt = threading.Condition(self._lock)
+
+    def publish(self, topic: str, payload, qos: int = 1, retain: bool = False) -> Future:
+        """Publish message without waiting for broker
+
+        Args:
+            topic (str): topic
+            payload (str|bytes): payload
+            qos (int, optional): 0 or 1. Defaults to 1.
+            retain (bool, optional): retain flag. Defaults to False.
+
+        Returns:
+            Future: resolved with None when written (QoS 0) or acknowledged (QoS 1),
+                ConnectionError when broker unavailable
+        """
+        future = Future()
+        payload = payload.encode() if isinstance(payload, str) else payload
+        with self._lock:
+            try:
+                sock = self._connected()
+                if sock is None and len(self.queued) >= self.max_inflight:
+                    raise ConnectionError("too many messages queued")
+                if not qos:
+                    if sock is None:
+                        self.queued.append((protocol.publish(topic, payload, 0, 0, retain), future, 0))
+                        return future
+                    sock.sendall(protocol.publish(topic, payload, 0, 0, retain))
+                    settle(future)
+                    return future
+                if len(self.inflight) >= self.max_inflight:
+                    raise ConnectionError("too many messages in flight")
+                packet_id = self._packet_id()
+                self.inflight[packet_id] = (protocol.publish(topic, payload, qos, packet_id, retain, dup=True), future)
+                if sock is None:
+                    self.queued.append((protocol.publish(topic, payload, qos, packet_id, retain), future, qos))
+                    return future
+            except (OSError, ProtocolError) as e:
+                settle(future, error=e if isinstance(e, ConnectionError) else ConnectionError(str(e)))
+                return future
+            try:
+                sock.sendall(protocol.publish(topic, payload, qos, packet_id, retain))
+            except OSError as e:
+                # Message stays in flight: resent after reconnect or failed
+                self._recover(sock, e)
+        return future
+
+    def subscribe(self, filters: dict):
+        """Subscribe topic filters, restored on reconnect. Messages go to on_message
+
+        Args:
+            filters (dict): topic filter -> qos
+        """
+        with self._lock:
+            # Kept when broker unavailable, new connection subscribes all of them
+            self.subscriptions.update(filters)
+            if self.sock is not None:
+                self.sock.sendall(protocol.subscribe(self._packet_id(), filters.items()))
+
+    def connect(self):
+        """Connect in calling thread when not connected, waits for connect
+        thread when it is connecting. Subscriptions restored
+
+        Raises:
+            ConnectionError: broker unavailable
+        """
+        with self._lock:
+            if self.sock is not None:
+                return
+            if self.closed:
+                raise ConnectionError("client closed")
+            own = not self.connecting
+            if own:
+                self.connecting = True
+            else:
+                self._attempt.wait(self.connect_timeout * 2)
+        if own:
+            self._connect()
+        with self._lock:
+            if self.sock is None:
+                raise ConnectionError("broker unavailable")
+
+    def close(self):
+        """Disconnect, in-flight messages failed"""
+        with self._lock:
+            self.closed = True
+            if self.sock is not None:
+                try:
+                    self.sock.sendall(DISCONNECT)
+                except OSError:
+                    pass
+            self._close()
+            self._fail(ConnectionError("client closed"))
+
+    def _packet_id(self) -> int:
+        while True:
+            packet_id = next(self._ids) % 65536
+            if packet_id and packet_id not in self.inflight:
+                return packet_id
+
+    def _connected(self):
+        """Current connection, None while connect thread (started when needed)
+        connects. Called with lock held
+
+        Raises:
+            ConnectionError: client closed or broker failed within retry_interval
+        """
+        if self.sock is not None:
+            return self.sock
+        if self.closed:
+            raise ConnectionError("client closed")
+        if self.failed_at is not None and self.clock() - self.failed_at < self.retry_interval:
+            raise ConnectionError("broker unavailable")
+        if not self.connecting:
+            self.connecting = True
+            threading.Thread(target=self._connect, name="mqtt-connect", daemon=True).start()
+        return None
+
+    def _open(self):
+        """New broker connection and its reader, called without lock"""
+        sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.sendall(protocol.connect(self.client_id, self.keepalive, self.username, self.password))
+            reader = PacketReader(sock)
+            packet_type, _, body = reader.read()
+            if packet_type != protocol.CONNACK or len(body) != 2:
+                raise ProtocolError("CONNACK expected")
+            if body[1]:
+                raise ProtocolError(
+                    "connection refused: %s" % protocol.CONNACK_ERRORS.get(body[1], body[1])
+                )
+            sock.settimeout(self.keepalive / 2 if self.keepalive else None)
+        except (OSError, ProtocolError):
+            sock.close()
+            raise
+        return sock, reader
+
+    def _connect(self):
+        """Connect attempt: queued and in-flight messages sent, or failed when broker unavailable"""
+        try:
+            sock, reader = self._open()
+        except (OSError, ProtocolError) as e:
+            with self._lock:
+                self.connecting = False
+                self.failed_at = self.clock()
+                logger.error("[MQTT]Connect to %s:%s failed: %s", self.host, self.port, e)
+                self._fail(ConnectionError(f"broker unavailable: {e}"))
+                self._attempt.notify_all()
+            return
+        with self._lock:
+            self.connecting = False
+            self._attempt.notify_all()
+            if self.closed:
+                sock.close()
+                return
+            self.sock = sock
+            self.failed_at = None
+            self.connects += 1
+            logger.info("[MQTT]Connected to %s:%s as %s", self.host, self.port, self.client_id)
+            threading.Thread(target=self._read, args=(sock, reader), name="mqtt-reader", daemon=True).start()
+            queued, self.queued = self.queued, []
+            try:
+                if self.subscriptions:
+                    sock.sendall(protocol.subscribe(self._packet_id(), self.subscriptions.items()))
+                unsent = {id(future) for _, future, _ in queued}
+                for packet_id, (packet, future) in list(self.inflight.items()):
+                    if future.done():
+                        del self.inflight[packet_id]
+                    elif id(future) not in unsent:
+                        sock.sendall(packet)
+                for packet, future, qos in queued:
+                    if not future.done():
+                        sock.sendall(packet)
+                        if not qos:
+                            settle(future)
+            except OSError as e:
+                # Not sent QoS 0 messages lost, in-flight ones resent after reconnect
+                for _, future, qos in queued:
+                    if not qos:
+                        settle(future, error=ConnectionError(str(e)))
+                self._recover(sock, e)
+
+    def _close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def _fail(self, error: Exception):
+        inflight, self.inflight = self.inflight, {}
+        queued, self.queued = self.queued, []
+        for _, future in inflight.values():
+            settle(future, error=error)
+        for _, future, _ in queued:
+            settle(future, error=error)
+
+    def _recover(self, sock, error: Exception):
+        """Connection lost: reconnect and resend in-flight messages or fail them"""
+        with self._lock:
+            if self.sock is not sock:
+                return
+            logger.warning("[MQTT]Connection to %s:%s lost: %s", self.host, self.port, error)
+            self._close()
+            if not self.inflight and not self.subscriptions:
+                return
+            try:
+                # Reconnected in connect thread
+                self._connected()
+            except ConnectionError as e:
+                self._fail(ConnectionError(f"broker unavailable: {e}"))
+
+    def _read(self, sock: socket.socket, reader: PacketReader):
+        ping_sent = False
+        while True:
+            try:
+                packet_type, flags, body = reader.read()
+            except socket.timeout:
+                if ping_sent:
+                    self._recover(sock, ConnectionError("keepalive timeout"))
+                    return
+                ping_sent = True
+                try:
+                    with self._lock:
+                        if self.sock is sock:
+                            sock.sendall(PINGREQ)
+                except OSError as e:
+                    self._recover(sock, e)
+                    return
+                continue
+            except (OSError, ProtocolError) as e:
+                self._recover(sock, e)
+                return
+            ping_sent = False
+            if packet_type == protocol.PUBACK:
+                self._acked(protocol.U16.unpack_from(body)[0])
+            elif packet_type == protocol.PUBLISH:
+                self._received(sock, flags, body)
+            elif packet_type == protocol.SUBACK and 0x80 in body[2:]:
+                logger.error("[MQTT]Subscription rejected by %s:%s", self.host, self.port)
+
+    def _acked(self, packet_id: int):
+        with self._lock:
+            entry = self.inflight.pop(packet_id, None)
+        if entry is not None:
+            settle(entry[1])
+
+    def _received(self, sock, flags: int, body: bytes):
+        topic, payload, qos, packet_id = protocol.parse_publish(flags, body)
+        if qos:
+            try:
+                with self._lock:
+                    sock.sendall(protocol.puback(packet_id))
+            except OSError:
+                pass
+        if self.on_message is not None:
+            try:
+                self.on_message(topic, payload)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("[MQTT]Message handler failed for %s", topic)
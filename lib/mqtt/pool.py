@@ -0,0 +1,51 @@
+import itertools
+import threading
+from .client import MqttClient
+
+
+class MqttPool:
+    """Process MQTT clients, publishes spread round-robin
+
+    Clients created on first use and kept for process life. Not fork safe:
+    create pool in worker (Ex: runtime.Lazy reset after fork).
+    """
+
+    def __init__(self, factory, size: int = 1):
+        """Create pool
+
+        Args:
+            factory (callable): returns new MqttClient
+            size (int, optional): max clients. Defaults to 1.
+        """
+        self.factory = factory
+        self.size = size
+        self.clients = []
+        self._lock = threading.Lock()
+        self._next = itertools.count()
+
+    def client(self) -> MqttClient:
+        index = next(self._next) % self.size
+        if index >= len(self.clients):
+            with self._lock:
+                while len(self.clients) <= index:
+                    self.clients.append(self.factory())
+        return self.clients[index]
+
+    def publish(self, topic: str, payload, qos: int = 1, retain: bool = False):
+        """See MqttClient.publish"""
+        return self.client().publish(topic, payload, qos, retain)
+
+    def close(self):
+        with self._lock:
+            clients, self.clients = self.clients, []
+        for client in clients:
+            client.close()
+
+    def stats(self) -> dict:
+        clients = list(self.clients)
+        return {
+            "clients": len(clients),
+            "connected": sum(1 for c in clients if c.sock is not None),
+            "connects": sum(c.connects for c in clients),
+            "inflight": sum(len(c.inflight) for c in clients),
+        }
@@ -0,0 +1,139 @@
+"""MQTT 3.1.1 packets, only what publisher/subscriber need
+
+See: http://docs.oasis-open.org/mqtt/mqtt/v3.1.1/os/mqtt-v3.1.1-os.html
+"""
+import struct
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+PROTOCOL_LEVEL = 4
+U16 = struct.Struct("!H")
+
+CONNACK_ERRORS = {
+    1: "unacceptable protocol version",
+    2: "identifier rejected",
+    3: "server unavailable",
+    4: "bad user name or password",
+    5: "not authorized",
+}
+
+
+class ProtocolError(Exception):
+    """Malformed packet or connection refused by broker"""
+
+
+def encode_string(value) -> bytes:
+    data = value.encode() if isinstance(value, str) else value
+    return U16.pack(len(data)) + data
+
+
+def encode_length(length: int) -> bytes:
+    ret = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        ret.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(ret)
+
+
+def packet(packet_type: int, flags: int, body: bytes = b"") -> bytes:
+    return bytes((packet_type << 4 | flags,)) + encode_length(len(body)) + body
+
+
+def connect(client_id: str, keepalive: int, username: str = None, password: str = None, clean: bool = True) -> bytes:
+    flags = (0x02 if clean else 0) | (0x80 if username is not None else 0) | (0x40 if password is not None else 0)
+    body = encode_string("MQTT") + bytes((PROTOCOL_LEVEL, flags)) + U16.pack(keepalive) + encode_string(client_id)
+    if username is not None:
+        body += encode_string(username)
+    if password is not None:
+        body += encode_string(password)
+    return packet(CONNECT, 0, body)
+
+
+def publish(topic: str, payload: bytes, qos: int = 0, packet_id: int = 0, retain: bool = False, dup: bool = False) -> bytes:
+    flags = (0x08 if dup else 0) | qos << 1 | (0x01 if retain else 0)
+    body = encode_string(topic) + (U16.pack(packet_id) if qos else b"") + payload
+    return packet(PUBLISH, flags, body)
+
+
+def puback(packet_id: int) -> bytes:
+    return packet(PUBACK, 0, U16.pack(packet_id))
+
+
+def subscribe(packet_id: int, filters) -> bytes:
+    """SUBSCRIBE for (topic filter, qos) pairs"""
+    body = U16.pack(packet_id) + b"".join(encode_string(f) + bytes((qos,)) for f, qos in filters)
+    return packet(SUBSCRIBE, 0x02, body)
+
+
+def parse_publish(flags: int, body: bytes):
+    """PUBLISH body to (topic, payload, qos, packet id)"""
+    qos = flags >> 1 & 0x03
+    (length,) = U16.unpack_from(body, 0)
+    topic = body[2:2 + length].decode()
+    offset = 2 + length
+    packet_id = 0
+    if qos:
+        (packet_id,) = U16.unpack_from(body, offset)
+        offset += 2
+    return topic, body[offset:], qos, packet_id
+
+
+class PacketReader:
+    """Packets from socket stream
+
+    Received bytes buffered, so socket timeout (used for keepalive) never
+    loses partially read packet.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+
+    def read(self):
+        """Next packet
+
+        Raises:
+            ConnectionError: connection closed
+            socket.timeout: nothing received in socket timeout
+            ProtocolError: malformed remaining length
+
+        Returns:
+            tuple: (packet type, flags, body)
+        """
+        while True:
+            parsed = self.parse()
+            if parsed is not None:
+                return parsed
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("connection closed")
+            self.buffer += chunk
+
+    def parse(self):
+        buffer = self.buffer
+        length = 0
+        for i in range(1, 5):
+            if i >= len(buffer):
+                return None
+            byte = buffer[i]
+            length |= (byte & 0x7F) << 7 * (i - 1)
+            if not byte & 0x80:
+                break
+        else:
+            raise ProtocolError("malformed remaining length")
+        end = i + 1 + length
+        if len(buffer) < end:
+            return None
+        first = buffer[0]
+        body = bytes(buffer[i + 1:end])
+        del buffer[:end]
+        return first >> 4, first & 0x0F, body
@@ -0,0 +1,72 @@
+class Node:
+    __slots__ = ("children", "values", "rest")
+
+    def __init__(self):
+        # topic level (or +) -> Node
+        self.children = {}
+        # values of patterns ending here
+        self.values = []
+        # values of patterns with # after this level
+        self.rest = []
+
+
+class TopicTrie:
+    """Values by MQTT topic pattern, patterns may use + and # wildcards
+
+    Match walks topic levels, so cost depends on topic depth and wildcard
+    branches, not on number of patterns.
+    """
+
+    __slots__ = ("root", "size")
+
+    def __init__(self, items=()):
+        """Create trie
+
+        Args:
+            items (iterable, optional): (pattern, value) pairs. Defaults to ().
+        """
+        self.root = Node()
+        self.size = 0
+        for pattern, value in items:
+            self.add(pattern, value)
+
+    def add(self, pattern: str, value):
+        node = self.root
+        for level in pattern.split("/"):
+            if level == "#":
+                node.rest.append(value)
+                self.size += 1
+                return
+            child = node.children.get(level)
+            if child is None:
+                child = node.children[level] = Node()
+            node = child
+        node.values.append(value)
+        self.size += 1
+
+    def match(self, topic: str) -> list:
+        """Values of all patterns matching topic"""
+        ret = []
+        nodes = (self.root,)
+        for level in topic.split("/"):
+            found = []
+            for node in nodes:
+                if node.rest:
+                    ret.extend(node.rest)
+                child = node.children.get(level)
+                if child is not None:
+                    found.append(child)
+                child = node.children.get("+")
+                if child is not None:
+                    found.append(child)
+            if not found:
+                return ret
+            nodes = found
+        for node in nodes:
+            ret.extend(node.values)
+            # "a/#" matches "a" too
+            ret.extend(node.rest)
+        return ret
+
+    def __len__(self):
+        return self.size
@@ -0,0 +1,3 @@
+from .lazy import Lazy, created, reset
+from .fork import on_fork, after_fork, freeze
+from .services import Services
@@ -0,0 +1,53 @@
+import gc
+import logging
+import os
+import weakref
+
+logger = logging.getLogger(__name__)
+
+# Hook references, see on_fork
+_fork_hooks = []
+
+
+def _prune():
+    _fork_hooks[:] = [ref for ref in _fork_hooks if ref() is not None]
+
+
+def on_fork(hook):
+    """Register hook called in child process after fork
+
+    Hooks should drop resources inherited from parent (connections,
+    thread pools, locks) without closing them, parent still uses them.
+    Bound methods held by weak reference, so hook of dropped object (Ex:
+    Services of app created in tests) removed with it.
+    """
+    _prune()
+    if hasattr(hook, "__self__") and hasattr(hook, "__func__"):
+        _fork_hooks.append(weakref.WeakMethod(hook))
+    else:
+        _fork_hooks.append(lambda: hook)
+    return hook
+
+
+def after_fork():
+    """Run fork hooks. Called automatically on os.fork, can be called by server post_fork hook"""
+    logger.debug("Post fork hooks in %s", os.getpid())
+    _prune()
+    for ref in list(_fork_hooks):
+        hook = ref()
+        if hook is not None:
+            hook()
+
+
+def freeze():
+    """Freeze objects created so far before forking workers
+
+    Moves all objects to permanent GC generation, so collections in
+    workers do not touch (and copy) pages shared with parent.
+    """
+    gc.collect()
+    gc.freeze()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=after_fork)
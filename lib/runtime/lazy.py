@@ -0,0 +1,45 @@
+import threading
+
+
+class Lazy:
+    """Proxy creating object with factory on first use
+
+    Attribute access and assignment forwarded to created object, call
+    returns object itself. See reset() to recreate object (Ex: after fork).
+    Proxy has no public methods, so it never shadows object attributes.
+    """
+
+    def __init__(self, factory):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_instance", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def __call__(self):
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                instance = self._instance
+                if instance is None:
+                    instance = self._factory()
+                    object.__setattr__(self, "_instance", instance)
+        return instance
+
+    def __getattr__(self, name):
+        return getattr(self(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self(), name)
+
+
+def created(lazy: Lazy) -> bool:
+    """Object already created, Ex: to report stats without creating it"""
+    return lazy._instance is not None
+
+
+def reset(lazy: Lazy):
+    """Drop created object without closing it. Used in forked child"""
+    object.__setattr__(lazy, "_instance", None)
+    object.__setattr__(lazy, "_lock", threading.Lock())
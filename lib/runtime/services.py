@@ -0,0 +1,311 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from aio import AsyncBackend
+from cache import CatalogCache, DeviceListCache, TokenCache
+from db import ConnectionPool, ThreadConnection, load_device_params, load_yandex_devices_by_ids, save_yandex_devices
+from integrations.coalescer import CommandCoalescer
+from integrations.resolver import DeviceResolver
+from integrations.validation import CatalogValidator
+from state import StateStore, StateJournal, StateIngest
+from mqtt import MqttClient, MqttPool
+from dispatch import DispatcherClient, RemoteDriver
+from drivers import register_driver
+from drivers.mqtt import DriverMqtt
+from drivers.codebook import Codebook
+from drivers.scheduler import TransmitScheduler
+from metrics import REGISTRY, BACKEND_LATENCY, timed
+from .lazy import Lazy, created, reset
+from .fork import on_fork
+
+logger = logging.getLogger(__name__)
+
+# Parent values are not worker values
+on_fork(REGISTRY.reset)
+
+
+class Services:
+    """Process resources shared by request handlers
+
+    Everything created on first use, so importing and creating app is cheap
+    and safe before fork. After fork resources inherited from parent are
+    dropped and recreated in child on first use.
+    """
+
+    def __init__(self, config, get_backend, validate_token=None, load_user=None):
+        """Create services
+
+        Args:
+            config: settings module or object, options read with getattr
+            get_backend (callable): returns backend module (Ex: lib.backend.alice)
+            validate_token (callable, optional): validate_token(token) returns token claims
+            load_user (callable, optional): load_user(user_id) returns user. Defaults to backend.load_user
+        """
+        self.config = config
+        self.get_backend = get_backend
+        self.validate_token = validate_token
+        self.load_user = load_user or (lambda user_id: self.backend.load_user(user_id))
+
+        self.pool = Lazy(self.create_pool)
+        # Every thread gets own pooled connection, released after request
+        self.connection = ThreadConnection(self.pool)
+        self.validator = Lazy(CatalogValidator)
+        self.catalog = Lazy(self.create_catalog)
+        self.device_lists = Lazy(lambda: DeviceListCache(maxsize=self.option("CATALOG_CACHE_SIZE", 1024)))
+        self.state = Lazy(self.create_state)
+        self.coalescer = Lazy(CommandCoalescer)
+        self.resolver = Lazy(self.create_resolver)
+        self.token_cache = Lazy(self.create_token_cache)
+        # Gateway connections, see drivers.mqtt.DriverMqtt
+        self.mqtt = Lazy(self.create_mqtt)
+        # Gateway transmissions serialized per channel, see drivers.scheduler
+        self.transmit = Lazy(self.create_transmit)
+        # Device reports to state store, see start_ingest
+        self.ingest = Lazy(self.create_ingest)
+        # Web worker connection to dispatcher process, see register_drivers
+        self.dispatcher = Lazy(lambda: DispatcherClient(self.option("DISPATCHER_SOCKET")))
+        # Async mode: backend and sync drivers calls run in executor
+        self.executor = Lazy(lambda: ThreadPoolExecutor(self.option("ASYNC_WORKERS", 32), thread_name_prefix="backend"))
+        self.abackend = AsyncBackend(Lazy(lambda: self.backend), self.executor, after_call=self.release)
+        on_fork(self.after_fork)
+
+    def option(self, name: str, default=None):
+        return getattr(self.config, name, default)
+
+    @property
+    def backend(self):
+        """Backend with calls latency observed, see metrics.BACKEND_LATENCY"""
+        return timed(self.get_backend())
+
+    def create_pool(self) -> ConnectionPool:
+        import mysql.connector
+
+        config = {
+            "user": self.option("DB_USER"),
+            "password": self.option("DB_PASS"),
+            "host": self.option("DB_HOST", "localhost"),
+            "database": self.option("DB_NAME"),
+            "raise_on_warnings": True,
+        }
+        logger.debug("Create DB pool")
+        return ConnectionPool(
+            lambda: mysql.connector.connect(**config),
+            size=self.option("DB_POOL_SIZE", 8),
+            timeout=self.option("DB_POOL_TIMEOUT", 5.0),
+            ping_interval=self.option("DB_POOL_PING_INTERVAL", 30),
+        )
+
+    def create_catalog(self) -> CatalogCache:
+        return CatalogCache(
+            lambda user_id: self.backend.load_yandex_devices(user_id),
+            maxsize=self.option("CATALOG_CACHE_SIZE", 1024),
+            ttl=self.option("CATALOG_CACHE_TTL", 300),
+            ids_loader=self.load_devices_by_ids,
+            async_loader=lambda user_id: self.abackend.load_yandex_devices(user_id),
+            validator=self.validator if self.option("CATALOG_VALIDATE", True) else None,
+        )
+
+    def create_state(self) -> StateStore:
+        """State store, restored from STATE_DIR journal when configured"""
+        directory = self.option("STATE_DIR")
+        journal = None
+        if directory:
+            journal = StateJournal(directory, max_log_size=self.option("STATE_LOG_SIZE", 4 * 1024 * 1024))
+        store = StateStore(
+            max_age=self.option("STATE_MAX_AGE", 30),
+            journal=journal,
+            restore_max_age=self.option("STATE_RESTORE_MAX_AGE", 3600),
+        )
+        if journal is not None:
+            logger.info("[STATE]Restored %s entries from %s", store.restore(), directory)
+        return store
+
+    def create_resolver(self) -> DeviceResolver:
+        return DeviceResolver(
+            max_workers=self.option("RESOLVE_WORKERS", 16),
+            timeout=self.option("RESOLVE_TIMEOUT", 2.5),
+            store=self.state,
+            coalescer=self.coalescer if self.option("COALESCE_COMMANDS", True) else None,
+        )
+
+    def create_mqtt_client(self) -> MqttClient:
+        return MqttClient(
+            self.option("MQTT_HOST"),
+            self.option("MQTT_PORT", 1883),
+            keepalive=self.option("MQTT_KEEPALIVE", 60),
+            username=self.option("MQTT_USER"),
+            password=self.option("MQTT_PASSWORD"),
+        )
+
+    def create_mqtt(self) -> MqttPool:
+        return MqttPool(self.create_mqtt_client, size=self.option("MQTT_POOL_SIZE", 1))
+
+    def create_transmit(self) -> TransmitScheduler:
+        qos = self.option("MQTT_QOS", 1)
+        return TransmitScheduler(
+            lambda topic, payload: self.mqtt.publish(topic, payload, qos),
+            gap=self.option("TRANSMIT_GAP", 0.05),
+            repeats=self.option("TRANSMIT_REPEATS", 1),
+            timeout=self.option("MQTT_TIMEOUT", 2.0),
+        )
+
+    def start_ingest(self):
+        """Start state feed once per process when MQTT_STATE_TOPICS configured
+
+        Cheap after first call, safe on request path: index load and broker
+        connection run (and retried) in ingest thread.
+        """
+        if created(self.ingest) or not (self.option("MQTT_HOST") and self.option("MQTT_STATE_TOPICS")):
+            return
+        self.ingest()
+
+    def create_ingest(self) -> StateIngest:
+        """Subscribe MQTT_STATE_TOPICS (relative to MQTT_PREFIX) on own connection"""
+        ingest = StateIngest(
+            self.state,
+            self.load_device_params,
+            prefix=self.option("MQTT_PREFIX"),
+            topics=self.option("MQTT_STATE_TOPICS", ("#",)),
+            batch_size=self.option("INGEST_BATCH_SIZE", 512),
+            flush_interval=self.option("INGEST_FLUSH_INTERVAL", 0.05),
+            refresh_interval=self.option("INGEST_REFRESH_INTERVAL", 300),
+            retry_interval=self.option("INGEST_RETRY_INTERVAL", 5),
+        )
+        ingest.start(self.create_mqtt_client())
+        return ingest
+
+    def load_device_params(self):
+        try:
+            with BACKEND_LATENCY.time("load_device_params"):
+                return load_device_params(self.connection)
+        finally:
+            self.connection.release()
+
+    def register_drivers(self):
+        """Register configured drivers
+
+        With DISPATCHER_SOCKET drivers named in DISPATCH_DRIVERS run by
+        dispatcher process (see dispatcher.py) and registered as proxies,
+        so web workers keep no driver connections.
+        """
+        if not self.option("DISPATCHER_SOCKET"):
+            self.register_local_drivers()
+            return
+        for name in self.option("DISPATCH_DRIVERS", ("mqtt",)):
+            register_driver(
+                RemoteDriver(
+                    name,
+                    self.dispatcher,
+                    timeout=self.option("DISPATCH_TIMEOUT", 5.0),
+                    wire_params=self.option("DISPATCH_PARAMS", RemoteDriver.WIRE_PARAMS),
+                )
+            )
+
+    def register_local_drivers(self):
+        """Register drivers owning device connections, in web worker or dispatcher"""
+        if self.option("MQTT_HOST"):
+            register_driver(
+                DriverMqtt(
+                    self.mqtt,
+                    prefix=self.option("MQTT_PREFIX"),
+                    qos=self.option("MQTT_QOS", 1),
+                    timeout=self.option("MQTT_TIMEOUT", 2.0),
+                    scheduler=self.transmit if self.option("TRANSMIT_SCHEDULE", True) else None,
+                    codebook=Codebook(self.option("CODEBOOK_SIZE", 65536)),
+                )
+            )
+
+    def create_token_cache(self) -> TokenCache:
+        return TokenCache(
+            self.validate_token,
+            self.load_user,
+            maxsize=self.option("TOKEN_CACHE_SIZE", 10000),
+            ttl=self.option("TOKEN_CACHE_TTL", 300),
+        )
+
+    def load_devices_by_ids(self, user_id, device_ids):
+        """Requested user devices in one indexed query, see db.load_yandex_devices_by_ids"""
+        try:
+            with BACKEND_LATENCY.time("load_yandex_devices_by_ids"):
+                return load_yandex_devices_by_ids(self.connection, user_id, device_ids)
+        finally:
+            self.connection.release()
+
+    def save_devices(self, user_id, devices: list) -> int:
+        """Validate and write user devices, cached catalog dropped. See tools/catalog.py import
+
+        Raises:
+            CatalogValidationError: with all violations found, nothing written
+        """
+        try:
+            with BACKEND_LATENCY.time("save_yandex_devices"):
+                count = save_yandex_devices(self.connection, user_id, devices, self.validator)
+        finally:
+            self.connection.release()
+        self.catalog.invalidate(user_id)
+        self.device_lists.invalidate(user_id)
+        return count
+
+    def cache_stats(self) -> dict:
+        """Stats of created caches by name"""
+        caches = {"catalog": self.catalog, "device_lists": self.device_lists, "tokens": self.token_cache, "state": self.state}
+        return {name: cache.stats() for name, cache in caches.items() if created(cache)}
+
+    def register_metrics(self, registry=REGISTRY):
+        """Export caches and DB pool stats, replaces metrics of other services"""
+
+        def cache_stat(key):
+            return lambda: (((name,), stats[key]) for name, stats in self.cache_stats().items())
+
+        def pool_stats():
+            if created(self.pool):
+                yield from (((key,), value) for key, value in self.pool.stats().items())
+
+        for name, documentation, key, kind in (
+            ("alice_cache_hits_total", "Cache hits", "hits", "counter"),
+            ("alice_cache_misses_total", "Cache misses", "misses", "counter"),
+            ("alice_cache_hit_ratio", "Cache hit ratio", "hit_rate", "gauge"),
+            ("alice_cache_size", "Cache entries", "size", "gauge"),
+        ):
+            registry.unregister(name)
+            registry.callback(name, documentation, ("cache",), cache_stat(key), kind)
+        def ingest_stats():
+            if created(self.ingest):
+                yield from (((key,), value) for key, value in self.ingest.stats().items())
+
+        def transmit_queues():
+            if created(self.transmit):
+                yield from (((channel,), depth) for channel, depth in self.transmit.stats().items())
+
+        registry.unregister("alice_transmit_queue")
+        registry.callback("alice_transmit_queue", "Gateway transmissions queued by channel", ("channel",), transmit_queues)
+        registry.unregister("alice_state_ingest")
+        registry.callback("alice_state_ingest", "MQTT state ingest stats", ("stat",), ingest_stats)
+        registry.unregister("alice_db_pool")
+        registry.callback("alice_db_pool", "DB connection pool stats", ("stat",), pool_stats)
+
+    def release(self):
+        """Release connection of current thread, call at the end of request"""
+        self.connection.release()
+
+    def after_fork(self):
+        """Drop resources inherited from parent"""
+        self.connection.reset()
+        if created(self.state) and self.state.journal is not None:
+            # Parent journal descriptor and queue, child opens own on first use
+            self.state.journal.close(flush=False)
+        resources = (
+            self.pool,
+            self.catalog,
+            self.device_lists,
+            self.state,
+            self.coalescer,
+            self.resolver,
+            self.token_cache,
+            self.mqtt,
+            self.transmit,
+            self.ingest,
+            self.dispatcher,
+            self.executor,
+        )
+        for resource in resources:
+            reset(resource)
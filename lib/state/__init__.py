@@ -0,0 +1,3 @@
+from .store import StateStore
+from .journal import StateJournal, JournalError
+from .ingest import StateIngest
@@ -0,0 +1,231 @@
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+from mqtt.trie import TopicTrie
+
+logger = logging.getLogger(__name__)
+
+# name None: payload is json object {name: value}
+Route = namedtuple("Route", ["device_id", "name", "instance"])
+
+# State instance of capabilities, properties instance is property name
+INSTANCES = {"on_off": "on"}
+BOOLEANS = {"on": True, "off": False, "true": True, "false": False}
+
+
+def instance_of(name: str) -> str:
+    return INSTANCES.get(name, name)
+
+
+def device_routes(device_id, params) -> list:
+    """Topic patterns of device reports from device driver params
+
+    Params:
+        state_topic: topic of json object payload {name: value}. Ex: sensors/kitchen
+        state_topics: topic per capability/property, plain value payload.
+            Ex: {"temperature": "sensors/kitchen/t", "range": {"topic": "dimmer/1", "instance": "brightness"}}
+
+    Returns:
+        list: (pattern, Route) pairs, patterns relative to MQTT_PREFIX
+    """
+    params = params or {}
+    device_id = str(device_id)
+    ret = []
+    topic = params.get("state_topic")
+    if topic:
+        ret.append((topic.strip("/"), Route(device_id, None, None)))
+    for name, spec in (params.get("state_topics") or {}).items():
+        if isinstance(spec, dict):
+            topic, instance = spec.get("topic"), spec.get("instance") or instance_of(name)
+        else:
+            topic, instance = spec, instance_of(name)
+        if topic:
+            ret.append((topic.strip("/"), Route(device_id, name, instance)))
+    return ret
+
+
+def decode_payload(payload: bytes):
+    """Report value: number, on/off/true/false as bool, json or text"""
+    text = payload.decode(errors="replace").strip()
+    boolean = BOOLEANS.get(text.lower())
+    if boolean is not None:
+        return boolean
+    try:
+        return float(text) if "." in text or "e" in text.lower() else int(text)
+    except ValueError:
+        pass
+    if text[:1] in ("{", "["):
+        try:
+            return json.loads(text)
+        except ValueError:
+            pass
+    return text
+
+
+class StateIngest:
+    """Device reports from MQTT to state store
+
+    Subscribes wildcard topics under prefix and matches incoming topics
+    against TopicTrie built from all devices driver params (see
+    device_routes), so matching cost does not grow with devices count.
+    Decoded values collected and written to store in batches by flusher
+    thread (or at once when batch is full). Index rebuilt every
+    refresh_interval to pick device changes.
+
+    Index load and broker connection done in ingest thread and retried
+    every retry_interval, so requests never wait for or fail on state feed.
+    """
+
+    def __init__(
+        self,
+        store,
+        load_devices,
+        prefix: str = None,
+        topics=("#",),
+        batch_size: int = 512,
+        flush_interval: float = 0.05,
+        refresh_interval: float = 300,
+        retry_interval: float = 5,
+    ):
+        """Create ingest
+
+        Args:
+            store (StateStore): state store
+            load_devices (callable): returns (device_id, params) list of all devices
+            prefix (str, optional): MQTT_PREFIX, device topics are relative to it. Defaults to None.
+            topics (iterable, optional): subscribed topic filters relative to prefix. Defaults to ("#",).
+            batch_size (int, optional): values written at once. Defaults to 512.
+            flush_interval (float, optional): max delay of value in seconds. Defaults to 0.05.
+            refresh_interval (float, optional): index rebuild interval in seconds. Defaults to 300.
+            retry_interval (float, optional): index load and broker connect retry interval in seconds. Defaults to 5.
+        """
+        self.store = store
+        self.load_devices = load_devices
+        self.prefix = prefix.strip("/") + "/" if prefix else ""
+        self.topics = tuple(topics)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        # Index built at least once, reports matched from then on
+        self.ready = False
+        self.trie = TopicTrie()
+        self.pending = []
+        self.client = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        # Approximate, for monitoring only
+        self.messages = 0
+        self.unmatched = 0
+        self.updates = 0
+
+    def rebuild(self) -> int:
+        """Build index from devices, replaces current one at once
+
+        Returns:
+            int: routes in index
+        """
+        trie = TopicTrie(
+            route for device_id, params in self.load_devices() for route in device_routes(device_id, params)
+        )
+        self.trie = trie
+        logger.info("[INGEST]Index built: %s routes", len(trie))
+        return len(trie)
+
+    def subscriptions(self) -> dict:
+        """Topic filters with qos"""
+        return {self.prefix + topic.strip("/"): 0 for topic in self.topics}
+
+    def on_message(self, topic: str, payload: bytes):
+        """MQTT message handler, called in client reader thread"""
+        self.messages += 1
+        if self.prefix:
+            if not topic.startswith(self.prefix):
+                self.unmatched += 1
+                return
+            topic = topic[len(self.prefix):]
+        routes = self.trie.match(topic)
+        if not routes:
+            self.unmatched += 1
+            return
+        value = decode_payload(payload)
+        batch = []
+        for route in routes:
+            if route.name is not None:
+                batch.append((route.device_id, route.name, route.instance, value))
+            elif isinstance(value, dict):
+                batch.extend((route.device_id, name, instance_of(name), v) for name, v in value.items())
+        with self._lock:
+            self.pending.extend(batch)
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """Write collected values to store"""
+        with self._lock:
+            batch, self.pending = self.pending, []
+        if not batch:
+            return 0
+        count = self.store.set_many(batch)
+        self.updates += count
+        return count
+
+    def start(self, client):
+        """Start ingest thread: builds index and subscribes with client (MqttClient)"""
+        self.client = client
+        client.on_message = self.on_message
+        threading.Thread(target=self._run, name="state-ingest", daemon=True).start()
+
+    def connect(self) -> bool:
+        """Build index when not built and (re)connect client, restores subscriptions
+
+        Returns:
+            bool: index built and client connected, errors logged
+        """
+        try:
+            if not self.ready:
+                self.rebuild()
+                self.ready = True
+            if not self.client.subscriptions:
+                self.client.subscribe(self.subscriptions())
+            if self.client.sock is None:
+                self.client.connect()
+            return True
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning("[INGEST]Not started, retry in %ss: %s", self.retry_interval, e)
+            return False
+
+    def _run(self):
+        refreshed = time.monotonic()
+        retry_at = 0
+        while True:
+            now = time.monotonic()
+            if now >= retry_at and (not self.ready or self.client.sock is None):
+                if not self.connect():
+                    retry_at = now + self.retry_interval
+            if self._stop.wait(self.flush_interval):
+                return
+            try:
+                self.flush()
+                if self.ready and time.monotonic() - refreshed >= self.refresh_interval:
+                    refreshed = time.monotonic()
+                    self.rebuild()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("[INGEST]Flush failed")
+
+    def stop(self):
+        self._stop.set()
+        if self.client is not None:
+            self.client.close()
+        self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "messages": self.messages,
+            "unmatched": self.unmatched,
+            "updates": self.updates,
+            "routes": len(self.trie),
+        }
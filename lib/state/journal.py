@@ -0,0 +1,293 @@
+"""Durable device state: append-only change log and compacted snapshot
+
+Files in state directory:
+    state.snapshot  all entries at last compaction
+    state.log       changes after last compaction
+
+Both files: header (magic, format version) and records. Record is
+length (u32), crc32 (u32) and json payload [device_id, name, instance,
+value, wall time]. Writers append whole records with single write() under
+shared flock, so prefork workers can share one directory. Changes queued
+and written by journal writer thread, so request threads never wait for
+disk. Compaction (in writer thread too) takes exclusive lock, merges
+snapshot and log into new snapshot and truncates log. Files read with
+mmap on startup, torn tail of log (crash while writing) dropped.
+"""
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+VERSION = 1
+LOG_MAGIC = b"ASTL"
+SNAPSHOT_MAGIC = b"ASTS"
+HEADER = struct.Struct("<4sHH")
+RECORD = struct.Struct("<II")
+
+LOG_FILE = "state.log"
+SNAPSHOT_FILE = "state.snapshot"
+
+
+class JournalError(Exception):
+    """Unreadable journal file: wrong magic or unsupported version"""
+
+
+def header(magic: bytes) -> bytes:
+    return HEADER.pack(magic, VERSION, 0)
+
+
+def encode_record(entry) -> bytes:
+    """Record bytes for entry (device_id, name, instance, value, wall)"""
+    payload = json.dumps(entry, separators=(",", ":")).encode()
+    return RECORD.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def scan(path: str, magic: bytes):
+    """Read records of journal file
+
+    Args:
+        path (str): file path
+        magic (bytes): expected file magic
+
+    Raises:
+        JournalError: wrong magic or version
+
+    Returns:
+        tuple: (entries list, valid length in bytes, problem description or None)
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return [], 0, None
+    try:
+        size = os.fstat(fd).st_size
+        if size == 0:
+            return [], 0, None
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as data:
+            if size < HEADER.size:
+                return [], 0, "truncated header"
+            file_magic, version, _ = HEADER.unpack_from(data, 0)
+            if file_magic != magic:
+                raise JournalError(f"{path}: not a state journal file")
+            if version != VERSION:
+                raise JournalError(f"{path}: unsupported format version {version}")
+            entries = []
+            offset = HEADER.size
+            while offset < size:
+                if offset + RECORD.size > size:
+                    return entries, offset, f"truncated record at {offset}"
+                length, crc = RECORD.unpack_from(data, offset)
+                start = offset + RECORD.size
+                payload = data[start:start + length]
+                if len(payload) < length:
+                    return entries, offset, f"truncated record at {offset}"
+                if zlib.crc32(payload) != crc:
+                    return entries, offset, f"checksum mismatch at {offset}"
+                entries.append(json.loads(payload))
+                offset = start + length
+            return entries, offset, None
+    finally:
+        os.close(fd)
+
+
+def merge(*sources) -> dict:
+    """Latest entry per (device_id, name), by wall time then order"""
+    ret = {}
+    for entries in sources:
+        for entry in entries:
+            key = (entry[0], entry[1])
+            current = ret.get(key)
+            if current is None or entry[4] >= current[4]:
+                ret[key] = entry
+    return ret
+
+
+class StateJournal:
+    """Append-only state log with periodic compaction, see module doc"""
+
+    def __init__(self, directory: str, max_log_size: int = 4 * 1024 * 1024):
+        """Open journal, directory created if missing
+
+        Args:
+            directory (str): state directory
+            max_log_size (int, optional): compact when log grows over it. Defaults to 4 MiB.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.log_path = os.path.join(directory, LOG_FILE)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.max_log_size = max_log_size
+        # Changes not written yet, taken by writer thread
+        self.pending = []
+        self.writer = None
+        self.closed = False
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self.fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        with self.locked(fcntl.LOCK_EX):
+            self._repair()
+        self.log_size = os.fstat(self.fd).st_size
+
+    @contextmanager
+    def locked(self, operation):
+        fcntl.flock(self.fd, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _repair(self):
+        """Write header to new log, drop torn tail. Called under exclusive lock"""
+        _, valid, problem = scan(self.log_path, LOG_MAGIC)
+        if valid == 0:
+            os.ftruncate(self.fd, 0)
+            os.write(self.fd, header(LOG_MAGIC))
+        elif problem:
+            logger.warning("[STATE]Log %s: %s, truncated to %s bytes", self.log_path, problem, valid)
+            os.ftruncate(self.fd, valid)
+
+    def load(self) -> list:
+        """All entries from snapshot and log, latest per device value"""
+        with self.locked(fcntl.LOCK_SH):
+            snapshot, _, _ = scan(self.snapshot_path, SNAPSHOT_MAGIC)
+            log, _, _ = scan(self.log_path, LOG_MAGIC)
+        return list(merge(snapshot, log).values())
+
+    def append(self, device_id, name: str, instance: str, value, wall: float):
+        """Queue change for writer thread, see append_many"""
+        self.append_many([[str(device_id), name, instance, value, wall]])
+
+    def append_many(self, entries: list):
+        """Queue changes [device_id, name, instance, value, wall]
+
+        Caller never waits for disk: writer thread appends queued changes
+        with one write and compacts log when it grows over max_log_size.
+        """
+        with self._lock:
+            self.pending.extend(entries)
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._run, name="state-journal", daemon=True)
+                self.writer.start()
+        self._wake.set()
+
+    def _run(self):
+        while not self.closed:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("[STATE]Journal write failed")
+
+    def flush(self) -> int:
+        """Write queued changes now
+
+        Returns:
+            int: changes written
+        """
+        with self._write_lock:
+            with self._lock:
+                entries, self.pending = self.pending, []
+            if not entries or self.fd is None:
+                return 0
+            record = b"".join(encode_record(entry) for entry in entries)
+            with self.locked(fcntl.LOCK_SH):
+                os.write(self.fd, record)
+            self.log_size += len(record)
+            if self.log_size > self.max_log_size:
+                self.compact()
+            return len(entries)
+
+    def compact(self) -> int:
+        """Merge log into snapshot and truncate log
+
+        Returns:
+            int: entries in new snapshot
+        """
+        with self.locked(fcntl.LOCK_EX):
+            count = compact_files(self.snapshot_path, self.log_path, self.fd)
+            self.log_size = os.fstat(self.fd).st_size
+        return count
+
+    def close(self, flush: bool = True):
+        """Stop writer and close log
+
+        Args:
+            flush (bool, optional): write queued changes first. False in forked
+                child, parent writes them. Defaults to True.
+        """
+        self.closed = True
+        self._wake.set()
+        if not flush:
+            # Writer thread and its lock not inherited in usable state
+            self.pending = []
+            self._close_fd()
+            return
+        self.flush()
+        with self._write_lock:
+            self._close_fd()
+
+    def _close_fd(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def compact_files(snapshot_path: str, log_path: str, log_fd: int) -> int:
+    """Write merged snapshot atomically and truncate log, caller holds exclusive lock"""
+    snapshot, _, _ = scan(snapshot_path, SNAPSHOT_MAGIC)
+    log, _, _ = scan(log_path, LOG_MAGIC)
+    entries = merge(snapshot, log)
+    tmp_path = snapshot_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header(SNAPSHOT_MAGIC))
+        for entry in entries.values():
+            f.write(encode_record(entry))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, snapshot_path)
+    directory = os.open(os.path.dirname(snapshot_path) or ".", os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+    os.ftruncate(log_fd, HEADER.size)
+    logger.debug("[STATE]Compacted %s entries", len(entries))
+    return len(entries)
+
+
+def verify(directory: str) -> dict:
+    """Check journal files
+
+    Returns:
+        dict: per file records count, valid bytes, size and problem
+    """
+    ret = {}
+    for name, magic in ((SNAPSHOT_FILE, SNAPSHOT_MAGIC), (LOG_FILE, LOG_MAGIC)):
+        path = os.path.join(directory, name)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        try:
+            entries, valid, problem = scan(path, magic)
+        except JournalError as e:
+            entries, valid, problem = [], 0, str(e)
+        ret[name] = {"records": len(entries), "valid": valid, "size": size, "problem": problem}
+    return ret
+
+
+def wall_time(updated: float, clock) -> float:
+    """Wall time of store clock time, store clock is not durable (monotonic)"""
+    return time.time() - (clock() - updated)
+
+
+def clock_time(wall: float, clock) -> float:
+    """Store clock time of wall time"""
+    return clock() - (time.time() - wall)
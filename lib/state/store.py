@@ -0,0 +1,145 @@
+import threading
+import time
+from .journal import clock_time, wall_time
+
+# Entry fields: (instance, value, updated), restored entries have extra restored flag
+INSTANCE, VALUE, UPDATED, RESTORED = range(4)
+
+
+class StateStore:
+    """Latest known state per device capability/property
+
+    Entry kept per (device id, capability/property name) as compact tuple
+    (instance, value, updated). Updated by driver query results, action
+    results (optimistic state) and devices reports (Ex: MQTT messages), so
+    queries answered from memory while state is fresh.
+    Writes are single dict assignments, readers never lock.
+
+    With journal every change appended to durable log (see state.journal),
+    so restarted worker restores state with restore() instead of polling.
+    Restored entries are last known state from before restart, served
+    until restore_max_age (counted from original update) or first update.
+    """
+
+    def __init__(self, max_age: float = 30, clock=time.monotonic, journal=None, restore_max_age: float = 3600):
+        """Create store
+
+        Args:
+            max_age (float, optional): state considered fresh for max_age seconds. Defaults to 30.
+            clock (callable, optional): time source for tests. Defaults to time.monotonic.
+            journal (StateJournal, optional): durable change log.
+            restore_max_age (float, optional): max age of restored entries in seconds. Defaults to 3600.
+        """
+        self.max_age = max_age
+        self.restore_max_age = restore_max_age
+        self.clock = clock
+        self.journal = journal
+        self.devices = {}
+        # Only to create device entries dict once
+        self._lock = threading.Lock()
+        # Approximate under concurrent reads, for monitoring only
+        self.hits = 0
+        self.misses = 0
+
+    def set(self, device_id, name: str, instance: str, value, updated: float = None):
+        """Store value
+
+        Args:
+            device_id: device id
+            name (str): capability/property name. Ex: on_off
+            instance (str): state instance. Ex: on
+            value: state value. Ex: True
+            updated (float, optional): clock time of value. Defaults to now.
+        """
+        device_id = str(device_id)
+        updated = self.clock() if updated is None else updated
+        self._states(device_id)[name] = (instance, value, updated)
+        if self.journal is not None:
+            self.journal.append(device_id, name, instance, value, wall_time(updated, self.clock))
+
+    def set_many(self, entries, updated: float = None) -> int:
+        """Store batch of values, later entries for the same value win
+
+        Args:
+            entries (iterable): (device_id, name, instance, value) tuples
+            updated (float, optional): clock time of values. Defaults to now.
+
+        Returns:
+            int: values stored
+        """
+        latest = {(str(device_id), name): (instance, value) for device_id, name, instance, value in entries}
+        updated = self.clock() if updated is None else updated
+        for (device_id, name), (instance, value) in latest.items():
+            self._states(device_id)[name] = (instance, value, updated)
+        if self.journal is not None and latest:
+            wall = wall_time(updated, self.clock)
+            self.journal.append_many(
+                [[device_id, name, instance, value, wall] for (device_id, name), (instance, value) in latest.items()]
+            )
+        return len(latest)
+
+    def _states(self, device_id: str) -> dict:
+        states = self.devices.get(device_id)
+        if states is None:
+            with self._lock:
+                states = self.devices.setdefault(device_id, {})
+        return states
+
+    def restore(self, entries=None) -> int:
+        """Load entries without logging them
+
+        Args:
+            entries (list, optional): [device_id, name, instance, value, wall time] lists. Defaults to journal entries.
+
+        Returns:
+            int: entries restored
+        """
+        if entries is None:
+            entries = self.journal.load() if self.journal is not None else []
+        count = 0
+        for device_id, name, instance, value, wall in entries:
+            self._states(str(device_id))[name] = (instance, value, clock_time(wall, self.clock), True)
+            count += 1
+        return count
+
+    def get(self, device_id, name: str):
+        """Entry tuple (instance, value, updated) or None"""
+        states = self.devices.get(str(device_id))
+        return states.get(name) if states else None
+
+    def fresh(self, device_id, name: str, max_age: float = None):
+        """Entry not older than max_age or None
+
+        max_age defaults to store max_age, restore_max_age for restored entries.
+        """
+        entry = self.get(device_id, name)
+        if max_age is None and entry is not None:
+            max_age = self.restore_max_age if len(entry) > RESTORED else self.max_age
+        if entry is None or self.clock() - entry[UPDATED] > max_age:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def device(self, device_id) -> dict:
+        """All entries of device by name"""
+        return dict(self.devices.get(str(device_id)) or {})
+
+    def forget(self, device_id):
+        self.devices.pop(str(device_id), None)
+
+    def clear(self):
+        self.devices = {}
+
+    def __len__(self):
+        return sum(len(states) for states in list(self.devices.values()))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self),
+            "devices": len(self.devices),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
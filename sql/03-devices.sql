@@ -10,8 +10,9 @@ CREATE TABLE `devices` (
   `properties` VARCHAR(256) NOT NULL,
   `device_info` VARCHAR(256) NOT NULL,
   `custom_data` VARCHAR(128) NOT NULL,
-  PRIMARY KEY (device_id)
-) ENGINE=MyISAM DEFAULT CHARSET=utf8;
+  PRIMARY KEY (device_id),
+  KEY `user_device_idx` (`user_id`, `device_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
 GRANT ALL ON  yandex.devices TO 'yd-operator'@'localhost';
 
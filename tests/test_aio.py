@@ -0,0 +1,124 @@
+import sys
+import asyncio
+import unittest
+import logging
+from collections import namedtuple
+
+# Project lib path
+sys.path.append("./lib")
+
+from aio import Application, AsyncBackend, Request, Response, TokenAuth
+from cache import TokenCache
+from integrations.yandex import YandexDeviceBuilder, YandexRequest
+from integrations.resolver import DeviceResolver
+from integrations.decoder import DecodeError
+from drivers import DeviceDriver, register_driver
+from devices import ActionResult
+
+logger = logging.getLogger(__name__)
+
+mock_user = namedtuple("IOTUser", ["user_id", "nickname"])(*[200, "testuser"])
+
+
+class MockDriver(DeviceDriver):
+    name = 'mock'
+
+    def action(self,**kwargs):
+        logger.info("Process action %s",kwargs)
+        return ActionResult('on',ActionResult.STATUS_DONE)
+
+register_driver(MockDriver())
+
+
+class MockBackend:
+    def load_user(self, user_id):
+        return mock_user if user_id == 200 else None
+
+
+class MockTokens:
+    def validate_token(self, token):
+        if token != 'valid':
+            raise PermissionError(token)
+        return namedtuple("Token", ["user_id"])(200)
+
+
+async def call(app, method, path, headers=None, body=b""):
+    """Call ASGI app, returns (status, headers, body)"""
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": body}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return messages[0]["status"], dict(messages[0]["headers"]), messages[1]["body"]
+
+
+class TestApplication(unittest.TestCase):
+    def setUp(self):
+        self.app = Application("test")
+        auth = TokenAuth(TokenCache(MockTokens().validate_token, None), AsyncBackend(MockBackend()), PermissionError)
+
+        @self.app.route("/v1.0/", methods=["HEAD"])
+        @auth.token_auth
+        async def ping(request):
+            return Response("OK")
+
+        @self.app.route("/echo", methods=["POST"])
+        async def echo(request):
+            return Response.json(request.body)
+
+    def test_auth(self):
+        """Protected route requires valid token"""
+        status, _, body = asyncio.run(call(self.app, "HEAD", "/v1.0/", {"Authorization": "Bearer valid"}))
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b"")
+        status, _, _ = asyncio.run(call(self.app, "HEAD", "/v1.0/", {"Authorization": "Bearer wrong"}))
+        self.assertEqual(status, 403)
+        status, _, _ = asyncio.run(call(self.app, "HEAD", "/v1.0/"))
+        self.assertEqual(status, 403)
+
+    def test_routing(self):
+        """Unknown path and method"""
+        status, headers, body = asyncio.run(call(self.app, "POST", "/echo", body=b'{"a":1}'))
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b"content-type"], b"application/json")
+        self.assertEqual(body, b'{"a":1}')
+        self.assertEqual(asyncio.run(call(self.app, "GET", "/echo"))[0], 405)
+        self.assertEqual(asyncio.run(call(self.app, "GET", "/nothing"))[0], 404)
+
+    def test_malformed_json(self):
+        """Malformed body raises DecodeError, answered by handlers in Yandex format"""
+        request = Request({"method": "POST", "path": "/", "headers": []}, b'{"devices":')
+        with self.assertRaises(DecodeError) as ctx:
+            request.json
+        self.assertEqual(dict(ctx.exception), {"error_code": "INVALID_VALUE", "error_message": "malformed json"})
+        self.assertIsNone(Request({"method": "POST", "path": "/"}, b"").json)
+
+
+class TestAsyncResolve(unittest.TestCase):
+    def test_sync_driver_in_async_mode(self):
+        """Sync driver action runs through thread pool adapter"""
+        capability = {'on_off':{'split':True}}
+        action_request = [{"type": "devices.capabilities.on_off","state": {"instance": "on","value": True}}]
+        device = (
+                YandexDeviceBuilder('dev-1', 'devices.types.light')
+                .with_capabilities(YandexRequest.build_action_request(capability,action_request))
+                .with_custom_data({'driver':'mock','actions':{'on_off':{'data':'test_data'}}})
+        ).build()
+
+        devices = asyncio.run(DeviceResolver(timeout=1).resolve_async([device]))
+        result = dict(devices[0])['capabilities'][0]['state']['action_result']
+        self.assertEqual(result['status'], 'DONE')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+import sys
+import asyncio
+import unittest
+
+# Project lib path
+sys.path.append("./lib")
+
+from collections import namedtuple
+from cache import LRUCache, CatalogCache, DeviceListCache, TokenCache
+from integrations.yandex import YandexDeviceBuilder
+
+
+class MockClock:
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        """Least recently used entry evicted first"""
+        cache = LRUCache(maxsize=2)
+        cache.set(1, 'a')
+        cache.set(2, 'b')
+        self.assertEqual(cache.get(1), 'a')
+        cache.set(3, 'c')
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(1), 'a')
+        self.assertEqual(cache.get(3), 'c')
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_ttl(self):
+        """Entry expires after ttl"""
+        clock = MockClock()
+        cache = LRUCache(maxsize=2, ttl=10, clock=clock)
+        cache.set(1, 'a')
+        clock.now = 9
+        self.assertEqual(cache.get(1), 'a')
+        clock.now = 10
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(len(cache), 0)
+
+    def test_stale_load_not_stored(self):
+        """Load started before invalidation is not cached"""
+        cache = LRUCache(maxsize=2)
+
+        def loader(key):
+            cache.invalidate(key)
+            return 'stale'
+
+        self.assertEqual(cache.get_or_load(1, loader), 'stale')
+        self.assertNotIn(1, cache)
+
+
+class TestCatalogCache(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.catalog = CatalogCache(self.loader, maxsize=10, ttl=60)
+
+    def loader(self, user_id):
+        self.calls.append(user_id)
+        return [{'device_id': user_id * 10}]
+
+    def test_catalog_cached(self):
+        """Backend called once per user"""
+        self.catalog.load_yandex_devices(100)
+        devices = self.catalog.load_yandex_devices(100)
+        self.assertEqual(devices[0]['device_id'], 1000)
+        self.assertEqual(self.calls, [100])
+        stats = self.catalog.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_catalog_invalidate(self):
+        """Invalidated catalog reloaded from backend"""
+        self.catalog.load_yandex_devices(100)
+        self.catalog.invalidate(100)
+        self.catalog.load_yandex_devices(100)
+        self.assertEqual(self.calls, [100, 100])
+
+    def test_load_requested_devices(self):
+        """Only missing requested devices loaded by id"""
+        loaded = []
+
+        def ids_loader(user_id, device_ids):
+            loaded.append(device_ids)
+            return [{'device_id': int(i)} for i in device_ids if i != '9']
+
+        catalog = CatalogCache(self.loader, ids_loader=ids_loader)
+        self.assertEqual(list(catalog.load_devices(100, ['1', '9'])), ['1'])
+        self.assertEqual(list(catalog.load_devices(100, [1, '2', '9'])), ['1', '2'])
+        self.assertEqual(loaded, [['1', '9'], ['2']])
+
+        # Partial catalog not used for full devices list
+        self.assertEqual(catalog.load_yandex_devices(100)[0]['device_id'], 1000)
+        self.assertEqual(catalog.load_devices(100, ['1000']), {'1000': {'device_id': 1000}})
+        self.assertEqual(len(loaded), 2)
+
+
+class TestDeviceListCache(unittest.TestCase):
+    def test_payload_bound_to_catalog(self):
+        """Payload rebuilt only when catalog object changed"""
+        builds = []
+
+        def build(catalog):
+            builds.append(catalog)
+            return [YandexDeviceBuilder(d, 'devices.types.light').with_name('Lamp').build() for d in catalog]
+
+        cache = DeviceListCache()
+        catalog = ('1', '2')
+        payload, etag = cache.get(100, catalog, 'testuser', build)
+        self.assertEqual(cache.get(100, catalog, 'testuser', build), (payload, etag))
+        self.assertEqual(len(builds), 1)
+
+        payload2, etag2 = cache.get(100, ('1',), 'testuser', build)
+        self.assertEqual(len(builds), 2)
+        self.assertNotEqual(etag, etag2)
+        self.assertTrue(payload2.startswith(b'{"devices":[{"id":"1"'))
+
+
+Claims = namedtuple("Claims", ["user_id", "exp"])
+
+
+class TestTokenCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = MockClock()
+        self.clock.now = 1000.0
+        self.validated = []
+
+        def validate(token):
+            if not token.startswith("tok"):
+                raise ValueError("Invalid token")
+            self.validated.append(token)
+            user_id, exp = token[3:].split(":")
+            return Claims(int(user_id), float(exp))
+
+        self.cache = TokenCache(validate, lambda user_id: {"user_id": user_id}, ttl=300, clock=self.clock)
+
+    def test_token_validated_once(self):
+        self.assertEqual(self.cache.authorize("tok1:2000"), {"user_id": 1})
+        self.assertEqual(self.cache.authorize("tok1:2000"), {"user_id": 1})
+        self.assertEqual(self.validated, ["tok1:2000"])
+        with self.assertRaises(ValueError):
+            self.cache.authorize("bad")
+
+    def test_expires_at_token_exp(self):
+        """Entry never outlives token exp nor ttl"""
+        self.cache.authorize("tok1:1010")
+        self.cache.authorize("tok2:9999")
+        self.clock.now = 1011
+        self.assertIsNone(self.cache.lookup("tok1:1010"))
+        self.assertIsNotNone(self.cache.lookup("tok2:9999"))
+        self.clock.now = 1301
+        self.assertIsNone(self.cache.lookup("tok2:9999"))
+
+    def test_evict_user(self):
+        self.cache.authorize("tok1:2000")
+        self.cache.authorize("tok1:3000")
+        self.cache.authorize("tok2:2000")
+        self.cache.evict_user(1)
+        self.assertIsNone(self.cache.lookup("tok1:2000"))
+        self.assertIsNone(self.cache.lookup("tok1:3000"))
+        self.assertIsNotNone(self.cache.lookup("tok2:2000"))
+        self.cache.revoke("tok2:2000")
+        self.assertIsNone(self.cache.lookup("tok2:2000"))
+
+    def test_evicted_while_loaded(self):
+        """User evicted during load (Ex: unlink) not stored back"""
+        def load_user(user_id):
+            self.cache.evict_user(user_id)
+            return {"user_id": user_id}
+
+        self.cache.load_user = load_user
+        self.assertEqual(self.cache.authorize("tok1:2000"), {"user_id": 1})
+        self.assertIsNone(self.cache.lookup("tok1:2000"))
+
+        async def load_user_async(user_id):
+            return load_user(user_id)
+
+        self.assertEqual(asyncio.run(self.cache.authorize_async("tok1:2000", load_user_async)), {"user_id": 1})
+        self.assertIsNone(self.cache.lookup("tok1:2000"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+import json
+import os
+import sys
+import sqlite3
+import threading
+import unittest
+
+# Project lib path
+sys.path.append("./lib")
+
+from db import ConnectionPool, ThreadConnection, PoolTimeout, load_yandex_devices_by_ids, save_yandex_devices
+from integrations.validation import CatalogValidator, CatalogValidationError
+
+
+class MockClock:
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def connect():
+    """Embedded stand-in for MySQL"""
+    return sqlite3.connect(":memory:", check_same_thread=False)
+
+
+class TestConnectionPool(unittest.TestCase):
+    def test_reuse(self):
+        """Released connection reused, not reconnected"""
+        pool = ConnectionPool(connect, size=2)
+        with pool.connection() as conn:
+            first = conn
+            conn.execute("SELECT 1")
+        with pool.connection() as conn:
+            self.assertIs(conn, first)
+        stats = pool.stats()
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['in_use'], 0)
+
+    def test_checkout_timeout(self):
+        """Checkout fails when all connections busy"""
+        pool = ConnectionPool(connect, size=1, timeout=0.01)
+        conn = pool.acquire()
+        self.assertEqual(pool.stats()['utilisation'], 1.0)
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        self.assertEqual(pool.stats()['timeouts'], 1)
+        pool.release(conn)
+        self.assertIs(pool.acquire(), conn)
+
+    def test_stale_reconnect(self):
+        """Dead idle connection replaced on checkout"""
+        clock = MockClock()
+        pool = ConnectionPool(connect, size=1, ping_interval=30, clock=clock)
+        conn = pool.acquire()
+        pool.release(conn)
+        conn.close()
+        clock.now = 31
+        new_conn = pool.acquire()
+        self.assertIsNot(new_conn, conn)
+        new_conn.execute("SELECT 1")
+        self.assertEqual(pool.stats()['reconnects'], 1)
+        self.assertEqual(pool.stats()['created'], 1)
+
+    def test_thread_connection(self):
+        """Every thread uses own connection"""
+        pool = ConnectionPool(connect, size=2)
+        proxy = ThreadConnection(pool)
+        used = []
+
+        def worker():
+            used.append(proxy.get())
+            proxy.cursor().execute("SELECT 1")
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        self.assertIsNot(proxy.get(), used[0])
+        self.assertEqual(pool.stats()['in_use'], 2)
+        proxy.release()
+        self.assertEqual(pool.stats()['in_use'], 1)
+
+
+class TestDevicesQueries(unittest.TestCase):
+    def setUp(self):
+        self.conn = connect()
+        self.conn.execute(
+            "CREATE TABLE devices (device_id INTEGER PRIMARY KEY, user_id INTEGER, name TEXT, description TEXT,"
+            " room TEXT, device_type TEXT, capabilities TEXT, properties TEXT, device_info TEXT, custom_data TEXT)"
+        )
+        for device_id, user_id in ((1, 100), (2, 100), (3, 200)):
+            self.conn.execute(
+                "INSERT INTO devices VALUES (?,?,?,?,?,?,?,?,?,?)",
+                (device_id, user_id, 'Lamp', 'Main lamp', 'Kids', 'devices.types.light',
+                 '["devices.capabilities.on_off"]', '{}', '', '{"driver":"mqtt","freq":315}'),
+            )
+        self.conn.commit()
+
+    def test_load_by_ids(self):
+        """Only requested devices of user loaded"""
+        devices = load_yandex_devices_by_ids(self.conn, 100, ['2', '3'], placeholder='?')
+        self.assertEqual(len(devices), 1)
+        self.assertEqual(devices[0]['device_id'], 2)
+        self.assertEqual(devices[0]['driver'], 'mqtt')
+        self.assertEqual(devices[0]['params'], {'freq': 315})
+        self.assertEqual(devices[0]['capabilities'], {'on_off': {}})
+        self.assertIsNone(devices[0]['device_info'])
+
+    def test_save_validated(self):
+        """Devices written only when all valid"""
+        device = {
+            'device_id': 4, 'name': 'Lamp', 'room': 'Kids', 'device_type': 'devices.types.light',
+            'driver': 'mqtt', 'params': {'freq': 433}, 'capabilities': {'on_off': {'split': True}},
+        }
+        invalid = dict(device, device_id=5, capabilities={'on_off': {'splitt': True}})
+        with self.assertRaises(CatalogValidationError):
+            save_yandex_devices(self.conn, 100, [device, invalid], CatalogValidator(), placeholder='?')
+        self.assertEqual(load_yandex_devices_by_ids(self.conn, 100, ['4'], placeholder='?'), [])
+
+        self.assertEqual(save_yandex_devices(self.conn, 100, [device], CatalogValidator(), placeholder='?'), 1)
+        saved = load_yandex_devices_by_ids(self.conn, 100, ['4'], placeholder='?')[0]
+        self.assertEqual(saved['params'], {'freq': 433})
+        self.assertEqual(saved['capabilities'], {'on_off': {'split': True}})
+        # Existing row format, see sql/my_devices.sql
+        row = self.conn.execute("SELECT capabilities, custom_data FROM devices WHERE device_id = 4").fetchone()
+        self.assertEqual(json.loads(row[0]), [{'type': 'devices.capabilities.on_off', 'parameters': {'split': True}}])
+        self.assertEqual(json.loads(row[1]), {'driver': 'mqtt', 'freq': 433})
+
+    def test_save_own_devices_only(self):
+        """Device of other user neither overwritten nor taken over"""
+        device = {
+            'device_id': 3, 'name': 'Taken', 'room': 'Kids', 'device_type': 'devices.types.light',
+            'driver': 'mqtt', 'params': {'freq': 433}, 'capabilities': {'on_off': {}},
+        }
+        with self.assertRaises(CatalogValidationError) as ctx:
+            save_yandex_devices(self.conn, 100, [device], CatalogValidator(), placeholder='?')
+        self.assertEqual(ctx.exception.violations[0].field, 'device_id')
+        self.assertEqual(load_yandex_devices_by_ids(self.conn, 200, ['3'], placeholder='?')[0]['name'], 'Lamp')
+
+        renamed = dict(device, device_id=2, name='Renamed')
+        self.assertEqual(save_yandex_devices(self.conn, 100, [renamed], CatalogValidator(), placeholder='?'), 1)
+        self.assertEqual(load_yandex_devices_by_ids(self.conn, 100, ['2'], placeholder='?')[0]['name'], 'Renamed')
+
+    def test_sample_rows(self):
+        """Rows of sql/my_devices.sql loaded in builder format"""
+        with open(os.path.join(os.path.dirname(__file__), '..', 'sql', 'my_devices.sql')) as f:
+            for statement in f.read().split(';'):
+                if statement.strip().startswith('INSERT'):
+                    self.conn.execute(statement.replace('INSERT INTO  devices', 'INSERT INTO devices'))
+        device = load_yandex_devices_by_ids(self.conn, 100, ['10000101'], placeholder='?')[0]
+        self.assertEqual(device['capabilities'], {'toggle': {}})
+        self.assertEqual(device['params'], {'topic': '/rf/315', 'action': {'type': 'toggle', 'data': '10965763,24'}})
+        self.assertEqual(CatalogValidator().check_device(device), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
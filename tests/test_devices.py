@@ -9,7 +9,9 @@ sys.path.append("..")
 import unittest
 from devices import Device, get_action_by_name
 from drivers import DeviceDriver, register_driver
-from devices.actions import DeviceAction
+from devices.actions import DeviceAction, DeviceActionOnOff, get_actions
+from drivers import DriverFactory, get_driver_by_name
+from integrations.capabilities import Capability
 
 
 logger = logging.getLogger(__name__)
@@ -34,6 +36,13 @@ class TestActions(unittest.TestCase):
     def setUp(self):
         logging.basicConfig(level=logging.DEBUG)
         logging.getLogger().setLevel(logging.DEBUG)
+        # Classes defined by tests registered globally
+        self.registries = [(r, dict(r)) for r in (DeviceAction.registry, Capability.registry, DeviceDriver.registry)]
+
+    def tearDown(self):
+        for registry, snapshot in self.registries:
+            registry.clear()
+            registry.update(snapshot)
 
     def test_action_on_off(self):
         """Test action on_off"""
@@ -71,6 +80,30 @@ class TestActions(unittest.TestCase):
         self.assertEqual(action_request['value'],'10965772,24')
 
 
+    def test_action_registry(self):
+        """Nested subclasses registered by own name, duplicates rejected"""
+
+        class DeviceActionPulse(DeviceActionOnOff):
+            name = 'test_pulse'
+
+        self.assertIsInstance(get_action_by_name('test_pulse',data='1'),DeviceActionPulse)
+        self.assertIs(get_actions()['on_off'],DeviceActionOnOff)
+        with self.assertRaises(TypeError):
+            class DeviceActionDuplicate(DeviceAction):
+                name = 'on_off'
+        self.assertIs(get_actions()['on_off'],DeviceActionOnOff)
+
+        class TestDriver(MockDriver):
+            name = 'test_registry'
+
+        self.assertIs(get_driver_by_name('test_registry'),TestDriver)
+
+    def test_registry_restored(self):
+        """Classes of other tests not left in registries"""
+        self.test_action_registry()
+        self.tearDown()
+        self.assertNotIn('test_pulse',get_actions())
+        self.assertIsNone(get_driver_by_name('test_registry'))
 
 
 
@@ -96,13 +129,33 @@ class TestDevices(unittest.TestCase):
         self.assertEqual((device_dict_data['actions']),device_data['actions'])
 
 
+    def test_compiled_actions(self):
+        """Actions shared between devices, request params don't leak into device"""
+        params = {"topic":"/rf/315"}
+        device = Device("mock", params, {"on_off":{"data":["1,24","2,24"]}})
+        other = Device("mock", {"topic":"/rf/433"}, {"on_off":["1,24","2,24"]})
+        self.assertIs(device.get_action('on_off'), other.get_action('on_off'))
+        with self.assertRaises(AttributeError):
+            device.get_action('on_off').data = None
+
+        request = device.build_request('on_off','on',False,{"topic":"/rf/868","repeat":3})
+        self.assertEqual(request['value'],"2,24")
+        self.assertEqual(dict(request['driver_params']),{"topic":"/rf/868","repeat":3})
+        self.assertEqual(params,{"topic":"/rf/315"})
+        self.assertEqual(dict(device.build_request('on_off','on',True)['driver_params']),params)
+
+
     def test_device_on(self):
         """Test actions device """
         # Device custom_data from integration
         device_data = {"driver":"mock", 'params':{"topic":"/rf/315"},'actions': {"on_off":"10965772,24"}}
+        # Other test modules register own mock driver
+        self.addCleanup(register_driver, DriverFactory.get('mock'))
+        register_driver(mock_driver)
         device: Device = Device(**device_data)
         mock_driver.reset()
         device.action('on_off','on',True)
-        self.assertEqual(mock_driver.params['topic'],"/rf/315")
-        self.assertEqual(mock_driver.params['data'],"10965772,24")
+        # Device params passed to driver as driver_params, command as value
+        self.assertEqual(mock_driver.params['driver_params']['topic'],"/rf/315")
+        self.assertEqual(mock_driver.params['value'],"10965772,24")
 
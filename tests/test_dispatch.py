@@ -0,0 +1,118 @@
+import sys
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+# Project lib path
+sys.path.append("./lib")
+
+from devices.actions import ActionResult, QueryResult
+from drivers import DeviceDriver
+from dispatch import Dispatcher, DispatcherClient, DispatchError, RemoteDriver
+
+
+class SlowDriver(DeviceDriver):
+    name = 'test_dispatch'
+
+    def __init__(self):
+        self.driver_params = []
+
+    async def action_async(self, param, value=None, driver_params=None, action=None):
+        self.driver_params.append(driver_params)
+        if action == 'query':
+            return QueryResult(param, 21.5)
+        if value == 'fail':
+            raise ValueError('bad command')
+        await asyncio.sleep(value)
+        return ActionResult(param, ActionResult.STATUS_DONE)
+
+
+class TestDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'dispatch.sock')
+        self.driver = SlowDriver()
+        self.dispatcher = Dispatcher(lambda name: self.driver if name == 'test_dispatch' else None)
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self.dispatcher.start(self.path))
+            started.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait(2)
+        self.client = DispatcherClient(self.path)
+
+    def tearDown(self):
+        self.client.close()
+
+        async def shutdown():
+            self.dispatcher.close()
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result(2)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(2)
+        self.loop.close()
+        self.tmp.cleanup()
+
+    def test_results_by_correlation_id(self):
+        """Fast call not blocked by slow one on the same connection"""
+        slow = self.client.call('test_dispatch', {'param': 'slow', 'value': 0.3})
+        fast = self.client.call('test_dispatch', {'param': 'fast', 'value': 0, 'driver_params': {'freq': 433}})
+        self.assertEqual(fast.result(2).param, 'fast')
+        self.assertFalse(slow.done())
+        self.assertEqual(slow.result(2).status, 'DONE')
+        query = self.client.call('test_dispatch', {'param': 'temperature', 'action': 'query'}).result(2)
+        self.assertEqual((query.param, query.value), ('temperature', 21.5))
+
+    def test_errors(self):
+        with self.assertRaises(DispatchError):
+            self.client.call('test_dispatch', {'param': 'on', 'value': 'fail'}).result(2)
+        with self.assertRaises(DispatchError):
+            self.client.call('unknown', {'param': 'on'}).result(2)
+        self.assertEqual(self.dispatcher.stats(), {'calls': 2, 'errors': 2})
+
+    def test_socket_path_checked(self):
+        """Existing file other than socket not removed"""
+        path = os.path.join(self.tmp.name, 'data')
+        with open(path, 'w') as f:
+            f.write('data')
+        with self.assertRaises(FileExistsError):
+            asyncio.run(Dispatcher(lambda name: None).start(path))
+        self.assertTrue(os.path.exists(path))
+
+    def test_remote_driver(self):
+        driver = RemoteDriver('test_dispatch', self.client, timeout=0.1)
+        self.assertEqual(driver.action(param='on', value=0).status, 'DONE')
+        result = driver.action(param='on', value=0.5)
+        self.assertEqual((result.status, result.error_code), ('ERROR', 'DEVICE_UNREACHABLE'))
+        # Timed out call not kept pending
+        self.assertEqual(self.client.pending, {})
+        result = asyncio.run(driver.action_async(param='on', value=0))
+        self.assertEqual(result.status, 'DONE')
+
+        # Only wire params sent, request user stays in worker
+        params = {'freq': 433, 'priority': 1, 'user': object()}
+        self.assertEqual(driver.action(param='on', value=0, driver_params=params).status, 'DONE')
+        self.assertEqual(self.driver.driver_params[-1], {'freq': 433, 'priority': 1})
+
+        down = RemoteDriver('test_dispatch', DispatcherClient(os.path.join(self.tmp.name, 'none.sock')))
+        result = down.action(param='on', value=0)
+        self.assertEqual((result.status, result.error_code), ('ERROR', 'DEVICE_UNREACHABLE'))
+        with self.assertRaises(ConnectionError):
+            down.action(param='on', action='query')
+
+
+if __name__ == "__main__":
+    unittest.main()
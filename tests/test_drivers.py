@@ -4,8 +4,18 @@ import json
 # Project lib path
 sys.path.append("./lib")
 
+import asyncio
+import socket
+import threading
+import time
 import unittest
+from concurrent.futures import Future
 from drivers import DriverFactory
+from drivers.mqtt import DriverMqtt
+from drivers.codebook import Codebook, CodebookError
+from drivers.scheduler import TransmitScheduler, INTERACTIVE, BULK, request_priority
+from mqtt import MqttClient, MqttPool
+from mqtt.broker import LocalBroker
 
 class TestDriverBase(unittest.TestCase):
     def get_driver_by_name(self):
@@ -14,6 +24,180 @@ class TestDriverBase(unittest.TestCase):
         # self.assertEqual(custom_data['driver'],'mqtt')
 
 
+class TestDriverMqtt(unittest.TestCase):
+    def setUp(self):
+        self.broker = LocalBroker()
+        self.pool = MqttPool(lambda: MqttClient(self.broker.host, self.broker.port, keepalive=10), size=2)
+        self.driver = DriverMqtt(self.pool, prefix='home', timeout=0.5)
+
+    def tearDown(self):
+        self.pool.close()
+        self.broker.stop()
+
+    def test_publish(self):
+        """Commands pipelined over pooled connections, PUBACK is DONE"""
+        params = {'action': 'rfsend', 'freq': 433}
+        futures = [self.driver.publish(f'1096576{i},24', params) for i in range(10)]
+        results = [self.driver.result('on_off', f) for f in futures]
+        self.assertEqual({r.status for r in results}, {'DONE'})
+        self.assertEqual(sorted(m[1] for m in self.broker.messages), sorted(f'1096576{i},24'.encode() for i in range(10)))
+        self.assertEqual({m[0] for m in self.broker.messages}, {'home/rf/433'})
+        self.assertEqual(self.broker.connects, 2)
+        self.assertEqual(self.driver.topic({'action': 'irsend', 'proto': 'nec'}), 'home/ir/nec')
+        self.assertEqual(self.driver.topic({'topic': '/rf/315'}), 'home/rf/315')
+        self.assertEqual(len(self.driver.topics), 3)
+
+    def test_errors(self):
+        """Missing PUBACK and broker down mapped to DEVICE_UNREACHABLE"""
+        result = self.driver.action(param='on_off', value='code', driver_params={'action': 'rfsend'})
+        self.assertEqual((result.status, result.error_code), ('ERROR', 'INVALID_ACTION'))
+
+        self.broker.ack = False
+        result = self.driver.action(param='on_off', value='10965763,24', driver_params={'action': 'rfsend', 'freq': 433})
+        self.assertEqual((result.status, result.error_code), ('ERROR', 'DEVICE_UNREACHABLE'))
+
+        self.broker.stop()
+        self.broker.wait(lambda b: all(c.sock is None for c in self.pool.clients))
+        for _ in range(2):
+            result = self.driver.action(param='on_off', value='10965763,24', driver_params={'action': 'rfsend', 'freq': 433})
+            self.assertEqual((result.status, result.error_code), ('ERROR', 'DEVICE_UNREACHABLE'))
+
+    def test_reconnect(self):
+        """Unacknowledged message resent with DUP after connection lost"""
+        client = MqttClient(self.broker.host, self.broker.port)
+        self.broker.ack = False
+        future = client.publish('rf/433', 'code')
+        self.assertTrue(self.broker.wait(lambda b: len(b.messages) == 1))
+        self.broker.ack = True
+        self.broker.drop_clients()
+        future.result(timeout=2)
+        self.assertEqual(self.broker.messages[-1], ('rf/433', b'code', 1, True))
+        self.assertEqual(client.connects, 2)
+        client.close()
+
+    def test_connect_not_blocking(self):
+        """Publish does not wait for broker connect, queued messages failed with connect"""
+        silent = socket.socket()
+        silent.bind(('127.0.0.1', 0))
+        silent.listen()
+        client = MqttClient(*silent.getsockname(), connect_timeout=0.3)
+        try:
+            start = time.monotonic()
+            futures = [client.publish('rf/433', 'code', qos) for qos in (1, 0)]
+            self.assertLess(time.monotonic() - start, 0.2)
+            self.assertEqual(len(client.queued), 2)
+            for future in futures:
+                with self.assertRaises(ConnectionError):
+                    future.result(timeout=2)
+            self.assertEqual(client.queued, [])
+        finally:
+            client.close()
+            silent.close()
+
+    def test_action_async(self):
+        result = asyncio.run(self.driver.action_async(param='on_off', value='code', driver_params={'action': 'irsend', 'proto': 'nec'}))
+        self.assertEqual(result.status, 'DONE')
+        self.assertEqual(self.broker.messages[0][:2], ('home/ir/nec', b'code'))
+
+
+class TestTransmitScheduler(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+        self.gate = threading.Event()
+        self.gaps = []
+        self.scheduler = TransmitScheduler(self.send, gap=0.01, sleep=self.gaps.append)
+
+    def send(self, channel, payload):
+        # First frame held until queue filled
+        self.gate.wait(2)
+        self.sent.append((channel, payload))
+        future = Future()
+        future.set_result(None)
+        return future
+
+    def test_priorities(self):
+        """Interactive jobs go first, device order kept on promotion"""
+        first = self.scheduler.submit('rf/433', 'first')
+        while self.scheduler.stats()['rf/433']:
+            time.sleep(0.001)
+        jobs = [
+            self.scheduler.submit('rf/433', 'scene-a1', BULK, 'a'),
+            self.scheduler.submit('rf/433', 'scene-b', BULK, 'b'),
+            self.scheduler.submit('rf/433', 'scene-a2', BULK, 'a'),
+            self.scheduler.submit('rf/433', 'voice-c', INTERACTIVE, 'c'),
+            self.scheduler.submit('rf/433', 'voice-a', INTERACTIVE, 'a'),
+        ]
+        self.assertEqual(self.scheduler.stats(), {'rf/433': 5})
+        self.gate.set()
+        for job in [first] + jobs:
+            job.result(timeout=2)
+        self.assertEqual([p for _, p in self.sent],
+                         ['first', 'voice-c', 'scene-a1', 'scene-a2', 'voice-a', 'scene-b'])
+        self.assertEqual(self.scheduler.stats(), {'rf/433': 0})
+        self.assertEqual(request_priority(1), INTERACTIVE)
+        self.assertEqual(request_priority(3), BULK)
+
+    def test_repeats(self):
+        """Frames repeated with gap, cancelled jobs not sent, channels independent"""
+        first = self.scheduler.submit('rf/433', 'code', repeats=3)
+        cancelled = self.scheduler.submit('rf/433', 'stale')
+        other = self.scheduler.submit('ir/nec', 'ir-code')
+        self.assertTrue(cancelled.cancel())
+        self.gate.set()
+        first.result(timeout=2)
+        other.result(timeout=2)
+        self.assertEqual([p for c, p in self.sent if c == 'rf/433'], ['code'] * 3)
+        self.assertEqual([p for c, p in self.sent if c == 'ir/nec'], ['ir-code'])
+        self.assertEqual(len(self.gaps), 2)
+
+    def test_driver(self):
+        """Driver commands go through scheduler with request priority and device repeats"""
+        broker = LocalBroker()
+        pool = MqttPool(lambda: MqttClient(broker.host, broker.port), size=1)
+        scheduler = TransmitScheduler(lambda topic, payload: pool.publish(topic, payload), gap=0)
+        driver = DriverMqtt(pool, prefix='home', timeout=1, scheduler=scheduler)
+        try:
+            params = {'action': 'rfsend', 'freq': 433, 'repeats': 2, 'priority': INTERACTIVE, 'device_id': '1'}
+            result = driver.action(param='on_off', value='10965763,24', driver_params=params)
+            self.assertEqual(result.status, 'DONE')
+            self.assertEqual([m[:2] for m in broker.messages], [('home/rf/433', b'10965763,24')] * 2)
+        finally:
+            pool.close()
+            broker.stop()
+
+
+class TestCodebook(unittest.TestCase):
+    def test_dedup(self):
+        """Equal codes of all devices compiled once and share wire payload"""
+        codebook = Codebook()
+        first = codebook.get('10965763,24', 'rfsend')
+        self.assertEqual((first.wire, first.code, first.bits), (b'10965763,24', 10965763, 24))
+        self.assertIs(codebook.get(''.join(['10965763', ',24']), 'rfsend'), first)
+        self.assertIs(codebook.get(' 10965763, 24', 'rfsend'), first)
+        self.assertEqual(codebook.wire(1234, 'rfsend'), b'1234')
+        self.assertEqual(codebook.wire('0x20DF10EF', 'irsend'), b'0x20DF10EF')
+        self.assertEqual(codebook.wire({'code': 1}), b'{"code": 1}')
+        self.assertEqual(codebook.stats(), {'codes': 3, 'keys': 4, 'hits': 1, 'misses': 4})
+
+    def test_equal_values_of_other_type(self):
+        """True, 1 and 1.0 are equal dict keys but different commands"""
+        codebook = Codebook()
+        self.assertEqual(codebook.wire(True), b'true')
+        self.assertEqual(codebook.wire(1), b'1')
+        self.assertEqual(codebook.wire(1.0), b'1.0')
+        self.assertEqual(codebook.wire(True), b'true')
+
+    def test_invalid(self):
+        codebook = Codebook()
+        for code in ('code', '1,2,3', '123,0', '', '-1,24'):
+            with self.assertRaises(CodebookError):
+                codebook.get(code, 'rfsend')
+        self.assertEqual(len(codebook), 0)
+        driver = DriverMqtt(None, codebook=codebook)
+        result = driver.action(param='on_off', value='code', driver_params={'action': 'rfsend', 'freq': 433})
+        self.assertEqual((result.status, result.error_code), ('ERROR', 'INVALID_ACTION'))
+
+
 if __name__ == "__main__":
     unittest.main()
 
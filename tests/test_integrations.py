@@ -1,12 +1,25 @@
 import sys
+import json
+import time
+import asyncio
 import unittest
 import logging
 
 # Project lib path
 sys.path.append("./lib")
 
-from integrations.yandex import YandexDeviceBuilder,YandexRequest
+from integrations.yandex import YandexDeviceBuilder,YandexRequest,YandexResponse,YandexError
+from integrations.capabilities import get_capability_by_name
 from drivers import DeviceDriver, register_driver
+from integrations.resolver import DeviceResolver
+from integrations.encoder import encode, encode_body, encode_payload, splice_response
+from integrations.validation import CatalogValidator, CatalogValidationError
+from integrations.decoder import DECODER, DecodeError
+from integrations.coalescer import CommandCoalescer, merge, split
+from integrations.resolve import ActionRequest
+from state import StateStore
+from metrics import DRIVER_ERRORS
+from concurrent.futures import Future
 from devices import ActionResult
 
 logger = logging.getLogger(__name__)
@@ -99,6 +112,385 @@ class TestCapabilities(unittest.TestCase):
         #self.assertEqual(device['capabilities'][0]['parameters']['split'],True)
         #self.assertEqual(device['capabilities'][0]['reportable'],True)
 
+    def test_capability_shared(self):
+        """Descriptors shared between devices, state kept per device"""
+        capability = {'on_off':{'split':True}}
+        devices = [
+            YandexDeviceBuilder(device_id, 'devices.types.light').with_capabilities(capability).build()
+            for device_id in ('1','2')
+        ]
+        first, second = (d.capabilities[0] for d in devices)
+        self.assertIs(first.capability,second.capability)
+        self.assertIsNot(first,second)
+        self.assertFalse(hasattr(first.capability,'__dict__'))
+        self.assertFalse(hasattr(first,'__dict__'))
+        with self.assertRaises(AttributeError):
+            first.capability.split = False
+        first.set_result(ActionResult('on',ActionResult.STATUS_DONE))
+        self.assertIsNone(second.action_result)
+
+    def test_shared_params_types(self):
+        """Equal params of other type (Ex: True and 1) not shared"""
+        flag = get_capability_by_name('on_off', split=True)
+        number = get_capability_by_name('on_off', split=1)
+        self.assertIsNot(flag, number)
+        self.assertIs(number.split, 1)
+        rows = [
+            {'device_id': i, 'name': 'Lamp', 'description': '', 'room': '', 'device_type': 'devices.types.light',
+             'driver': 'mock', 'params': {}, 'capabilities': {'on_off': {'split': split}}, 'properties': None,
+             'device_info': None}
+            for i, split in ((1, True), (2, 1))
+        ]
+        first, second = (d.capabilities[0].capability for d in YandexDeviceBuilder.build_many(rows))
+        self.assertIs(first.split, True)
+        self.assertIs(second.split, 1)
+
+
+class TestResolver(unittest.TestCase):
+    def build_device(self, device_id, value=True):
+        capability = {'on_off':{'split':True,'reportable':True}}
+        action_request = [{"type": "devices.capabilities.on_off","state": {"instance": "on","value": value}}]
+        return (
+                YandexDeviceBuilder(device_id, 'devices.types.light')
+                .with_capabilities(YandexRequest.build_action_request(capability,action_request))
+                .with_custom_data({'driver':'mock','actions':{'on_off':{'data':'test_data'}}})
+        ).build()
+
+    def test_resolve_deadline(self):
+        """Slow device gets DEVICE_UNREACHABLE, others resolved, order kept"""
+        devices = [self.build_device('dev-1'), self.build_device('dev-2'), {'id': 'dev-3'}]
+        devices[0].call = lambda value, params: time.sleep(0.5)
+
+        resolver = DeviceResolver(max_workers=4, timeout=0.1)
+        ret = [dict(d) for d in resolver.resolve(devices)]
+
+        self.assertEqual([d['id'] for d in ret], ['dev-1', 'dev-2', 'dev-3'])
+        result = ret[0]['capabilities'][0]['state']['action_result']
+        self.assertEqual(result['status'], 'ERROR')
+        self.assertEqual(result['error_code'], 'DEVICE_UNREACHABLE')
+        result = ret[1]['capabilities'][0]['state']['action_result']
+        self.assertEqual(result['status'], 'DONE')
+        resolver.shutdown()
+
+    def test_error_results_counted(self):
+        """Driver answered with error counted as driver error"""
+        device = self.build_device('dev-1')
+        device.call = lambda value, params: ActionResult('on', ActionResult.STATUS_ERROR, 'DEVICE_BUSY', 'Busy')
+        before = DRIVER_ERRORS.values().get(('mock', 'DEVICE_BUSY'), 0)
+        resolver = DeviceResolver(max_workers=1, timeout=1)
+        resolver.resolve([device])
+        self.assertEqual(DRIVER_ERRORS.values()[('mock', 'DEVICE_BUSY')], before + 1)
+        resolver.shutdown()
+
+
+class BatchDriver(DeviceDriver):
+    name = 'test_batch'
+
+    def __init__(self):
+        self.calls = []
+
+    def action_many(self, requests):
+        self.calls.append(requests)
+        return [ActionResult(r['param'], ActionResult.STATUS_DONE) for r in requests]
+
+    def query_many(self, requests):
+        self.calls.append(requests)
+        return [QueryResult(r['param'], True) for r in requests]
+
+
+batch_driver = BatchDriver()
+register_driver(batch_driver)
+
+
+class TestBatchResolver(unittest.TestCase):
+    def build_device(self, device_id, driver='test_batch'):
+        capability = {'on_off':{'split':True,'reportable':True}}
+        action_request = [{"type": "devices.capabilities.on_off","state": {"instance": "on","value": True}}]
+        return (
+                YandexDeviceBuilder(device_id, 'devices.types.light')
+                .with_capabilities(YandexRequest.build_action_request(capability,action_request))
+                .with_custom_data({'driver':driver,'params':{'topic':device_id},'actions':{'on_off':{'data':device_id}}})
+        ).build()
+
+    def setUp(self):
+        batch_driver.calls = []
+
+    def test_fallback(self):
+        """Drivers without batch support called per request"""
+        driver = MockDriver()
+        self.assertFalse(driver.batched)
+        self.assertTrue(batch_driver.batched)
+        results = driver.action_many([{'param': 'on'}, {'param': 'off'}])
+        self.assertEqual([r.status for r in results], ['DONE', 'DONE'])
+        self.assertEqual(driver.params, {'param': 'off'})
+        self.assertIsInstance(DeviceDriver().action_many([{'unknown': 1}])[0], TypeError)
+
+    def test_resolve_grouped(self):
+        """One driver call for all devices of batched driver"""
+        devices = [self.build_device(f'dev-{i}') for i in range(3)]
+        resolver = DeviceResolver(max_workers=2, timeout=1)
+        ret = [dict(d) for d in resolver.resolve(devices)]
+        resolver.shutdown()
+
+        self.assertEqual(len(batch_driver.calls), 1)
+        self.assertEqual([r['value'] for r in batch_driver.calls[0]], ['dev-0', 'dev-1', 'dev-2'])
+        self.assertEqual([dict(r['driver_params']) for r in batch_driver.calls[0]][1], {'topic': 'dev-1', 'device_id': 'dev-1'})
+        for device in ret:
+            self.assertEqual(device['capabilities'][0]['state']['action_result']['status'], 'DONE')
+
+    def test_query_grouped(self):
+        """Batched queries get device params like actions"""
+        device = (
+            YandexDeviceBuilder('dev-1', 'devices.types.light')
+            .with_capabilities(YandexRequest.build_query_request({'on_off': {}}))
+            .with_custom_data({'driver': 'test_batch', 'params': {'topic': 'dev-1'}, 'actions': {}})
+        ).build()
+        resolver = DeviceResolver(max_workers=2, timeout=1)
+        resolver.resolve([device])
+        resolver.shutdown()
+        request = batch_driver.calls[0][0]
+        self.assertEqual((request['action'], request['param']), ('query', 'on_off'))
+        self.assertEqual(dict(request['driver_params']), {'topic': 'dev-1', 'device_id': 'dev-1'})
+
+    def test_resolve_async_grouped(self):
+        devices = [self.build_device(f'dev-{i}') for i in range(2)]
+        resolver = DeviceResolver(max_workers=2, timeout=1)
+        ret = [dict(d) for d in asyncio.run(resolver.resolve_async(devices))]
+        resolver.shutdown()
+        self.assertEqual(len(batch_driver.calls), 1)
+        self.assertEqual(ret[1]['capabilities'][0]['state']['action_result']['status'], 'DONE')
+
+    def test_device_resolve(self):
+        device = self.build_device('dev-1')
+        device.resolve()
+        self.assertEqual(len(batch_driver.calls), 1)
+        self.assertEqual(dict(device)['capabilities'][0]['state']['action_result']['status'], 'DONE')
+
+
+class TestCoalescer(unittest.TestCase):
+    KEY = ('dev-1', 'range', 'brightness')
+
+    def request(self, value, relative=False):
+        return ActionRequest('range', {'instance': 'brightness', 'value': value, 'relative': relative})
+
+    def setUp(self):
+        self.coalescer = CommandCoalescer()
+        self.sent = []
+        self.running = []
+
+    def execute(self, request):
+        self.sent.append((request.value, request.relative))
+        self.running.append(Future())
+        return self.running[-1]
+
+    def test_merge(self):
+        steps = [self.request(10, True), self.request(10, True), self.request(-5, True)]
+        # Steps not summed, drivers send one step per command
+        self.assertEqual(split(steps), 1)
+        self.assertEqual(split(steps + [self.request(40)]), 4)
+        self.assertEqual((merge(steps[:1]).value, merge(steps[:1]).relative), (10, True))
+        net = merge([self.request(10, True), self.request(40), self.request(5, True)])
+        self.assertEqual((net.value, net.relative), (45, False))
+        self.assertIsNone(merge([self.request(50)], last=self.request(50)))
+
+    def test_burst(self):
+        """Values queued while first in flight sent as one, every request answered"""
+        requests = [self.request(10, True), self.request(30), self.request(60), self.request(5, True)]
+        futures = [self.coalescer.submit(self.KEY, r, self.execute) for r in requests]
+        self.assertEqual(self.sent, [(10, True)])
+        self.running[0].set_result(ActionResult('brightness', ActionResult.STATUS_DONE))
+        self.assertEqual(self.sent, [(10, True), (65, False)])
+        self.running[1].set_result(ActionResult('brightness', ActionResult.STATUS_ERROR, 'DEVICE_BUSY', 'Busy'))
+
+        results = [f.result(0) for f in futures]
+        self.assertEqual([r.status for r in results], ['DONE', 'ERROR', 'ERROR', 'ERROR'])
+        self.assertEqual({r.param for r in results}, {'brightness'})
+        self.assertEqual([(r.sent.value, r.sent.relative) for r in results], [(10, True)] + [(65, False)] * 3)
+        self.assertEqual(self.coalescer.chains, {})
+        self.assertEqual(self.coalescer.stats()['coalesced'], 2)
+
+    def test_steps(self):
+        """Relative steps sent one by one"""
+        futures = [self.coalescer.submit(self.KEY, self.request(10, True), self.execute) for _ in range(3)]
+        for i in range(3):
+            self.running[i].set_result(ActionResult('brightness', ActionResult.STATUS_DONE))
+        self.assertEqual(self.sent, [(10, True)] * 3)
+        self.assertEqual([f.result(0).status for f in futures], ['DONE'] * 3)
+
+    def test_retry_after_failure(self):
+        """Retry of failed command sent, not answered with result of failed one"""
+        key = ('dev-1', 'on_off', 'on')
+        toggle = lambda value: ActionRequest('on_off', {'instance': 'on', 'value': value})
+        first = self.coalescer.submit(key, toggle(True), self.execute)
+        retry = self.coalescer.submit(key, toggle(True), self.execute)
+        self.running[0].set_result(ActionResult('on', ActionResult.STATUS_ERROR, 'DEVICE_UNREACHABLE', 'Timeout'))
+        self.assertEqual(self.sent, [(True, False), (True, False)])
+        self.running[1].set_result(ActionResult('on', ActionResult.STATUS_DONE))
+        self.assertEqual((first.result(0).status, retry.result(0).status), ('ERROR', 'DONE'))
+
+    def test_toggles_cancel(self):
+        """Queued toggles ending at value just sent not sent again"""
+        key = ('dev-1', 'on_off', 'on')
+        toggle = lambda value: ActionRequest('on_off', {'instance': 'on', 'value': value})
+        futures = [self.coalescer.submit(key, toggle(v), self.execute) for v in (True, False, True)]
+        self.running[0].set_result(ActionResult('on', ActionResult.STATUS_DONE))
+        self.assertEqual(self.sent, [(True, False)])
+        self.assertEqual([f.result(0).status for f in futures], ['DONE'] * 3)
+        self.assertEqual(self.coalescer.chains, {})
+
+    def test_resolve_async(self):
+        """Concurrent requests for one device coalesced by resolver"""
+        resolver = DeviceResolver(max_workers=2, timeout=1, coalescer=self.coalescer)
+        sent = []
+
+        def build():
+            device = TestResolver().build_device('dev-1')
+
+            async def call_async(value, params):
+                sent.append(value.resolve.value)
+                await asyncio.sleep(0.01)
+                return ActionResult('on', ActionResult.STATUS_DONE)
+
+            device.call_async = call_async
+            return device
+
+        async def burst():
+            return await asyncio.gather(*(resolver.resolve_async([build()]) for _ in range(3)))
+
+        ret = asyncio.run(burst())
+        self.assertEqual(sent, [True])
+        for devices in ret:
+            self.assertEqual(dict(devices[0])['capabilities'][0]['state']['action_result']['status'], 'DONE')
+        resolver.shutdown()
+
+    def test_record_sent(self):
+        """Merged requests keep state actually sent, not own requested one"""
+        store = StateStore()
+        resolver = DeviceResolver(max_workers=1, store=store)
+        devices = [TestResolver().build_device('dev-1', v) for v in (False, True, False)]
+        values = [value for _, value in resolver.pending(devices)]
+        futures = [self.coalescer.submit(('dev-1', 'on_off', 'on'), value.resolve, self.execute) for value in values]
+        self.running[0].set_result(ActionResult('on', ActionResult.STATUS_DONE))
+        # Queued True and False cancel out at False just sent
+        self.assertEqual(self.sent, [(False, False)])
+        for i in (0, 2, 1):
+            resolver.record(devices[i], values[i], futures[i].result(0))
+        self.assertIs(store.get('dev-1', 'on_off')[1], False)
+        resolver.shutdown()
+
+
+class TestEncoder(unittest.TestCase):
+    def assertEncoded(self, obj):
+        expected = json.dumps(dict(obj), ensure_ascii=True, sort_keys=True, separators=(",", ":"))
+        self.assertEqual(encode(obj), expected.encode())
+
+    def test_descriptors(self):
+        """Devices list descriptors same as dict serialization"""
+        device = (
+            YandexDeviceBuilder('test-1234', 'devices.types.light')
+            .with_name('Лампа')
+            .with_room('Living room')
+            .with_description('First lamp')
+            .with_custom_data({"driver":"mock",'params':{"freq":315, "payload": "10965763,24"}})
+            .with_properties({'temperature':{}})
+            .with_capabilities({'on_off':{'split':True,'reportable':True}, 'toggle':{'retrievable':False}})
+            .with_device_info({"manufacturer":"vt77", "model":"rf315sw", "hw_version":"0.1", "sw_version":"0.1"})
+        ).build()
+        self.assertEncoded(device)
+        for value in device.capabilities + device.properties:
+            self.assertEncoded(value)
+        self.assertEncoded(YandexResponse('req-1', [device, {'id': '1', 'error_code': 'DEVICE_NOT_FOUND'}], 'user'))
+
+    def test_states(self):
+        """Query and action results same as dict serialization"""
+        device = YandexDeviceBuilder('test-1234').with_capabilities({'on_off':{}, 'range':{}}).build()
+        device.capabilities[0].set_result(ActionResult('on', ActionResult.STATUS_DONE))
+        device.capabilities[1].set_result(ActionResult('brightness', ActionResult.STATUS_ERROR, 'INVALID_VALUE', 'Bad'))
+        self.assertEncoded(device)
+        self.assertEncoded(ActionResult('on', ActionResult.STATUS_ERROR, 'INVALID_VALUE', 'Bad'))
+        device.set_error(YandexError('DEVICE_UNREACHABLE', 'Device not answered'))
+        self.assertEncoded(device)
+
+
+class TestValidation(unittest.TestCase):
+    row = {
+        'device_id': 1, 'name': 'Sensor', 'device_type': 'devices.types.sensor', 'driver': 'mock',
+        'capabilities': {}, 'properties': {'temperature': {}},
+        'device_info': {'manufacturer': 'vt77', 'model': 'th1', 'hw_version': '0.1', 'sw_version': '0.1'},
+    }
+
+    def test_valid(self):
+        validator = CatalogValidator()
+        self.assertEqual(validator.check_device(self.row), [])
+        self.assertEqual(validator.validate([self.row]), [self.row])
+
+    def test_all_violations_reported(self):
+        bad = dict(
+            self.row,
+            device_id=2,
+            name='',
+            capabilities={'on_off': {'spilt': True}, 'unknown': {}},
+            properties={'temperature': {'units': 'C'}},
+        )
+        validator = CatalogValidator()
+        with self.assertRaises(CatalogValidationError) as ctx:
+            validator.validate([self.row, bad, self.row])
+        fields = sorted((v.device_id, v.field) for v in ctx.exception.violations)
+        self.assertEqual(fields, [
+            (1, 'device_id'),
+            (2, 'capabilities.on_off'),
+            (2, 'capabilities.on_off'),
+            (2, 'capabilities.unknown'),
+            (2, 'name'),
+            (2, 'properties.temperature'),
+        ])
+        # Rows already in DB still served
+        with self.assertLogs('integrations.validation', 'WARNING'):
+            self.assertEqual(validator.checked_rows([self.row, bad]), [self.row, bad])
+
+    def test_list_capabilities(self):
+        """devices table list format accepted quietly and converted once"""
+        row = dict(self.row, device_type='devices.types.light', properties={}, capabilities=['devices.capabilities.toggle'])
+        validator = CatalogValidator()
+        self.assertEqual(validator.check_device(row), [])
+        with self.assertNoLogs('integrations.validation', 'WARNING'):
+            checked = validator.checked_rows([row])
+        self.assertEqual(checked[0]['capabilities'], {'toggle': {}})
+
+
+class TestDecoder(unittest.TestCase):
+    def test_action(self):
+        body = {'payload': {'devices': [{'id': 1, 'capabilities': [
+            {'type': 'devices.capabilities.on_off', 'state': {'instance': 'on', 'value': False}},
+            {'type': 'devices.capabilities.range', 'state': {'instance': 'brightness', 'value': 10, 'relative': True}},
+        ]}]}}
+        yandex_request = YandexRequest.action(body)
+        self.assertEqual(yandex_request.device_ids, ['1'])
+        on_off, brightness = yandex_request.devices[0].capabilities
+        self.assertEqual((on_off.name, on_off.instance, on_off.value), ('on_off', 'on', False))
+        self.assertTrue(brightness.relative)
+
+    def test_query(self):
+        self.assertEqual(YandexRequest.query({'devices': [{'id': 'a'}, {'id': 2}]}).device_ids, ['a', '2'])
+
+    def test_invalid(self):
+        """Malformed bodies rejected with yandex error codes"""
+        capability = {'type': 'devices.capabilities.on_off', 'state': {'instance': 'on', 'value': True}}
+        cases = [
+            (None, 'INVALID_VALUE'),
+            ({'devices': []}, 'INVALID_VALUE'),
+            ({'devices': [{'capabilities': [capability]}]}, 'INVALID_VALUE'),
+            ({'devices': [{'id': '1', 'capabilities': [dict(capability, type='devices.capabilities.fly')]}]}, 'INVALID_ACTION'),
+            ({'devices': [{'id': '1', 'capabilities': [dict(capability, state={'instance': 'on', 'value': 1})]}]}, 'INVALID_VALUE'),
+            ({'devices': [{'id': '1', 'capabilities': [dict(capability, state={'instance': 'on'})]}]}, 'INVALID_VALUE'),
+        ]
+        for body, error_code in cases:
+            with self.assertRaises(DecodeError) as ctx:
+                DECODER.action(body)
+            self.assertEqual(dict(ctx.exception)['error_code'], error_code)
+        with self.assertRaises(DecodeError):
+            DECODER.query({'devices': [{'id': None}]})
+
 
 class TestIntegrationYandex(unittest.TestCase):
                                                             
@@ -122,3 +514,31 @@ class TestIntegrationYandex(unittest.TestCase):
         print(dict(device))
         self.assertEqual(device.room,'Living room')
 
+    def test_response_encode(self):
+        """Pre-encoded payload spliced with request_id same as jsonify output"""
+        builder = (
+            YandexDeviceBuilder('test-1234', 'devices.types.light')
+            .with_name('Лампа')
+            .with_room('Living room')
+            .with_capabilities({'on_off':{'split':True}})
+        )
+        response = YandexResponse('req-1', [builder.build()], 'testuser')
+        expected = json.dumps(dict(response), ensure_ascii=True, sort_keys=True, separators=(",", ":")) + "\n"
+        self.assertEqual(splice_response('req-1', encode_payload(response)), expected.encode())
+        self.assertEqual(encode_body(response), expected.encode())
+
+    def test_build_many(self):
+        """Batch build gives same devices as from_row"""
+        rows = [
+            {
+                'device_id': i, 'name': f'Lamp {i}', 'description': 'Lamp', 'room': 'Kids',
+                'device_type': 'devices.types.light', 'driver': 'mock', 'params': {'code': i},
+                'capabilities': {'on_off': {'split': i == 1}}, 'properties': {'temperature': {}},
+                'device_info': {'manufacturer': 'vt77', 'model': 'rf315sw', 'hw_version': '0.1', 'sw_version': '0.1'},
+            }
+            for i in range(3)
+        ]
+        devices = YandexDeviceBuilder.build_many(iter(rows))
+        self.assertNotIsInstance(devices, list)
+        expected = [encode(YandexDeviceBuilder.from_row(row)) for row in rows]
+        self.assertEqual([encode(d) for d in devices], expected)
@@ -0,0 +1,86 @@
+import sys
+import threading
+import unittest
+
+# Project lib path
+sys.path.append("./lib")
+
+from metrics import Registry, timed
+
+
+class MockBackend:
+    table = "users"
+
+    def load_user(self, user_id):
+        return user_id
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_threads(self):
+        """Per thread shards merged on collect"""
+        counter = self.registry.counter("errors_total", "Errors", ("code",))
+
+        def work():
+            for _ in range(1000):
+                counter.inc("DEVICE_NOT_FOUND")
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        counter.inc("INTERNAL_ERROR", amount=2)
+        self.assertEqual(counter.values(), {("DEVICE_NOT_FOUND",): 4000, ("INTERNAL_ERROR",): 2})
+        self.assertIn('errors_total{code="DEVICE_NOT_FOUND"} 4000', self.registry.render().decode())
+
+    def test_exited_threads_folded(self):
+        """Shards of exited threads folded into base values"""
+        histogram = self.registry.histogram("latency_seconds", "Latency", buckets=(1,))
+        for _ in range(10):
+            thread = threading.Thread(target=histogram.observe, args=(0.5,))
+            thread.start()
+            thread.join()
+        self.assertEqual(histogram._shards, [])
+        self.assertEqual(histogram.values(), {(): [10, 0, 5.0]})
+        histogram.observe(2)
+        self.registry.reset()
+        self.assertEqual(histogram.values(), {})
+        histogram.observe(2)
+        self.assertEqual(histogram.values(), {(): [0, 1, 2]})
+
+    def test_histogram_render(self):
+        histogram = self.registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1))
+        histogram.observe(0.05, "/q")
+        histogram.observe(0.1, "/q")
+        histogram.observe(5, "/q")
+        lines = self.registry.render().decode().splitlines()
+        self.assertEqual(
+            lines,
+            [
+                "# HELP latency_seconds Latency",
+                "# TYPE latency_seconds histogram",
+                'latency_seconds_bucket{route="/q",le="0.1"} 2',
+                'latency_seconds_bucket{route="/q",le="1"} 2',
+                'latency_seconds_bucket{route="/q",le="+Inf"} 3',
+                'latency_seconds_sum{route="/q"} 5.15',
+                'latency_seconds_count{route="/q"} 3',
+            ],
+        )
+
+    def test_timed_proxy(self):
+        histogram = self.registry.histogram("backend_seconds", "Backend", ("call",))
+        backend = timed(MockBackend(), histogram)
+        self.assertEqual(backend.load_user(200), 200)
+        self.assertEqual(backend.table, "users")
+        # Bucket counts, last item is sum
+        self.assertEqual(sum(histogram.values()[("load_user",)][:-1]), 1)
+
+    def test_callback(self):
+        metric = self.registry.callback("cache_hit_ratio", "Hit ratio", ("cache",), lambda: [(("catalog",), 0.5)])
+        self.assertEqual(metric.values(), {("catalog",): 0.5})
+        self.assertIn('cache_hit_ratio{cache="catalog"} 0.5', self.registry.render().decode())
+        with self.assertRaises(ValueError):
+            self.registry.counter("cache_hit_ratio", "Duplicate")
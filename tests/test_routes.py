@@ -99,6 +99,23 @@ class TestYandexEndpoints(unittest.TestCase):
         self.assertEqual(rv.json["payload"]['devices'][0]['name'], 'Lamp1')
         self.assertEqual(rv.json["payload"]['devices'][0]['type'], 'devices.types.light')
 
+        # Same catalog, conditional request answered with 304
+        etag = rv.headers["ETag"]
+        rv = client.get("/v1.0/user/devices", headers=dict(self.headers, **{"If-None-Match": etag}))
+        self.assertEqual(rv.status_code, 304)
+        backend.load_yandex_devices.assert_called_once_with(200)
+
+
+    def test_v1_auth_errors(self, auth_backend):
+        """Rejected token is forbidden, backend failure is not"""
+        client = app.test_client()
+        rv = client.get("/v1.0/user/devices", headers=dict(self.headers, Authorization="Bearer invalid"))
+        self.assertEqual(rv.status_code, 403)
+
+        (other, _, _) = tokens.create_token_pair(101)
+        auth_backend.load_user.side_effect = ConnectionError("db down")
+        with self.assertRaises(ConnectionError):
+            client.get("/v1.0/user/devices", headers=dict(self.headers, Authorization=f"Bearer {other}"))
 
     @patch("wsgi.backend")
     def no_test_v1_devices_query(self, backend, auth_backend):
@@ -0,0 +1,105 @@
+import gc
+import os
+import sys
+import unittest
+from unittest import mock
+
+# Project lib path
+sys.path.append("./lib")
+
+from runtime import Lazy, Services, on_fork, reset
+
+
+class MockSettings:
+    DB_POOL_SIZE = 2
+    RESOLVE_TIMEOUT = 1
+
+
+class TestLazy(unittest.TestCase):
+    def test_created_once(self):
+        """Object created on first use only"""
+        created = []
+
+        def factory():
+            created.append(1)
+            return MockSettings()
+
+        lazy = Lazy(factory)
+        self.assertEqual(created, [])
+        self.assertEqual(lazy.DB_POOL_SIZE, 2)
+        lazy.DB_POOL_SIZE = 3
+        self.assertEqual(lazy().DB_POOL_SIZE, 3)
+        self.assertEqual(created, [1])
+
+        reset(lazy)
+        self.assertEqual(lazy.DB_POOL_SIZE, 2)
+        self.assertEqual(created, [1, 1])
+
+
+class TestServices(unittest.TestCase):
+    def test_lazy_services(self):
+        """Services do not touch backend until used"""
+        services = Services(MockSettings(), lambda: None)
+        self.assertIsNone(services.pool._instance)
+        self.assertEqual(services.resolver.timeout, 1)
+        self.assertEqual(services.catalog.cache.maxsize, 1024)
+
+        services.after_fork()
+        self.assertIsNone(services.pool._instance)
+        self.assertIsNone(services.resolver._instance)
+        self.assertIsNone(services.catalog._instance)
+
+    def test_partial_catalog_from_db(self):
+        """Query/action requests load requested devices with db query"""
+        services = Services(MockSettings(), lambda: None)
+        with mock.patch('runtime.services.load_yandex_devices_by_ids', return_value=[]) as load:
+            self.assertEqual(services.catalog.load_devices(100, ['1']), {})
+        load.assert_called_once_with(services.connection, 100, ['1'])
+
+    def test_ingest_not_on_request_path(self):
+        """Resolver does not depend on state feed, feed start never raises"""
+        settings = MockSettings()
+        settings.MQTT_HOST = '127.0.0.1'
+        settings.MQTT_PORT = 1
+        settings.MQTT_STATE_TOPICS = ('#',)
+        services = Services(settings, lambda: None)
+        services.load_device_params = lambda: []
+        self.assertEqual(services.resolver.timeout, 1)
+        self.assertIsNone(services.ingest._instance)
+        services.start_ingest()
+        self.assertIsNotNone(services.ingest._instance)
+        services.ingest.stop()
+
+    @unittest.skipUnless(hasattr(os, "fork"), "fork not supported")
+    def test_fork_hooks(self):
+        """Fork hooks run in child"""
+        read_fd, write_fd = os.pipe()
+
+        class Resource:
+            def after_fork(self):
+                os.write(write_fd, b"x")
+
+        resource = Resource()
+        on_fork(resource.after_fork)
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0)
+        os.waitpid(pid, 0)
+        os.close(write_fd)
+        self.assertEqual(os.read(read_fd, 1), b"x")
+        os.close(read_fd)
+
+    def test_fork_hooks_released(self):
+        """Hook does not keep its Services alive"""
+        from runtime import fork
+        services = Services(MockSettings(), lambda: None)
+        hook = fork._fork_hooks[-1]
+        self.assertEqual(hook(), services.after_fork)
+        del services
+        gc.collect()
+        self.assertIsNone(hook())
+        fork._prune()
+        self.assertNotIn(hook, fork._fork_hooks)
+
+if __name__ == "__main__":
+    unittest.main()
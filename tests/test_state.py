@@ -0,0 +1,287 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+# Project lib path
+sys.path.append("./lib")
+
+from state import StateStore, StateJournal, JournalError
+from state.journal import LOG_FILE, SNAPSHOT_FILE, verify
+from state.store import RESTORED
+from state.ingest import StateIngest, device_routes, decode_payload
+from mqtt import MqttClient, TopicTrie
+from mqtt.broker import LocalBroker
+from integrations.yandex import YandexDeviceBuilder, YandexRequest
+from integrations.resolver import DeviceResolver
+from devices.actions import ActionResult, QueryResult
+
+
+class MockClock:
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestStateStore(unittest.TestCase):
+    def test_fresh(self):
+        clock = MockClock()
+        store = StateStore(max_age=10, clock=clock)
+        store.set(1, 'on_off', 'on', True)
+        self.assertEqual(store.fresh('1', 'on_off'), ('on', True, 0.0))
+        clock.now = 11
+        self.assertIsNone(store.fresh('1', 'on_off'))
+        self.assertEqual(store.get('1', 'on_off')[1], True)
+        self.assertEqual(store.stats()['hits'], 1)
+
+
+class TestStateJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_restore(self):
+        journal = StateJournal(self.dir)
+        store = StateStore(journal=journal)
+        store.set(1, 'on_off', 'on', True)
+        store.set(1, 'range', 'brightness', 40)
+        store.set(1, 'on_off', 'on', False)
+        journal.close()
+
+        journal = StateJournal(self.dir)
+        restored = StateStore(journal=journal)
+        self.assertEqual(restored.restore(), 2)
+        self.assertEqual(restored.fresh('1', 'on_off')[:2], ('on', False))
+        self.assertTrue(restored.get('1', 'on_off')[RESTORED])
+        self.assertEqual(restored.get('1', 'range')[:2], ('brightness', 40))
+        # Restored entries not logged again
+        self.assertEqual(verify(self.dir)[LOG_FILE]['records'], 3)
+        journal.close()
+
+    def test_compact(self):
+        journal = StateJournal(self.dir, max_log_size=200)
+        store = StateStore(journal=journal)
+        for i in range(20):
+            store.set(1, 'range', 'brightness', i)
+            journal.flush()
+        report = verify(self.dir)
+        self.assertEqual(report[SNAPSHOT_FILE]['records'], 1)
+        self.assertLess(report[LOG_FILE]['records'], 20)
+        self.assertEqual(journal.compact(), 1)
+        self.assertEqual(verify(self.dir)[LOG_FILE]['records'], 0)
+        self.assertEqual(journal.load()[0][3], 19)
+        journal.close()
+
+    def test_restore_age(self):
+        """Restored state served as last known until restore_max_age"""
+        clock = MockClock()
+        journal = StateJournal(self.dir)
+        StateStore(journal=journal).set(1, 'on_off', 'on', True, updated=time.monotonic() - 120)
+        journal.close()
+
+        journal = StateJournal(self.dir)
+        store = StateStore(max_age=30, clock=clock, journal=journal, restore_max_age=600)
+        store.restore()
+        self.assertEqual(store.fresh('1', 'on_off')[:2], ('on', True))
+        clock.now = 500
+        self.assertIsNone(store.fresh('1', 'on_off'))
+        # Updated entry is fresh for max_age only
+        store.set(1, 'on_off', 'on', False)
+        self.assertEqual(store.fresh('1', 'on_off'), ('on', False, 500))
+        clock.now = 531
+        self.assertIsNone(store.fresh('1', 'on_off'))
+        journal.close()
+
+    def test_writer(self):
+        """Changes written by writer thread, caller does not wait"""
+        journal = StateJournal(self.dir)
+        store = StateStore(journal=journal)
+        store.set(1, 'on_off', 'on', True)
+        store.set(2, 'on_off', 'on', True)
+        for _ in range(100):
+            if verify(self.dir)[LOG_FILE]['records'] == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(verify(self.dir)[LOG_FILE]['records'], 2)
+        self.assertEqual(journal.writer.name, 'state-journal')
+        journal.close()
+
+    def test_torn_tail(self):
+        journal = StateJournal(self.dir)
+        StateStore(journal=journal).set(1, 'on_off', 'on', True)
+        journal.close()
+        with open(os.path.join(self.dir, LOG_FILE), 'ab') as f:
+            f.write(b'\x20\x00\x00\x00garbage')
+        self.assertTrue(verify(self.dir)[LOG_FILE]['problem'].startswith('truncated record'))
+
+        journal = StateJournal(self.dir)
+        self.assertIsNone(verify(self.dir)[LOG_FILE]['problem'])
+        self.assertEqual(len(journal.load()), 1)
+        journal.close()
+
+    def test_version(self):
+        with open(os.path.join(self.dir, SNAPSHOT_FILE), 'wb') as f:
+            f.write(b'ASTS\x09\x00\x00\x00')
+        journal = StateJournal(self.dir)
+        with self.assertRaises(JournalError):
+            journal.load()
+        journal.close()
+
+
+class TestStateResolve(unittest.TestCase):
+    def setUp(self):
+        self.clock = MockClock()
+        self.store = StateStore(max_age=10, clock=self.clock)
+        self.resolver = DeviceResolver(max_workers=2, timeout=1, store=self.store)
+        self.calls = []
+
+    def tearDown(self):
+        self.resolver.shutdown()
+
+    def device(self, capabilities):
+        device = YandexDeviceBuilder('dev-1').with_capabilities(capabilities).build()
+
+        def call(value, params):
+            self.calls.append(value.name)
+            if value.resolve.action_name == 'query':
+                return QueryResult('on', False)
+            return ActionResult('on', ActionResult.STATUS_DONE)
+
+        device.call = call
+        return device
+
+    def query(self):
+        device = self.device(YandexRequest.build_query_request({'on_off': {}}))
+        return dict(self.resolver.resolve([device])[0])['capabilities'][0]['state']
+
+    def test_query_served_from_store(self):
+        """Driver queried only when state stale"""
+        self.assertEqual(self.query(), {'instance': 'on', 'value': False})
+        self.assertEqual(self.query(), {'instance': 'on', 'value': False})
+        self.assertEqual(self.calls, ['on_off'])
+        self.clock.now = 11
+        self.query()
+        self.assertEqual(self.calls, ['on_off', 'on_off'])
+
+    def test_action_optimistic_state(self):
+        """Done action stored as current state"""
+        action = [{'type': 'devices.capabilities.on_off', 'state': {'instance': 'on', 'value': True}}]
+        self.resolver.resolve([self.device(YandexRequest.build_action_request({'on_off': {}}, action))])
+        self.assertEqual(self.query(), {'instance': 'on', 'value': True})
+        self.assertEqual(self.calls, ['on_off'])
+
+
+class TestStateIngest(unittest.TestCase):
+    DEVICES = [
+        (1, {'state_topic': 'sensors/kitchen'}),
+        (2, {'state_topics': {'on_off': 'relay/2', 'range': {'topic': 'dimmer/2', 'instance': 'brightness'}}}),
+        (3, {'state_topics': {'temperature': 'sensors/+/t'}}),
+        (4, None),
+    ]
+
+    def test_trie(self):
+        trie = TopicTrie([('a/b', 1), ('a/+', 2), ('a/#', 3), ('#', 4), ('a/b/c', 5)])
+        self.assertEqual(sorted(trie.match('a/b')), [1, 2, 3, 4])
+        self.assertEqual(sorted(trie.match('a')), [3, 4])
+        self.assertEqual(sorted(trie.match('a/b/c')), [3, 4, 5])
+        self.assertEqual(trie.match('b/c'), [4])
+        self.assertEqual(len(trie), 5)
+
+    def test_routes(self):
+        routes = dict(device_routes(2, self.DEVICES[1][1]))
+        self.assertEqual(routes['relay/2'], ('2', 'on_off', 'on'))
+        self.assertEqual(routes['dimmer/2'], ('2', 'range', 'brightness'))
+        self.assertEqual(device_routes(4, None), [])
+        self.assertEqual([decode_payload(p) for p in (b'ON', b'42', b'21.5', b'{"a": 1}', b'idle')],
+                         [True, 42, 21.5, {'a': 1}, 'idle'])
+
+    def test_batch(self):
+        store = StateStore()
+        ingest = StateIngest(store, lambda: self.DEVICES, prefix='home', batch_size=3)
+        ingest.rebuild()
+        ingest.on_message('home/relay/2', b'on')
+        ingest.on_message('home/other/topic', b'1')
+        ingest.on_message('other/relay/2', b'1')
+        self.assertEqual(store.get('2', 'on_off'), None)
+        ingest.on_message('home/sensors/kitchen', b'{"temperature": 20, "on_off": false}')
+        # Batch full, written at once
+        self.assertEqual(store.get('1', 'on_off')[:2], ('on', False))
+        self.assertEqual(store.get('1', 'temperature')[:2], ('temperature', 20))
+        ingest.batch_size = 10
+        ingest.on_message('home/sensors/kitchen/t', b'21.5')
+        ingest.on_message('home/dimmer/2', b'40')
+        ingest.on_message('home/dimmer/2', b'50')
+        self.assertEqual(ingest.flush(), 2)
+        self.assertEqual(store.get('3', 'temperature')[:2], ('temperature', 21.5))
+        self.assertEqual(store.get('2', 'range')[:2], ('brightness', 50))
+        self.assertEqual(ingest.stats(), {'messages': 7, 'unmatched': 2, 'updates': 5, 'routes': 4})
+
+    def test_journal(self):
+        with tempfile.TemporaryDirectory() as directory:
+            journal = StateJournal(directory)
+            store = StateStore(journal=journal)
+            store.set_many([(1, 'on_off', 'on', True), (1, 'on_off', 'on', False), (2, 'range', 'brightness', 5)])
+            journal.flush()
+            self.assertEqual(verify(directory)[LOG_FILE]['records'], 2)
+            journal.close()
+
+    def test_subscribed(self):
+        broker = LocalBroker()
+        store = StateStore()
+        ingest = StateIngest(store, lambda: self.DEVICES, prefix='home', topics=('relay/#', 'dimmer/#'),
+                             flush_interval=0.01)
+        ingest.start(MqttClient(broker.host, broker.port))
+        try:
+            self.assertEqual(set(ingest.subscriptions()), {'home/relay/#', 'home/dimmer/#'})
+            self.assertTrue(broker.wait(lambda b: len(b.subscriptions) == 2))
+            broker.deliver('home/relay/2', b'on')
+            broker.deliver('home/sensors/kitchen', b'{"on_off": true}')
+            deadline = time.monotonic() + 2
+            while store.get('2', 'on_off') is None and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(store.get('2', 'on_off')[:2], ('on', True))
+            # Not subscribed
+            self.assertIsNone(store.get('1', 'on_off'))
+        finally:
+            ingest.stop()
+            broker.stop()
+
+    def test_unavailable(self):
+        """Broker and DB failures do not fail start, retried in ingest thread"""
+        broker = LocalBroker()
+        failures = [ConnectionError('db down')]
+
+        def load_devices():
+            if failures:
+                raise failures.pop()
+            return self.DEVICES
+
+        ingest = StateIngest(StateStore(), load_devices, topics=('relay/#',), flush_interval=0.01, retry_interval=0.05)
+        ingest.start(MqttClient(broker.host, broker.port))
+        try:
+            self.assertTrue(broker.wait(lambda b: len(b.subscriptions) == 1))
+            self.assertTrue(ingest.ready)
+            self.assertEqual(len(ingest.trie), 4)
+            broker.drop_clients()
+            self.assertTrue(broker.wait(lambda b: b.connects == 2 and len(b.subscriptions) == 1))
+        finally:
+            ingest.stop()
+            broker.stop()
+
+        closed = LocalBroker()
+        closed.stop()
+        ingest = StateIngest(StateStore(), lambda: self.DEVICES, retry_interval=0.05)
+        ingest.start(MqttClient(closed.host, closed.port, retry_interval=0))
+        time.sleep(0.1)
+        self.assertTrue(ingest.ready)
+        self.assertEqual(ingest.client.subscriptions, {'#': 0})
+        ingest.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+"""User devices import, see lib/db/devices.py
+
+Usage:
+    python tools/catalog.py check FILE
+    python tools/catalog.py import USER_ID FILE
+
+FILE is json list of devices in backend.load_yandex_devices format. Ex:
+    [{"device_id": 10000101, "name": "Lamp", "description": "", "room": "Kids",
+      "device_type": "devices.types.light", "driver": "mqtt",
+      "params": {"topic": "/rf/315"}, "capabilities": {"toggle": {}},
+      "properties": {}, "device_info": null}]
+
+Devices validated against device type tables, all violations printed and
+nothing written when any device is invalid (exit code 1). import writes
+with settings DB config, devices of other users are never overwritten.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+
+from integrations.validation import CatalogValidator, CatalogValidationError  # noqa: E402
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="User devices import tool")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("check").add_argument("file", help="devices json file")
+    import_parser = subparsers.add_parser("import")
+    import_parser.add_argument("user_id", type=int, help="devices owner")
+    import_parser.add_argument("file", help="devices json file")
+    args = parser.parse_args(argv)
+
+    with open(args.file) as f:
+        devices = json.load(f)
+    if not isinstance(devices, list):
+        parser.error(f"{args.file}: json list of devices expected")
+
+    try:
+        if args.command == "check":
+            CatalogValidator().validate(devices)
+            print(f"{len(devices)} devices valid")
+        else:
+            import settings  # pylint: disable=import-outside-toplevel
+            from runtime import Services  # pylint: disable=import-outside-toplevel
+
+            # Backend not used for writes
+            services = Services(settings, lambda: None)
+            print(f"imported {services.save_devices(args.user_id, devices)} devices")
+    except CatalogValidationError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+"""State journal maintenance, see lib/state/journal.py
+
+Usage:
+    python tools/statelog.py verify STATE_DIR
+    python tools/statelog.py compact STATE_DIR
+    python tools/statelog.py dump STATE_DIR
+
+verify exits with 1 when any file is damaged. compact is safe while workers
+are running: it takes the same exclusive lock as worker compaction.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+
+from state.journal import StateJournal, verify  # noqa: E402
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Device state journal tool")
+    parser.add_argument("command", choices=("verify", "compact", "dump"))
+    parser.add_argument("directory", help="state directory (STATE_DIR)")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        parser.error(f"{args.directory}: not a directory")
+
+    if args.command == "verify":
+        damaged = False
+        for name, report in verify(args.directory).items():
+            status = report["problem"] or "ok"
+            damaged |= report["problem"] is not None
+            print(f"{name}: {report['records']} records, {report['valid']}/{report['size']} bytes valid: {status}")
+        return 1 if damaged else 0
+
+    journal = StateJournal(args.directory)
+    try:
+        if args.command == "compact":
+            print(f"compacted {journal.compact()} entries")
+        else:
+            for entry in journal.load():
+                print(json.dumps(entry))
+    finally:
+        journal.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
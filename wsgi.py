@@ -1,15 +1,22 @@
 import os
 import sys
+import time
 import logging
 
+from functools import wraps
+
 from flask import (
+    Blueprint,
     Flask,
+    current_app,
+    g,
     request,
     render_template,
     jsonify,
     abort,
     make_response,
 )
+from werkzeug.local import LocalProxy
 
 import settings
 
@@ -20,71 +27,180 @@ from lib.auth import VT77APIAuth, ApiAuthError, TokenAgentOAuth
 from lib.backend import alice as backend
 
 from integrations.yandex import YandexDevice, YandexDeviceBuilder, YandexError, YandexRequest, YandexResponse 
-from drivers import DriverFactory
+from integrations.encoder import encode_body, splice_response
+from integrations.decoder import DecodeError
+from runtime import Lazy, Services, freeze
+from metrics import REGISTRY, REQUEST_LATENCY, BACKEND_LATENCY
 import drivers
+from drivers.scheduler import request_priority
 
-import mysql.connector
 
+aud = "iot.vt77.com"
+logger = logging.getLogger()
 
-config = {
-    "user": settings.DB_USER,
-    "password": settings.DB_PASS,
-    "host": "localhost",
-    "database": settings.DB_NAME,
-    "raise_on_warnings": True,
-}
+# Created on first request, not on import
+tokens = Lazy(lambda: TokenAgentOAuth(aud))
+# Users for verified tokens loaded with auth.backend
+auth = Lazy(lambda: VT77APIAuth(backend, tokens()))
 
-backend.connection = mysql.connector.connect(**config)
+# Services of current app, see create_app
+services = LocalProxy(lambda: current_app.extensions["alice"])
 
-drivers.settings = {
-    'MQTT_HOST' : settings.MQTT_HOST,
-    'MQTT_PREFIX' :settings.MQTT_PREFIX,
-    'BACKEND' : backend
-}
+api = Blueprint("alice", __name__)
 
 
+def token_auth(func):
+    """Bearer token check, verified tokens served from services.token_cache
 
-aud = "iot.vt77.com"
-logging.basicConfig(
-    format="%(asctime)-15s %(process)d %(levelname)s %(name)s %(message)s",
-    stream=sys.stdout,
-    level=logging.DEBUG,
-)
-logger = logging.getLogger()
+    Authorized user stored in flask.g, see get_auth_user
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        header = request.headers.get("Authorization", "")
+        if not header.lower().startswith("bearer "):
+            abort(403)
+        try:
+            g.auth_user = services.token_cache.authorize(header[7:].strip())
+        except ApiAuthError as e:
+            # Backend and DB errors not caught: server error, not forbidden
+            logger.warning("[AUTH]Token rejected: %s", e)
+            abort(403)
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def get_auth_user():
+    """User authorized by token_auth
+
+    Raises:
+        ApiAuthError: user not found
+    """
+    user = g.get("auth_user")
+    if not user:
+        raise ApiAuthError("User not found")
+    return user
+
+
+def load_user(user_id):
+    with BACKEND_LATENCY.time("load_user"):
+        return auth.backend.load_user(user_id)
+
+
+def start_request():
+    g.request_start = time.perf_counter()
 
-app = Flask("alice-backend")
 
-tokens = TokenAgentOAuth(aud)
-auth = VT77APIAuth(backend, tokens)
+def observe_request():
+    """Route latency, teardown hook so failed requests counted too"""
+    start = g.get("request_start")
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_LATENCY.observe(time.perf_counter() - start, route, request.method)
 
-@app.route("/")
+
+def bad_request(request_id, error: DecodeError):
+    """Yandex format error for request body rejected by decoder"""
+    body = encode_body(dict({"request_id": request_id}, **dict(error)))
+    return current_app.response_class(body, status=400, mimetype="application/json")
+
+
+def create_app(config=settings) -> Flask:
+    """Create application
+
+    Backend connections, auth, caches and drivers set up lazily on first
+    use, so app is cheap to create and safe to preload before fork.
+
+    Args:
+        config (optional): settings module or object. Defaults to settings.
+
+    Returns:
+        Flask: application
+    """
+    logging.basicConfig(
+        format="%(asctime)-15s %(process)d %(levelname)s %(name)s %(message)s",
+        stream=sys.stdout,
+        level=getattr(config, "LOG_LEVEL", logging.DEBUG),
+    )
+
+    app_services = Services(
+        config,
+        lambda: backend,
+        # Access token audience bound to token agent, same check as asgi TokenAuth
+        validate_token=lambda token: tokens.validate_token(token),
+        load_user=load_user,
+    )
+    app_services.register_metrics()
+    backend.connection = app_services.connection
+
+    drivers.settings = {
+        'MQTT_HOST' : getattr(config, "MQTT_HOST", None),
+        'MQTT_PREFIX' : getattr(config, "MQTT_PREFIX", None),
+        'BACKEND' : backend
+    }
+    app_services.register_drivers()
+
+    app = Flask("alice-backend")
+    app.extensions["alice"] = app_services
+    app.register_blueprint(api)
+    app.before_request(start_request)
+    # Per process: workers start own feed after fork
+    app.before_request(app_services.start_ingest)
+
+    @app.teardown_request
+    def teardown(exc):
+        observe_request()
+        app_services.release()
+
+    return app
+
+
+def preload():
+    """Prefork server hook (Ex: gunicorn on_starting/when_ready)
+
+    Immutable registries frozen and all objects moved out of GC, so they
+    stay shared copy-on-write between workers.
+    Post fork hooks registered with runtime.on_fork run in every worker.
+    """
+    drivers.freeze_drivers()
+    freeze()
+
+
+@api.route("/")
 def main():
     return "<h1>Yandex Alice integration</h1>"
 
 
-@app.route("/dashboard")
+@api.route("/metrics")
+def metrics():
+    """Prometheus scrape endpoint, restrict access on proxy level"""
+    return current_app.response_class(REGISTRY.render(), content_type=REGISTRY.CONTENT_TYPE)
+
 
+@api.route("/dashboard")
 
-@app.route("/ping")
-@auth.token_auth(aud)
+
+@api.route("/ping")
+@token_auth
 def _ping():
     try:
-        user = auth.get_auth_user()
+        user = get_auth_user()
         return "PONG"
     except ApiAuthError:
         abort(403)
 
-@app.route("/devices", methods=["GET"])
-@auth.token_auth(aud)
+@api.route("/devices", methods=["GET"])
+@token_auth
 def devices_ui():
     return render_template("devices.html", devices=["234234", "sdsdfgdfsg"])
 
 
-@app.route("/v1.0/", methods=["HEAD"])
-@auth.token_auth(aud)
+@api.route("/v1.0/", methods=["HEAD"])
+@token_auth
 def devices_ping():
     try:
-        user = auth.get_auth_user()
+        user = get_auth_user()
         logger.debug("[ROUTE]Ping %s", user.user_id)
         return make_response("OK", 200)
     except ApiAuthError:
@@ -92,118 +208,95 @@ def devices_ping():
         abort(403)
 
 
-@app.route("/v1.0/user/unlink", methods=["GET"])
-@auth.token_auth(aud)
+@api.route("/v1.0/user/unlink", methods=["GET"])
+@token_auth
 def devices_unlink():
     """Called by yandex IoT framework on account unlink"""
     try:
-        user = auth.get_auth_user()
+        user = get_auth_user()
         request_id = request.headers.get("X-Request-Id")
         logger.debug("[ROUTE]Unlink %s", user.user_id)
-        backend.user_unlink(user.user_id)
+        services.backend.user_unlink(user.user_id)
+        services.token_cache.evict_user(user.user_id)
+        services.catalog.invalidate(user.user_id)
+        services.device_lists.invalidate(user.user_id)
         return jsonify({"request_id": request_id})
     except ApiAuthError:
         logger.error("User not authorized")
         abort(403)
 
 
-@app.route("/v1.0/user/devices", methods=["GET"])
-@auth.token_auth(aud)
+@api.route("/v1.0/user/devices", methods=["GET"])
+@token_auth
 def devices_list():
     """Called by yandex IoT framework to list devices
     See : https://yandex.ru/dev/dialogs/smart-home/doc/reference/get-devices.html
     """
 
-    def build_device(
-        device_id, name, description, room, device_type, driver, properties, capabilities, params, device_info
-    ):
-        """Build yandex device object"""
-
-        driver = DriverFactory().get(driver)
-        builder = (
-            YandexDeviceBuilder(device_id, device_type)
-            .with_name(name)
-            .with_room(room)
-            .with_custom_data({'driver':driver.name,'params':params})
-            .with_description(description)
-            .with_properties(properties)
-            .with_capabilities(capabilities)
-            .with_device_info(device_info)
-        )
-        return builder.build()
-
     try:
-        user = auth.get_auth_user()
-        devices = [build_device(**d) for d in backend.load_yandex_devices(user.user_id)]
+        user = get_auth_user()
         request_id = request.headers.get("X-Request-Id")
-        return jsonify(dict(YandexResponse(request_id, devices,user.nickname)))
+        payload, etag = services.device_lists.get(
+            user.user_id,
+            services.catalog.load_yandex_devices(user.user_id),
+            user.nickname,
+            YandexDeviceBuilder.build_many,
+        )
+        if request.if_none_match.contains_weak(etag):
+            response = make_response("", 304)
+        else:
+            response = current_app.response_class(splice_response(request_id, payload), mimetype="application/json")
+        # Weak, body differs by request_id
+        response.set_etag(etag, weak=True)
+        return response
     except ApiAuthError:
         logger.error("User not authorized")
         abort(403)
 
 
-@app.route("/v1.0/user/devices/query", methods=["POST"])
-@auth.token_auth(aud)
+@api.route("/v1.0/user/devices/query", methods=["POST"])
+@token_auth
 def devices_status():
     """Called by yandex IoT framework to get devices status
     See : https://yandex.ru/dev/dialogs/smart-home/doc/reference/post-devices-query.html
     """
     try:
-        user = auth.get_auth_user()
+        user = get_auth_user()
         request_id = request.headers.get("X-Request-Id")
-        data = request.json
-        devices = {d['device_id']:d for d in backend.load_yandex_devices(user.user_id)}
-        ret = []
-        for dev in YandexRequest(data).devices:
-            if dev['id'] in devices:
-                device = devices[dev['id']]
-                builder = (
-                    YandexDeviceBuilder(device.id)
-                    .with_properties(YandexRequest.build_query_request(device.properties))
-                    .with_capabilities(YandexRequest.build_query_request(device.capabilities))
-                )
-                device = builder.build()
-                device.resolve()
-                ret.append(device)
-            else:
-                dev.update(dict(YandexError("DEVICE_NOT_FOUND","Device not found")))
-                ret.append(dev)
-
-        return jsonify(dict(YandexResponse(request_id, ret)))
+        yandex_request = YandexRequest.query(request.get_json(silent=True))
+        devices = services.catalog.load_devices(user.user_id, yandex_request.device_ids)
+        ret = yandex_request.query_devices(devices)
+        services.resolver.resolve(ret)
+        return current_app.response_class(encode_body(YandexResponse(request_id, ret)), mimetype="application/json")
+    except DecodeError as e:
+        logger.warning("[ROUTE]Bad request: %s", e)
+        return bad_request(request_id, e)
     except ApiAuthError:
         logger.error("User not authorized")
         abort(403)
 
 
-@app.route("/v1.0/user/devices/action", methods=["POST"])
-@auth.token_auth(aud)
+@api.route("/v1.0/user/devices/action", methods=["POST"])
+@token_auth
 def devices_action():
     """Called by yandex IoT framework to get devices status
     See : https://yandex.ru/dev/dialogs/smart-home/doc/reference/post-action.html
     """
 
     try:
-        user = auth.get_auth_user()
+        user = get_auth_user()
         request_id = request.headers.get("X-Request-Id")
-        data = request.json
-        devices = {d['device_id']:YandexDevice(**d) for d in backend.load_yandex_devices(user.user_id)}
-        ret = []
-
-        for dev in YandexRequest(data).devices:
-            if dev['id'] in devices:
-                device = devices[dev['id']]
-                builder = (
-                    YandexDeviceBuilder(device.id)
-                    .with_capabilities(YandexRequest.build_action_request(device.capabilities,dev['capabilities']))
-                )
-                # var device : YandexDevice
-                device = builder.build()
-                device.resolve(params={'user':user})
-                ret.append( device )
-            else:
-                dev['action_result'] = dict(YandexError("DEVICE_NOT_FOUND","Device not found"))
-                ret.append(device)
-        return jsonify(dict(YandexResponse(request_id, ret)))
+        yandex_request = YandexRequest.action(request.get_json(silent=True))
+        devices = services.catalog.load_devices(user.user_id, yandex_request.device_ids)
+        ret = yandex_request.action_devices(devices)
+        services.resolver.resolve(ret, params={'user':user, 'priority':request_priority(len(ret))})
+        return current_app.response_class(encode_body(YandexResponse(request_id, ret)), mimetype="application/json")
+    except DecodeError as e:
+        logger.warning("[ROUTE]Bad request: %s", e)
+        return bad_request(request_id, e)
     except ApiAuthError:
         logger.error("User not authorized")
         abort(403)
+
+
+app = create_app()